@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import desempenho
+import relatorio
+
+# --- AGREGADOS MATERIALIZADOS ---
+# Depois da classificação os itens são resumidos uma única vez por dimensão
+# (NCM, CFOP, cClassTrib, CST, status, mês, documento e a chave do laudo
+# agregado), além do resumo de saneamento. Simulação, Dashboard, cruzamento e
+# exportações leem estas tabelas em vez de varrer os itens a cada execução.
+# As somas guardadas não dependem das alíquotas: 'Base Reforma' (Base Líquida
+# x Fator) vira vIBS/vCBS/Carga Projetada na leitura, então trocar IBS/CBS não
+# refaz nada. acrescentar() soma um lote novo ao que já existe (arquivos
+# anexados no app, lotes da auditoria em linha de comando).
+
+DIMENSOES = {
+    'ncm': ['NCM'],
+    'cfop': ['CFOP'],
+    'cclass': ['cClassTrib'],
+    'cst': ['Novo CST'],
+    'status': ['Status'],
+    'mes': ['Mês'],
+    'documento': ['Chave NFe'],
+    'laudo': relatorio.CHAVES_AGREGADO,
+}
+# Carga Atual = ICMS Atual + PIS/COFINS Atual (separados para o simulador da transição)
+SOMAS = ['Itens', 'Valor', 'Carga Atual', 'ICMS Atual', 'PIS/COFINS Atual', 'Base Reforma']
+COLUNAS_ITEM = ['NCM', 'CFOP', 'Produto', 'Chave NFe', 'Mês']
+
+class Agregados:
+    """Tabelas por dimensão (chaves + SOMAS) e resumo de saneamento de um conjunto de itens."""
+    def __init__(self):
+        self.tabelas = {}
+        self.saneamento = pd.DataFrame()
+        self.somas = pd.Series(0.0, index=SOMAS)
+
+    @property
+    def itens(self): return int(self.somas['Itens'])
+
+    def acrescentar(self, df, preparado):
+        """Soma os itens de df; `preparado` é a saída de motor.preparar_auditoria para df."""
+        if df.empty: return
+        with desempenho.etapa('agregacao', itens=len(df)):
+            base = self._base(df, preparado)
+            lote = Agregados()
+            lote.somas = base[SOMAS].sum()
+            lote.tabelas = {nome: base.groupby(chaves, dropna=False, sort=False, observed=True)[SOMAS].sum()
+                            for nome, chaves in DIMENSOES.items() if all(c in base.columns for c in chaves)}
+            # Saneamento: cresce com o cadastro de produtos, não com o volume de itens
+            lote.saneamento = relatorio.resumo_saneamento(base)
+            self.incorporar(lote)
+
+    def incorporar(self, outro):
+        """Soma os agregados de outro conjunto de itens (ex.: calculados numa tarefa em segundo plano)."""
+        self.somas = self.somas + outro.somas
+        for nome, novo in outro.tabelas.items():
+            atual = self.tabelas.get(nome)
+            if atual is not None:
+                novo = pd.concat([atual, novo]).groupby(level=list(range(novo.index.nlevels)), dropna=False, sort=False).sum()
+            self.tabelas[nome] = novo
+        resumo = outro.saneamento
+        if not self.saneamento.empty:
+            resumo = pd.concat([self.saneamento, resumo], ignore_index=True).drop_duplicates(relatorio.COLUNAS_SANEAMENTO_BASE)
+        self.saneamento = resumo.reset_index(drop=True)
+
+    @staticmethod
+    def _base(df, preparado):
+        regras = [c for c in relatorio.COLUNAS_SANEAMENTO_EXTRA if c in preparado.columns]
+        base = pd.concat([df[[c for c in COLUNAS_ITEM if c in df.columns]].reset_index(drop=True),
+                          preparado[regras].reset_index(drop=True)], axis=1)
+        base['Itens'] = 1
+        base['Valor'] = df['Valor'].to_numpy(dtype=float) if 'Valor' in df.columns else 0.0
+        base['Carga Atual'] = preparado['Carga Atual'].to_numpy(dtype=float)
+        zera = preparado['Zera Atual'].to_numpy(dtype=bool)
+        base['ICMS Atual'] = np.where(zera, 0.0, _valores(df, 'vICMS'))
+        base['PIS/COFINS Atual'] = np.where(zera, 0.0, _valores(df, 'vPIS') + _valores(df, 'vCOFINS'))
+        base['Base Reforma'] = preparado['Base Líquida'].to_numpy(dtype=float) * preparado['Fator'].to_numpy(dtype=float)
+        return base
+
+    def tabela(self, dimensao, aliq_ibs, aliq_cbs):
+        """Agregado de uma dimensão (DIMENSOES) com vIBS, vCBS e Carga Projetada nas alíquotas dadas."""
+        atual = self.tabelas.get(dimensao)
+        if atual is None: return pd.DataFrame(columns=DIMENSOES[dimensao] + SOMAS + ['vIBS', 'vCBS', 'Carga Projetada'])
+        t = atual.reset_index()
+        t['Itens'] = t['Itens'].astype('int64')
+        return _projetar(t, aliq_ibs, aliq_cbs)
+
+    def totais(self, aliq_ibs, aliq_cbs):
+        """Somas de todos os itens (dict), com a carga projetada nas alíquotas dadas."""
+        t = _projetar(self.somas.to_frame().T, aliq_ibs, aliq_cbs).iloc[0]
+        return {c: float(v) for c, v in t.items()}
+
+def _valores(df, col):
+    return df[col].to_numpy(dtype=float) if col in df.columns else np.zeros(len(df))
+
+def _projetar(t, aliq_ibs, aliq_cbs):
+    base = t['Base Reforma'].to_numpy(dtype=float)
+    t['vIBS'] = base * aliq_ibs
+    t['vCBS'] = base * aliq_cbs
+    t['Carga Projetada'] = t['vIBS'] + t['vCBS']
+    return t
+
+def de_itens(df, preparado):
+    """Agregados de um DataFrame inteiro."""
+    agregados = Agregados()
+    agregados.acrescentar(df, preparado)
+    return agregados
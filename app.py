@@ -3,9 +3,20 @@ import pandas as pd
 import xml.etree.ElementTree as ET
 import io
 import motor 
-import importlib
 import relatorio
+import agregados
+import cenarios
+import conciliacao
+import tarefas
+import cache
+import desempenho
+import base_regras
 import zipfile
+import os
+import json
+import tempfile
+import uuid
+from collections import deque
 
 # Botão na barra lateral para voltar ao Portal
 with st.sidebar:
@@ -13,9 +24,10 @@ with st.sidebar:
     st.link_button("🏠 Voltar ao Portal Principal", "https://auditoria-fiscal.streamlit.app/")
     st.markdown("---")
 
-# Recarrega módulos auxiliares
-importlib.reload(motor)
-importlib.reload(relatorio)
+# Os módulos auxiliares não são recarregados a cada rerun: as tarefas em segundo
+# plano usam esses módulos enquanto o script roda de novo, e um reload trocaria
+# classes (motor.IndiceNCM), memos e a instrumentação no meio de uma tarefa.
+# Alterações no código desses módulos pedem reinício do servidor.
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
@@ -42,6 +54,11 @@ init_df('df_validador', cols_padrao)
 
 if 'empresa_nome' not in st.session_state: st.session_state.empresa_nome = "Nenhuma Empresa"
 if 'uploader_key' not in st.session_state: st.session_state.uploader_key = 0
+if 'workers_zip' not in st.session_state: st.session_state.workers_zip = os.cpu_count() or 1
+if 'medir_desempenho' not in st.session_state: st.session_state.medir_desempenho = False
+if 'tarefas' not in st.session_state: st.session_state.tarefas = {}  # id da tarefa -> onde o resultado entra
+if 'registros_desempenho' not in st.session_state: st.session_state.registros_desempenho = deque(maxlen=5000)
+if 'id_sessao' not in st.session_state: st.session_state.id_sessao = uuid.uuid4().hex[:8]
 
 def reset_all():
     for key in list(st.session_state.keys()):
@@ -50,6 +67,12 @@ def reset_all():
     st.session_state.empresa_nome = "Nenhuma Empresa"
     st.session_state.uploader_key += 1
     st.session_state.last_sped_m1 = None
+    st.session_state.indice_efd = None
+    st.session_state.pop('classificacao_cache', None)
+    st.session_state.pop('conciliacao_cache', None)
+    for id_tarefa in st.session_state.pop('tarefas', {}): obter_executor().descartar(id_tarefa)
+    st.session_state.tarefas = {}
+    st.session_state.pop('arquivos_lidos', None)
 
 # --- CSS ---
 st.markdown("""
@@ -68,36 +91,35 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # --- CACHE ---
-@st.cache_data
-def carregar_bases(): return motor.carregar_base_legal(), motor.carregar_json_regras()
+@st.cache_resource
+def carregar_bases():
+    # Base de regras compilada (regras.bin, recompilada se alguma fonte mudou). Um só
+    # objeto por servidor, somente leitura: cache_data copiaria a trie a cada sessão/rerun
+    base = base_regras.carregar()
+    try: return base.mapa_ncm, base.indice_cclass, base.versao
+    finally: base.fechar()
 @st.cache_data
 def carregar_tipi_cache(file): return motor.carregar_tipi(file)
-
-def buscar_descricao_tipi(ncm, df_tipi):
-    if df_tipi.empty: return "TIPI não carregada"
-    ncm_limpo = str(ncm).replace('.', '').strip()
-    try:
-        resultado = None
-        if ncm_limpo in df_tipi.index:
-            row = df_tipi.loc[ncm_limpo]
-            if isinstance(row, pd.DataFrame): resultado = row.iloc[0, 0]
-            else: resultado = row.iloc[0]
-        elif len(ncm_limpo) >= 4:
-            posicao = ncm_limpo[:4]
-            if posicao in df_tipi.index:
-                row = df_tipi.loc[posicao]
-                if isinstance(row, pd.DataFrame): resultado = row.iloc[0, 0]
-                else: resultado = row.iloc[0]
-                if resultado: resultado = f"[Posição {posicao}] {resultado}"
-        if pd.isna(resultado) or str(resultado).lower().strip() == 'nan': return "Descrição não encontrada na TIPI"
-        return str(resultado)
-    except: return "Erro ao ler descrição"
-
-def formatar_ncm_pontos(ncm):
-    n = str(ncm).replace('.', '').replace(' ', '').strip()
-    if len(n) == 8: return f"{n[:4]}.{n[4:6]}.{n[6:]}"
-    if len(n) == 4: return f"{n[:2]}.{n[2:]}"
-    return n
+@st.cache_resource
+def obter_cache_leitura():
+    # Compartilhado entre sessões/usuários do mesmo servidor
+    limite = int(os.environ.get('AUDITOR_CACHE_MB', '1024')) * 1024 * 1024
+    return cache.CacheParse(os.environ.get('AUDITOR_CACHE_DIR', '.cache_parse'), limite)
+@st.cache_resource
+def obter_cache_exportacao():
+    # Também compartilhado: as chaves são impressões digitais do conteúdo
+    return cache.CacheExportacao(int(os.environ.get('AUDITOR_EXPORT_MB', '256')) * 1024 * 1024)
+
+@st.cache_resource
+def obter_executor():
+    # Um pool por servidor: as tarefas continuam entre reruns e o estado fica fora do script
+    return tarefas.Executor(int(os.environ.get('AUDITOR_TAREFAS', '2')))
+
+def exportacao_sob_demanda(chave, gerar, *args, **kwargs):
+    """Callable para st.download_button: o arquivo só é gerado no clique e fica
+    no cache de exportações; os argumentos são fixados agora, não no clique."""
+    exportacoes = obter_cache_exportacao()
+    return lambda: exportacoes.obter(chave, lambda: gerar(*args, **kwargs))
 
 def gerar_modelo_excel():
     df_modelo = pd.DataFrame({
@@ -110,96 +132,298 @@ def gerar_modelo_excel():
         df_modelo.to_excel(writer, index=False, sheet_name='Modelo_Importacao')
     return output.getvalue()
 
-def gerar_excel_final_com_links(df_para_excel):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df_para_excel.to_excel(writer, index=False, sheet_name='Classificacao_Fiscal')
-        worksheet = writer.sheets['Classificacao_Fiscal']
-        worksheet.set_column('A:Z', 20) 
-    return output.getvalue()
-
-def criar_link_lei(ncm):
-    ncm_fmt = formatar_ncm_pontos(ncm)
-    link = f"https://www.planalto.gov.br/ccivil_03/leis/lcp/lcp214.htm#:~:text={ncm_fmt}"
-    return f'=HYPERLINK("{link}", "📜 Base Legal")'
-
-def gerar_excel_saneamento(df_v, df_c):
+LIMITE_PREVIA_CONSULTOR = 5000
+LIMITE_PREVIA_TAREFA = 200
+INTERVALO_TAREFAS = 1.0  # segundos entre as atualizações do painel de tarefas
+LIMITE_EXIBICAO_CONCILIACAO = 10000
+# Tipo de operação -> (itens do XML, itens do SPED) na sessão
+PARES_CONCILIACAO = {'SAIDA': ('xml_vendas_df', 'sped_vendas_df'), 'ENTRADA': ('xml_compras_df', 'sped_compras_df')}
+# Quebras do Dashboard (dimensões de agregados.DIMENSOES)
+VISOES_DASHBOARD = {'status': 'Status', 'cclass': 'cClassTrib', 'cst': 'CST', 'ncm': 'NCM', 'cfop': 'CFOP', 'mes': 'Mês'}
+
+def classificar_cadastro(arquivo):
+    """Consultor em lote: lê a planilha em blocos, classifica cada NCM/CFOP distinto
+    uma vez e grava o Excel bloco a bloco. Retorna (linhas, prévia, bytes do Excel),
+    ou None se não houver coluna de NCM."""
+    aviso = st.empty()
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        cols_base = ['NCM', 'CFOP', 'Produto']
-        cols_extra = ['Novo CST', 'cClassTrib', 'DescRegra', 'Status', 'Validação TIPI']
-        
-        if not df_v.empty:
-            cols_presentes = [c for c in cols_base + cols_extra if c in df_v.columns]
-            df_resumo_v = df_v[cols_presentes].groupby(cols_base, as_index=False).first()
-            df_resumo_v['Base Legal (Clique Aqui)'] = df_resumo_v['NCM'].apply(criar_link_lei)
-            df_resumo_v.to_excel(writer, sheet_name='Resumo_Saidas', index=False)
-            writer.sheets['Resumo_Saidas'].set_column('A:Z', 18)
-            writer.sheets['Resumo_Saidas'].set_column('C:C', 40)
-
-        if not df_c.empty:
-            cols_presentes = [c for c in cols_base + cols_extra if c in df_c.columns]
-            df_resumo_c = df_c[cols_presentes].groupby(cols_base, as_index=False).first()
-            df_resumo_c['Base Legal (Clique Aqui)'] = df_resumo_c['NCM'].apply(criar_link_lei)
-            df_resumo_c.to_excel(writer, sheet_name='Resumo_Entradas', index=False)
-            writer.sheets['Resumo_Entradas'].set_column('A:Z', 18)
-            writer.sheets['Resumo_Entradas'].set_column('C:C', 40)
-            
-    return output.getvalue()
+    total, previa = 0, []
+    with relatorio.PlanilhaFluxo(output, largura_coluna=20) as planilha:
+        for bloco in motor.ler_planilha_lotes(arquivo):
+            col_ncm = next((c for c in bloco.columns if 'ncm' in c.lower()), None)
+            col_cfop = next((c for c in bloco.columns if 'cfop' in c.lower()), None)
+            if col_ncm is None: return None
+            with desempenho.etapa('consultor_lote', motor.nome_arquivo(arquivo), len(bloco)):
+                res = motor.consultar_lote(bloco, col_ncm, col_cfop, mapa_lei, indice_cclass, df_tipi, versao_regras)
+                links = relatorio.links_consultor(res['NCM Original'])
+                planilha.escrever('Classificacao_Fiscal', res.join(links['Base Legal (Clique Aqui)']))
+            if total < LIMITE_PREVIA_CONSULTOR: previa.append(res.join(links['Link Conferência (Web)']).head(LIMITE_PREVIA_CONSULTOR - total))
+            total += len(res)
+            aviso.info(f"⏳ {total:,} linhas classificadas...")
+    aviso.empty()
+    return total, pd.concat(previa, ignore_index=True) if previa else pd.DataFrame(columns=motor.COLUNAS_CONSULTOR), output.getvalue()
 
 ns = {'ns': 'http://www.portalfiscal.inf.br/nfe'}
 
-def processar_arquivos_com_barra(arquivos, tipo, is_zip=False):
-    lista = []
+def ler_arquivos(arquivos, tipo, is_zip, workers, cache_leitura, andamento):
+    """Lê XMLs soltos ou ZIPs, passando pelo cache de leitura (uma entrada por XML, solto ou
+    dentro do ZIP), e devolve (DataFrame de itens compacto, ver motor.itens_df; info). Não usa
+    st.*: roda numa tarefa em segundo plano ou no próprio script; andamento e lotes lidos vão
+    para `andamento` (tarefas.Andamento)."""
+    partes = []
+    info = {'empresa': None, 'documentos': 0, 'segundos': 0.0}
     
     if is_zip:
-        barra = st.progress(0, text="⏳ Descompactando e analisando ZIP...")
         for arquivo in arquivos:
+            def atualizar(feitos, total, nome=arquivo.name):
+                andamento.progresso(feitos, total, f"⏳ {nome}: {feitos}/{total} XMLs lidos...")
             try:
-                itens = motor.processar_zip_xml(arquivo, ns)
-                lista.extend(itens)
+                stats, lidos = {}, []
+                with desempenho.etapa('leitura_zip', arquivo.name) as medida:
+                    for df_lote in motor.ler_zip_stream(arquivo, ns, tipo, workers, progresso=atualizar, estatisticas=stats,
+                                                        cache_docs=cache_leitura):
+                        lidos.append(df_lote); andamento.parcial(df_lote)
+                    medida.itens = sum(len(d) for d in lidos)
+                partes.append(motor.juntar_itens(lidos))
+                if info['empresa'] is None: info['empresa'] = stats.get('emitente')
+                info['documentos'] += stats['documentos']; info['segundos'] += stats['segundos']
+            except tarefas.Cancelada: raise
             except: pass
-        barra.empty() 
-        st.toast(f"✅ ZIP Processado! {len(lista)} itens encontrados.", icon="🚀")
         
     else:
+        lote, lidos = motor.LoteItens(), []
         total = len(arquivos)
-        barra = st.progress(0, text="⏳ Iniciando leitura...")
         step = max(1, int(total / 10)) 
         
         for i, arquivo in enumerate(arquivos):
             if i % step == 0:
                 perc = int((i / total) * 100)
-                barra.progress(i / total, text=f"⏳ Processando: {perc}% concluído...")
+                andamento.progresso(i, total, f"⏳ Processando: {perc}% concluído...")
+                if len(lote):  # o que já foi lido vira resultado parcial
+                    lidos.append(lote.df()); andamento.parcial(lidos[-1])
+                    lote = motor.LoteItens()
             
             try:
-                tree = ET.parse(arquivo)
-                if tipo == 'SAIDA' and st.session_state.empresa_nome == "Nenhuma Empresa":
-                    st.session_state.empresa_nome = motor.extrair_nome_empresa_xml(tree, ns)
-                lista.extend(motor.processar_xml_detalhado(tree, ns, tipo))
+                with desempenho.etapa('leitura_xml', arquivo.name) as medida:
+                    emitente, colunas = motor.ler_documento_xml(arquivo, tipo, ns, cache_leitura)
+                    medida.itens = len(colunas[0])
+                if info['empresa'] is None: info['empresa'] = emitente
+                lote.acrescentar_colunas(colunas)
             except: continue
-        barra.empty()
+        lidos.append(lote.df())
+        cache_leitura.despejar()
+        partes.append(motor.juntar_itens(lidos))
         
-    return lista
+    return motor.juntar_itens(partes), info
 
-def auditar_df(df, a_ibs, a_cbs):
-    if df.empty: return df
-    res = df.apply(lambda row: motor.classificar_item(row, mapa_lei, df_regras_json, df_tipi, a_ibs, a_cbs), axis=1, result_type='expand')
-    df[['cClassTrib', 'DescRegra', 'Status', 'Novo CST', 'Origem Legal', 'Validação TIPI', 'Carga Atual', 'Carga Projetada', 'vIBS', 'vCBS']] = res
+class BarraProgresso(tarefas.Andamento):
+    """Andamento de uma leitura feita no próprio script: barra do Streamlit."""
+    def __init__(self, texto): self.barra = st.progress(0, text=texto)
+    def progresso(self, feitos, total=None, texto=None):
+        if total: self.barra.progress(min(feitos / total, 1.0), text=texto)
+
+def avisar_zip(info, n_itens):
+    taxa = info['documentos'] / info['segundos'] if info['segundos'] > 0 else 0.0
+    st.toast(f"✅ ZIP Processado! {n_itens} itens encontrados ({taxa:,.0f} docs/s).", icon="🚀")
+
+def processar_arquivos_com_barra(arquivos, tipo, is_zip=False):
+    """Lê XMLs soltos ou ZIPs no próprio script, com barra de progresso (Validador)."""
+    barra = BarraProgresso("⏳ Descompactando e analisando ZIP..." if is_zip else "⏳ Iniciando leitura...")
+    df, info = ler_arquivos(arquivos, tipo, is_zip, st.session_state.workers_zip, obter_cache_leitura(), barra)
+    barra.barra.empty()
+    if tipo == 'SAIDA' and info['empresa'] and st.session_state.empresa_nome == "Nenhuma Empresa":
+        st.session_state.empresa_nome = info['empresa']
+    if is_zip: avisar_zip(info, len(df))
     return df
 
-def preparar_exibicao(df):
-    cols_ordenadas = ['Cód. Produto', 'Descrição Produto', 'NCM', 'CFOP', 'Novo CST', 'cClassTrib', 'DescRegra', 'Valor', 'vICMS', 'vPIS', 'vCOFINS', 'Carga Atual', 'vIBS', 'vCBS', 'Carga Projetada', 'Validação TIPI']
+def classificar_tarefa(andamento, df, bases):
+    """(df, preparado, agregados) de itens recém-lidos, calculados ainda na tarefa."""
+    if df.empty: return df, None, None
+    andamento.progresso(0, None, f"⚙️ Classificando {len(df):,} itens...")
+    preparado = motor.preparar_auditoria(df, *bases)
+    return df, preparado, agregados.de_itens(df, preparado)
+
+def tarefa_xml(tarefa, arquivos, tipo, is_zip, workers, cache_leitura, bases):
+    """Leitura + classificação de XMLs/ZIPs enviados (roda no executor de tarefas)."""
+    df, info = ler_arquivos(arquivos, tipo, is_zip, workers, cache_leitura, tarefa)
+    if tipo != 'SAIDA': info['empresa'] = None  # o nome da empresa vem das vendas
+    return {**info, 'versao': bases[-1], 'itens': {tipo: classificar_tarefa(tarefa, df, bases)}}
+
+def tarefa_sped(tarefa, sped_file, cache_leitura, bases):
+    """Leitura + classificação do SPED (roda no executor de tarefas)."""
+    chave_sped = cache_leitura.chave(sped_file, contexto=f"sped|{motor.VERSAO_PARSER}")
+    achado = cache_leitura.obter(chave_sped, cache.tamanho_conteudo(sped_file))
+    if achado is not None:
+        df_sped, meta = achado
+        nome, indice_efd = meta['empresa'], meta.get('indice_efd')
+        partes_v = [df_sped[df_sped['Tipo'] == 'SAIDA'].reset_index(drop=True)] if not df_sped.empty else []
+        partes_c = [df_sped[df_sped['Tipo'] != 'SAIDA'].reset_index(drop=True)] if not df_sped.empty else []
+    else:
+        # Cada lote já chega como DataFrame compacto: a lista de dicts nunca passa do tamanho do lote
+        nome, partes_v, partes_c = "Empresa SPED", [], []
+        indice_efd = {}
+        with desempenho.etapa('leitura_sped', sped_file.name) as medida:
+            n_itens = 0
+            for nome, vendas, compras in motor.ler_sped_stream(sped_file, indice=indice_efd):
+                for partes, lote in ((partes_v, vendas), (partes_c, compras)):
+                    if len(lote): partes.append(lote); tarefa.parcial(lote)
+                n_itens += len(vendas) + len(compras)
+                tarefa.progresso(n_itens, None, f"⏳ {n_itens:,} itens lidos do SPED...")
+            medida.itens = n_itens
+        if partes_v or partes_c:
+            cache_leitura.guardar(chave_sped, motor.juntar_itens(partes_v + partes_c), {'empresa': nome, 'indice_efd': indice_efd})
+    vazio = pd.DataFrame(columns=cols_padrao)
+    itens = {tipo: classificar_tarefa(tarefa, motor.juntar_itens(partes) if partes else vazio, bases)
+             for tipo, partes in (('SAIDA', partes_v), ('ENTRADA', partes_c))}
+    return {'empresa': nome, 'indice_efd': indice_efd, 'versao': bases[-1], 'itens': itens}
+
+def classificacao(chave):
+    """(DataFrame, versão das regras, preparado, impressão digital, agregados) de
+    st.session_state[chave]. Tudo o que não depende das alíquotas é calculado
+    uma vez por DataFrame e guardado na sessão."""
+    df = st.session_state[chave]
+    guardados = st.session_state.setdefault('classificacao_cache', {})
+    guardado = guardados.get(chave)
+    # Compara a identidade do próprio objeto: um upload novo substitui o DataFrame da sessão
+    if guardado is None or guardado[0] is not df or guardado[1] != versao_regras:
+        preparado = motor.preparar_auditoria(df, mapa_lei, indice_cclass, df_tipi, versao_regras)
+        guardado = (df, versao_regras, preparado, cache.impressao_df(df), agregados.de_itens(df, preparado))
+        guardados[chave] = guardado
+    return guardado
+
+def anexar_itens(chave, df_novo, preparado_novo=None, agregado_novo=None):
+    """Acrescenta itens de arquivos enviados depois ao DataFrame da sessão. Se ele
+    já estava classificado, só os itens novos passam pela classificação e são
+    somados aos agregados existentes. preparado_novo/agregado_novo: classificação e
+    agregados de df_novo nas regras atuais, quando já calculados numa tarefa."""
+    atual = st.session_state[chave]
+    if df_novo.empty: return
+    guardados = st.session_state.setdefault('classificacao_cache', {})
+    if atual.empty:
+        st.session_state[chave] = df_novo
+        if preparado_novo is not None:
+            guardados[chave] = (df_novo, versao_regras, preparado_novo, cache.impressao_df(df_novo),
+                                agregado_novo if agregado_novo is not None else agregados.de_itens(df_novo, preparado_novo))
+        return
+    df = motor.juntar_itens([atual, df_novo])
+    guardado = guardados.get(chave)
+    if guardado is not None and guardado[0] is atual and guardado[1] == versao_regras:
+        if preparado_novo is None: preparado_novo = motor.preparar_auditoria(df_novo, mapa_lei, indice_cclass, df_tipi, versao_regras)
+        agregado = guardado[4]
+        if agregado_novo is not None: agregado.incorporar(agregado_novo)
+        else: agregado.acrescentar(df_novo, preparado_novo)
+        preparado = pd.concat([guardado[2], preparado_novo.set_axis(df.index[len(atual):])])
+        guardados[chave] = (df, versao_regras, preparado, cache.impressao_df(df), agregado)
+    st.session_state[chave] = df
+
+def enviar_tarefa(rotulo, destinos, funcao, *args, substituir=False):
+    """Põe funcao(tarefa, *args) no executor e registra na sessão em quais DataFrames
+    ({tipo: chave}) o resultado entra; substituir=True troca o conteúdo em vez de anexar."""
+    tarefa = obter_executor().enviar(rotulo, funcao, *args, sinks=sinks)
+    st.session_state.tarefas[tarefa.id] = {'rotulo': rotulo, 'destinos': destinos, 'substituir': substituir}
+
+def carregar_novos(chave, arquivos, tipo):
+    """Manda para uma tarefa em segundo plano só os arquivos do uploader ainda não
+    enviados nesta sessão."""
+    lidos = st.session_state.setdefault('arquivos_lidos', {}).setdefault(chave, set())
+    novos = [a for a in arquivos if a.file_id not in lidos]
+    if not novos: return
+    is_zip = any(a.name.endswith('.zip') for a in novos)
+    rotulo = f"{'ZIP' if is_zip else 'XMLs'} de {'vendas' if tipo == 'SAIDA' else 'compras'} ({len(novos)} arq.)"
+    enviar_tarefa(rotulo, {tipo: chave}, tarefa_xml, novos, tipo, is_zip, st.session_state.workers_zip,
+                  obter_cache_leitura(), (mapa_lei, indice_cclass, df_tipi, versao_regras))
+    lidos.update(a.file_id for a in novos)  # a partir daqui são da tarefa: um rerun não os envia de novo
+
+def recolher_tarefas():
+    """Aplica à sessão o resultado das tarefas que terminaram (True se aplicou algum).
+    Roda no script: só ele mexe em st.session_state."""
+    executor = obter_executor()
+    aplicou = False
+    for id_tarefa, registro in list(st.session_state.tarefas.items()):
+        tarefa = executor.obter(id_tarefa)
+        if tarefa is not None and not tarefa.terminada: continue
+        del st.session_state.tarefas[id_tarefa]
+        if tarefa is None: continue
+        executor.descartar(id_tarefa)
+        if tarefa.estado == tarefas.ERRO: st.toast(f"❌ {registro['rotulo']}: {tarefa.erro}")
+        elif tarefa.estado == tarefas.CANCELADA: st.toast(f"⏹️ {registro['rotulo']}: cancelada.")
+        else:
+            aplicar_resultado(registro, tarefa.resultado)
+            aplicou = True
+    return aplicou
+
+def aplicar_resultado(registro, resultado):
+    mesma_versao = resultado['versao'] == versao_regras  # regras trocadas no meio: classifica de novo
+    for tipo, (df, preparado, agregado) in resultado['itens'].items():
+        chave = registro['destinos'][tipo]
+        if registro['substituir']: st.session_state[chave] = pd.DataFrame(columns=cols_padrao)
+        anexar_itens(chave, df, *((preparado, agregado) if mesma_versao else (None, None)))
+    if 'indice_efd' in resultado:
+        st.session_state.empresa_nome = resultado['empresa']
+        st.session_state.indice_efd = resultado['indice_efd']
+    elif resultado['empresa'] and st.session_state.empresa_nome == "Nenhuma Empresa":
+        st.session_state.empresa_nome = resultado['empresa']
+    if resultado.get('documentos'): avisar_zip(resultado, sum(len(i[0]) for i in resultado['itens'].values()))
+
+@st.fragment(run_every=INTERVALO_TAREFAS)
+def painel_tarefas():
+    """Andamento das tarefas da sessão, atualizado sozinho a cada INTERVALO_TAREFAS
+    segundos. Quando alguma termina, o app inteiro roda de novo para aplicar o resultado."""
+    executor = obter_executor()
+    terminou = False
+    for id_tarefa, registro in list(st.session_state.tarefas.items()):
+        tarefa = executor.obter(id_tarefa)
+        if tarefa is None or tarefa.terminada:
+            terminou = True
+            continue
+        texto = tarefa.texto or ("⏳ Na fila..." if tarefa.estado == tarefas.FILA else "⏳ Iniciando...")
+        st.progress(tarefa.fracao or 0.0, text=f"{registro['rotulo']} · {texto}")
+        parciais = tarefa.parciais()
+        c1, c2 = st.columns([5, 1])
+        c1.caption(f"{sum(len(p) for p in parciais):,} itens lidos até agora")
+        if c2.button("⏹️ Cancelar", key=f"cancelar_{id_tarefa}"): tarefa.cancelar()
+        if parciais:
+            with st.expander("Prévia dos itens já lidos"):
+                st.dataframe(parciais[-1].head(LIMITE_PREVIA_TAREFA), use_container_width=True, hide_index=True)
+    if terminou: st.rerun()
+
+def agregados_sessao(chave):
+    """Agregados materializados de st.session_state[chave] (vazios se não houver itens)."""
+    if st.session_state[chave].empty: return agregados.Agregados()
+    return classificacao(chave)[4]
+
+def conciliacao_sessao(tipo):
+    """Ocorrências da conciliação item a item (conciliacao.COLUNAS) entre o XML e o
+    SPED de um tipo de operação, guardadas enquanto nenhum dos dois lados mudar."""
+    chave_xml, chave_sped = PARES_CONCILIACAO[tipo]
+    xml, sped = st.session_state[chave_xml], st.session_state[chave_sped]
+    guardados = st.session_state.setdefault('conciliacao_cache', {})
+    guardado = guardados.get(tipo)
+    if guardado is None or guardado[0] is not xml or guardado[1] is not sped:
+        with desempenho.etapa('cruzamento', itens=len(xml) + len(sped)):
+            guardado = (xml, sped, conciliacao.conciliar_df(xml, sped, tipo))
+        guardados[tipo] = guardado
+    return guardado[2]
+
+def auditar_df(chave, a_ibs, a_cbs):
+    """Audita o DataFrame guardado em st.session_state[chave].
+    A classificação (que só depende de NCM/CFOP/Tipo e das regras) fica guardada
+    por DataFrame; trocar IBS/CBS refaz apenas a multiplicação vetorizada."""
+    df = st.session_state[chave]
     if df.empty: return df
-    cols_existentes = [c for c in cols_ordenadas if c in df.columns or c == 'Descrição Produto']
-    if 'Produto' in df.columns:
-        return df.rename(columns={'Produto': 'Descrição Produto'})[cols_existentes]
-    return df[cols_existentes]
+    preparado = classificacao(chave)[2]
+    # Só acrescenta colunas: com copy-on-write o concat reaproveita as colunas do upload sem copiá-las
+    return pd.concat([df, preparado[motor.COLUNAS_CLASSIFICACAO + ['Carga Atual']], motor.aplicar_aliquotas(preparado, a_ibs, a_cbs)], axis=1)
+
+def impressao_auditoria(chave, a_ibs, a_cbs):
+    """Identifica o resultado de auditar_df(chave, a_ibs, a_cbs): conteúdo do upload
+    (hash calculado uma vez, junto da classificação) + regras + alíquotas."""
+    guardado = st.session_state.get('classificacao_cache', {}).get(chave)
+    return (guardado[3] if guardado is not None and guardado[0] is st.session_state[chave] else 'vazio', versao_regras, a_ibs, a_cbs)
 
 def converter_df_para_excel(df):
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Resultado')
+    with relatorio.PlanilhaFluxo(output) as planilha: planilha.escrever('Resultado', df)
     return output.getvalue()
 
 # --- SIDEBAR ---
@@ -225,7 +449,7 @@ with st.sidebar:
     st.markdown("#### ⚙️ Parâmetros Fiscais")
     
     if modo_app == "🛡️ Validador XML (Reforma)":
-        val_ibs, val_cbs = 0.1, 0.9 
+        val_ibs, val_cbs = cenarios.ALIQ_TESTE_IBS, cenarios.ALIQ_TESTE_CBS
         st.info("ℹ️ Alíquotas ajustadas para Período de Teste (1.0%)")
     else:
         val_ibs, val_cbs = 17.7, 8.8 
@@ -241,13 +465,45 @@ with st.sidebar:
             carregar_tipi_cache.clear()
             st.rerun()
 
+    with st.expander("🚀 Desempenho"):
+        st.number_input("Processos p/ leitura de ZIP", 1, 64, key='workers_zip', help="Quantidade de processos que leem os XMLs de um ZIP em paralelo.")
+
+    with st.expander("⏱️ Performance"):
+        st.checkbox("Medir etapas", key='medir_desempenho', help="Tempo, itens e memória de cada leitura, classificação, cruzamento e exportação.")
+        gerar_perfil = st.checkbox("Gerar cProfile", disabled=not st.session_state.medir_desempenho)
+        caminho_perfil = os.path.join(tempfile.gettempdir(), f"auditoria_{st.session_state.id_sessao}.prof")
+        painel_desempenho = st.empty()  # preenchido no fim do script, com as etapas desta execução
+    sinks = []  # também vão para as tarefas em segundo plano
+    if st.session_state.medir_desempenho:
+        sinks = [desempenho.SinkMemoria(st.session_state.registros_desempenho)]
+        if os.environ.get('AUDITOR_METRICAS'): sinks.append(desempenho.SinkJSON(os.environ['AUDITOR_METRICAS']))
+        desempenho.configurar(*sinks, perfil=caminho_perfil if gerar_perfil else None)
+    else:
+        desempenho.desligar()
+
+    with st.expander("💾 Cache de Leitura"):
+        stats_cache = obter_cache_leitura().estatisticas()
+        k1, k2 = st.columns(2)
+        k1.metric("Acertos", stats_cache['hits']); k2.metric("Falhas", stats_cache['misses'])
+        st.caption(f"Leitura evitada: {stats_cache['bytes_poupados'] / 1e6:,.1f} MB · "
+                   f"Em disco: {stats_cache['entradas']} arquivos ({stats_cache['bytes_em_disco'] / 1e6:,.1f} MB)")
+        stats_export = obter_cache_exportacao().estatisticas()
+        st.caption(f"Exportações em memória: {stats_export['entradas']} ({stats_export['bytes_em_memoria'] / 1e6:,.1f} MB) · "
+                   f"reaproveitadas {stats_export['hits']}x")
+        if st.button("🧹 Limpar Cache"):
+            obter_cache_leitura().limpar()
+            obter_cache_exportacao().limpar()
+            st.rerun()
+
     st.markdown("<br>", unsafe_allow_html=True)
     if st.button("🗑️ LIMPAR TUDO", type="secondary"):
         reset_all()
         st.rerun()
 
-    mapa_lei, df_regras_json = carregar_bases()
+    mapa_lei, indice_cclass, versao_base = carregar_bases()
     df_tipi = carregar_tipi_cache(uploaded_tipi)
+    versao_regras = motor.versao_regras(mapa_lei, indice_cclass, df_tipi)
+    st.caption(f"📚 Base de regras {versao_base}")
 
 # ==============================================================================
 # MODO 1: AUDITORIA & REFORMA
@@ -261,6 +517,7 @@ if modo_app == "📊 Auditoria & Reforma":
     """, unsafe_allow_html=True)
 
     st.markdown("### 📂 Central de Arquivos")
+    if recolher_tarefas(): st.rerun()  # resultados aplicados: roda de novo com a sessão atualizada
     
     c_saida, c_entrada, c_sped = st.columns(3)
 
@@ -279,38 +536,38 @@ if modo_app == "📊 Auditoria & Reforma":
         sped_file = st.file_uploader("Fiscal ou Contrib.", type=['txt'], accept_multiple_files=False, key=f"s_{st.session_state.uploader_key}", label_visibility="collapsed")
         if sped_file: st.markdown(f'<div class="file-success">✅ SPED OK</div>', unsafe_allow_html=True)
 
-    if vendas_files and st.session_state.xml_vendas_df.empty:
-        tem_zip_v = any(f.name.endswith('.zip') for f in vendas_files)
-        st.session_state.xml_vendas_df = pd.DataFrame(processar_arquivos_com_barra(vendas_files, 'SAIDA', is_zip=tem_zip_v))
-        st.rerun()
-    
-    if compras_files and st.session_state.xml_compras_df.empty:
-        tem_zip_c = any(f.name.endswith('.zip') for f in compras_files)
-        st.session_state.xml_compras_df = pd.DataFrame(processar_arquivos_com_barra(compras_files, 'ENTRADA', is_zip=tem_zip_c))
-        st.rerun()
+    # Leitura e classificação rodam em tarefas em segundo plano; arquivos acrescentados
+    # ao uploader depois viram tarefas próprias e são anexados quando terminam
+    if vendas_files: carregar_novos('xml_vendas_df', vendas_files, 'SAIDA')
+    if compras_files: carregar_novos('xml_compras_df', compras_files, 'ENTRADA')
 
-    if sped_file and st.session_state.get('last_sped_m1') != sped_file.name:
-        with st.spinner("Processando SPED Universal..."):
-            nome, vendas, compras = motor.processar_sped_geral(sped_file)
-            st.session_state.empresa_nome = nome
-            st.session_state.sped_vendas_df = pd.DataFrame(vendas) if vendas else pd.DataFrame(columns=cols_padrao)
-            st.session_state.sped_compras_df = pd.DataFrame(compras) if compras else pd.DataFrame(columns=cols_padrao)
-            st.session_state.last_sped_m1 = sped_file.name
-            st.rerun()
+    if sped_file and st.session_state.get('last_sped_m1') != sped_file.file_id:
+        enviar_tarefa(f"SPED {sped_file.name}", {'SAIDA': 'sped_vendas_df', 'ENTRADA': 'sped_compras_df'}, tarefa_sped,
+                      sped_file, obter_cache_leitura(), (mapa_lei, indice_cclass, df_tipi, versao_regras), substituir=True)
+        st.session_state.last_sped_m1 = sped_file.file_id
 
-    df_xml_v = auditar_df(st.session_state.xml_vendas_df.copy(), aliq_ibs/100, aliq_cbs/100)
-    df_xml_c = auditar_df(st.session_state.xml_compras_df.copy(), aliq_ibs/100, aliq_cbs/100)
-    df_sped_v = auditar_df(st.session_state.sped_vendas_df.copy(), aliq_ibs/100, aliq_cbs/100)
-    df_sped_c = auditar_df(st.session_state.sped_compras_df.copy(), aliq_ibs/100, aliq_cbs/100)
+    if st.session_state.tarefas: painel_tarefas()
+
+    df_xml_v = auditar_df('xml_vendas_df', aliq_ibs/100, aliq_cbs/100)
+    df_xml_c = auditar_df('xml_compras_df', aliq_ibs/100, aliq_cbs/100)
+    df_sped_v = auditar_df('sped_vendas_df', aliq_ibs/100, aliq_cbs/100)
+    df_sped_c = auditar_df('sped_compras_df', aliq_ibs/100, aliq_cbs/100)
 
     df_final_v = df_xml_v if not df_xml_v.empty else df_sped_v
     df_final_c = df_xml_c if not df_xml_c.empty else df_sped_c
+    chave_v = 'xml_vendas_df' if not df_xml_v.empty else 'sped_vendas_df'
+    chave_c = 'xml_compras_df' if not df_xml_c.empty else 'sped_compras_df'
+    chave_exportacao = (impressao_auditoria(chave_v, aliq_ibs, aliq_cbs), impressao_auditoria(chave_c, aliq_ibs, aliq_cbs))
+    # Totais e quebras vêm dos agregados materializados, não de uma nova varredura dos itens
+    agregado_v, agregado_c = agregados_sessao(chave_v), agregados_sessao(chave_c)
+    totais_v, totais_c = agregado_v.totais(aliq_ibs/100, aliq_cbs/100), agregado_c.totais(aliq_ibs/100, aliq_cbs/100)
     tem_dados = not df_final_v.empty or not df_final_c.empty
 
     if tem_dados:
         st.markdown("---")
         abas = ["📤 Saídas", "📥 Entradas", "⚖️ Simulação", "📊 Dashboard"]
-        tem_cruzamento = (not df_xml_v.empty or not df_xml_c.empty) and (not df_sped_v.empty or not df_sped_c.empty)
+        pares_cruzamento = [t for t, par in PARES_CONCILIACAO.items() if all(not st.session_state[c].empty for c in par)]
+        tem_cruzamento = bool(pares_cruzamento)
         if tem_cruzamento: abas.insert(0, "⚔️ Cruzamento XML x SPED")
             
         tabs = st.tabs(abas)
@@ -318,29 +575,54 @@ if modo_app == "📊 Auditoria & Reforma":
         if tem_cruzamento:
             with tabs[abas.index("⚔️ Cruzamento XML x SPED")]:
                 st.markdown("### ⚔️ Auditoria Cruzada")
-                xml_val = df_xml_v.groupby('Chave NFe')['Valor'].sum().reset_index().rename(columns={'Valor':'V_XML'}) if not df_xml_v.empty else pd.DataFrame(columns=['Chave NFe', 'V_XML'])
-                sped_val = df_sped_v.groupby('Chave NFe')['Valor'].sum().reset_index().rename(columns={'Valor':'V_SPED'}) if not df_sped_v.empty else pd.DataFrame(columns=['Chave NFe', 'V_SPED'])
-                cross = pd.merge(xml_val, sped_val, on='Chave NFe', how='outer', indicator=True)
-                so_xml = cross[cross['_merge']=='left_only']
-                div = cross[(cross['_merge']=='both') & (abs(cross['V_XML'] - cross['V_SPED']) > 0.01)]
-                k1, k2 = st.columns(2)
-                k1.metric("Omissão SPED", len(so_xml), delta="Risco Alto", delta_color="inverse")
-                k2.metric("Divergência Valor", len(div), delta="Erro Escrituração", delta_color="inverse")
-                if not so_xml.empty: st.error("🚨 Notas fora do SPED:"); st.dataframe(so_xml)
-                if not div.empty: st.warning("⚠️ Valores divergentes:"); st.dataframe(div)
+                # Conciliação item a item (chave + nº do item), nos dois sentidos
+                tipo_cruz = st.radio("Operação", pares_cruzamento, format_func={'SAIDA': 'Saídas', 'ENTRADA': 'Entradas'}.get, horizontal=True)
+                ocorrencias = conciliacao_sessao(tipo_cruz)
+                contagem = conciliacao.resumir(ocorrencias)
+                k1, k2, k3, k4 = st.columns(4)
+                k1.metric("Notas fora do SPED", int(contagem['Nota fora do SPED']), delta="Risco Alto", delta_color="inverse")
+                k2.metric("Itens fora do SPED", int(contagem['Item fora do SPED']), delta="Omissão", delta_color="inverse")
+                k3.metric("Sem XML", int(contagem['Nota sem XML'] + contagem['Item sem XML']))
+                k4.metric("Divergências", int(contagem[['Produto divergente', 'NCM divergente', 'CFOP divergente', 'Valor divergente']].sum()),
+                          delta="Erro Escrituração", delta_color="inverse")
+                if ocorrencias.empty: st.success("✅ XML e SPED conferem item a item.")
+                else:
+                    filtro = st.selectbox("Ocorrência", ['Todas'] + [o for o in conciliacao.OCORRENCIAS if contagem[o]],
+                                          format_func=lambda o: f"{o} ({contagem[o]:,})" if o in contagem.index else o)
+                    vista = ocorrencias if filtro == 'Todas' else ocorrencias[ocorrencias['Ocorrência'] == filtro]
+                    if len(vista) > LIMITE_EXIBICAO_CONCILIACAO:
+                        st.caption(f"Exibindo {LIMITE_EXIBICAO_CONCILIACAO:,} de {len(vista):,} ocorrências; o Excel traz todas.")
+                    vista = vista.head(LIMITE_EXIBICAO_CONCILIACAO)
+                    st.dataframe(vista, use_container_width=True, hide_index=True)
+                    st.download_button("📥 Baixar ocorrências (Excel)",
+                                       exportacao_sob_demanda(('conciliacao', tipo_cruz) + tuple(classificacao(c)[3] for c in PARES_CONCILIACAO[tipo_cruz]),
+                                                              relatorio.gerar_excel_conciliacao, ocorrencias),
+                                       "Conciliacao_XML_SPED.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+                # Detalhe por nota: o SPED é lido só no trecho do C100 (índice de offsets)
+                indice_efd = st.session_state.get('indice_efd')
+                if not ocorrencias.empty and sped_file and indice_efd:
+                    chave_sel = st.selectbox("🔎 Detalhar nota", vista['Chave NFe'].dropna().unique().tolist())
+                    df_xml_t = df_xml_v if tipo_cruz == 'SAIDA' else df_xml_c
+                    d1, d2 = st.columns(2)
+                    with d1:
+                        st.markdown("**Itens no XML**")
+                        st.dataframe(relatorio.preparar_exibicao(df_xml_t[df_xml_t['Chave NFe'] == chave_sel]), use_container_width=True)
+                    with d2:
+                        st.markdown("**Itens no SPED (C170)**")
+                        st.dataframe(pd.DataFrame(motor.itens_sped_por_chave(sped_file, indice_efd, chave_sel)), use_container_width=True)
 
         with tabs[abas.index("📤 Saídas")]:
-            if not df_final_v.empty: st.dataframe(preparar_exibicao(df_final_v), use_container_width=True)
+            if not df_final_v.empty: st.dataframe(relatorio.preparar_exibicao(df_final_v), use_container_width=True)
             else: st.info("Sem dados de Saída.")
 
         with tabs[abas.index("📥 Entradas")]:
-            if not df_final_c.empty: st.dataframe(preparar_exibicao(df_final_c), use_container_width=True)
+            if not df_final_c.empty: st.dataframe(relatorio.preparar_exibicao(df_final_c), use_container_width=True)
             else: st.info("Sem dados de Entrada.")
 
         with tabs[abas.index("⚖️ Simulação")]:
             st.markdown("### Comparativo")
-            atu = df_final_v['Carga Atual'].sum() if 'Carga Atual' in df_final_v.columns else 0.0
-            nov = df_final_v['Carga Projetada'].sum() if 'Carga Projetada' in df_final_v.columns else 0.0
+            atu, nov = totais_v['Carga Atual'], totais_v['Carga Projetada']
             c1, c2, c3 = st.columns(3)
             c1.metric("Carga Atual", f"R$ {atu:,.2f}")
             c2.metric("Carga Reforma", f"R$ {nov:,.2f}")
@@ -349,40 +631,70 @@ if modo_app == "📊 Auditoria & Reforma":
             try: st.bar_chart(pd.DataFrame({'Cenário':['Atual','Novo'], 'Valor':[float(atu),float(nov)]}).set_index('Cenário')['Valor'])
             except: pass
 
+            st.markdown("### Transição 2026–2033")
+            st.caption("Edite o cronograma (alíquotas em %, fatores = fração do ICMS e do PIS/COFINS que ainda vigora) ou acrescente cenários.")
+            cronograma = st.data_editor(cenarios.cronograma(aliq_ibs, aliq_cbs), hide_index=True, num_rows="dynamic", use_container_width=True)
+            transicao = cenarios.simular(agregado_v, agregado_c, cronograma)
+            if not transicao.empty:
+                st.line_chart(transicao.assign(Ano=transicao['Ano'].astype(int).astype(str)).set_index('Ano')[['Débitos', 'Créditos', 'Saldo']])
+                st.dataframe(transicao, use_container_width=True, hide_index=True)
+                visao_t = st.selectbox("Saldo por ano, quebrado por", ['-'] + list(VISOES_DASHBOARD),
+                                       format_func=lambda v: VISOES_DASHBOARD.get(v, 'Sem quebra'))
+                if visao_t != '-': st.dataframe(cenarios.saldo_por(agregado_v, agregado_c, cronograma, visao_t), use_container_width=True, hide_index=True)
+
         with tabs[abas.index("📊 Dashboard")]:
-            d = df_final_v['Carga Projetada'].sum() if 'Carga Projetada' in df_final_v.columns else 0.0
-            c = df_final_c['Carga Projetada'].sum() if 'Carga Projetada' in df_final_c.columns else 0.0
+            d, c = totais_v['Carga Projetada'], totais_c['Carga Projetada']
             k1, k2, k3 = st.columns(3)
             k1.metric("Débitos", f"R$ {d:,.2f}"); k2.metric("Créditos", f"R$ {c:,.2f}"); k3.metric("Saldo", f"R$ {d-c:,.2f}")
+            visao = st.selectbox("Quebrar por", list(VISOES_DASHBOARD), format_func=VISOES_DASHBOARD.get)
+            chaves_visao = agregados.DIMENSOES[visao]
+            quebra = pd.merge(agregado_v.tabela(visao, aliq_ibs/100, aliq_cbs/100)[chaves_visao + ['Itens', 'Carga Projetada']],
+                              agregado_c.tabela(visao, aliq_ibs/100, aliq_cbs/100)[chaves_visao + ['Itens', 'Carga Projetada']],
+                              on=chaves_visao, how='outer', suffixes=(' Saídas', ' Entradas'))
+            quebra = quebra.rename(columns={'Carga Projetada Saídas': 'Débitos', 'Carga Projetada Entradas': 'Créditos'})
+            quebra = quebra.fillna({c: 0 for c in ['Itens Saídas', 'Débitos', 'Itens Entradas', 'Créditos']}).astype({'Itens Saídas': 'int64', 'Itens Entradas': 'int64'})
+            quebra['Saldo'] = quebra['Débitos'] - quebra['Créditos']
+            if visao == 'mes' and not quebra.empty: st.bar_chart(quebra.set_index('Mês').sort_index()[['Débitos', 'Créditos']])
+            st.dataframe(quebra.sort_values('Débitos', ascending=False), use_container_width=True, hide_index=True)
 
         st.markdown("---")
         st.markdown("### 📥 Exportar Relatórios")
         c1, c2 = st.columns(2)
+        # Arquivos gerados só no clique e guardados por (dados auditados, alíquotas, regras)
         with c1:
-            try:
-                if not df_final_v.empty or not df_final_c.empty:
-                    pdf = relatorio.gerar_pdf_bytes(st.session_state.empresa_nome, df_final_v, df_final_c)
-                    st.download_button("📄 BAIXAR LAUDO PDF", pdf, "Laudo_Auditoria.pdf", "application/pdf", use_container_width=True)
-            except: st.error("Erro PDF")
+            modo_pdf = st.radio("Itens no laudo", list(relatorio.MODOS_PDF), format_func=relatorio.MODOS_PDF.get, horizontal=True)
+            if modo_pdf == 'agregado':
+                laudo_v, laudo_c = agregado_v.tabela('laudo', aliq_ibs/100, aliq_cbs/100), agregado_c.tabela('laudo', aliq_ibs/100, aliq_cbs/100)
+            else: laudo_v, laudo_c = df_final_v, df_final_c
+            st.download_button("📄 BAIXAR LAUDO PDF",
+                               exportacao_sob_demanda(('pdf', st.session_state.empresa_nome, modo_pdf) + chave_exportacao, relatorio.gerar_pdf_bytes,
+                                                      st.session_state.empresa_nome, laudo_v, laudo_c,
+                                                      totais=(totais_v['Carga Projetada'], totais_c['Carga Projetada']),
+                                                      versao_regras=versao_regras, modo=modo_pdf),
+                               "Laudo_Auditoria.pdf", "application/pdf", use_container_width=True)
         with c2:
-            buf = io.BytesIO()
-            with pd.ExcelWriter(buf, engine='openpyxl') as writer:
-                if not df_final_v.empty: preparing_df = preparar_exibicao(df_final_v); preparing_df.to_excel(writer, sheet_name="Saidas", index=False)
-                if not df_final_c.empty: preparing_df = preparar_exibicao(df_final_c); preparing_df.to_excel(writer, sheet_name="Entradas", index=False)
-            st.download_button("📊 BAIXAR DADOS COMPLETOS", buf, "Auditoria_Dados_Completos.xlsx", "primary", use_container_width=True)
+            # Acima do limite de linhas o Excel é dividido em abas; CSV/Parquet (.zip) não têm limite
+            maior = max(len(df_final_v), len(df_final_c))
+            formato = st.radio("Formato dos dados completos", list(relatorio.FORMATOS_EXPORTACAO), horizontal=True,
+                               index=0 if maior < relatorio.LIMITE_LINHAS_EXCEL else 1,
+                               format_func={'xlsx': 'Excel', 'csv': 'CSV (.zip)', 'parquet': 'Parquet (.zip)'}.get)
+            if formato == 'xlsx' and maior >= relatorio.LIMITE_LINHAS_EXCEL:
+                st.caption("⚠️ Mais linhas que uma aba do Excel comporta: os dados continuam em abas \"(2)\", \"(3)\"...")
+            extensao, mime = relatorio.FORMATOS_EXPORTACAO[formato]
+            st.download_button("📊 BAIXAR DADOS COMPLETOS",
+                               exportacao_sob_demanda(('dados_completos', formato) + chave_exportacao, relatorio.gerar_dados_completos, df_final_v, df_final_c, formato),
+                               f"Auditoria_Dados_Completos.{extensao}", mime, type="primary", use_container_width=True)
             
             st.markdown("<div style='height: 10px'></div>", unsafe_allow_html=True)
             
-            if not df_final_v.empty or not df_final_c.empty:
-                excel_resumo = gerar_excel_saneamento(df_final_v, df_final_c)
-                st.download_button(
-                    "📉 BAIXAR RESUMO (Saneamento)", 
-                    excel_resumo, 
-                    "Resumo_Saneamento_Cadastro.xlsx", 
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-                    use_container_width=True,
-                    help="Baixa lista consolidada por NCM/Produto com link para a lei (ideal para atualização de ERP)."
-                )
+            st.download_button(
+                "📉 BAIXAR RESUMO (Saneamento)", 
+                exportacao_sob_demanda(('excel_saneamento',) + chave_exportacao, relatorio.gerar_excel_saneamento, agregado_v.saneamento, agregado_c.saneamento),
+                "Resumo_Saneamento_Cadastro.xlsx", 
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
+                use_container_width=True,
+                help="Baixa lista consolidada por NCM/Produto com link para a lei (ideal para atualização de ERP)."
+            )
 
 # ==============================================================================
 # MODO 2: CONSULTOR (COSMOS NA TELA + LC 214 NO EXCEL)
@@ -406,10 +718,10 @@ elif modo_app == "🔍 Consultor de Classificação":
         if st.button("🔍 Consultar Regra", type="primary"):
             if ncm_input:
                 ncm_limpo = ncm_input.replace('.', '').strip()
-                ncm_formatado_pontos = formatar_ncm_pontos(ncm_limpo)
-                desc_tipi = buscar_descricao_tipi(ncm_limpo, df_tipi)
+                ncm_formatado_pontos = relatorio.formatar_ncm_pontos(ncm_limpo)
+                desc_tipi = df_tipi.descricao(ncm_limpo)
                 row_simulada = {'NCM': ncm_limpo, 'CFOP': cfop_input if cfop_input else '5102', 'Valor': 100.00, 'vICMS': 0, 'vPIS': 0, 'vCOFINS': 0}
-                resultado = motor.classificar_item(row_simulada, mapa_lei, df_regras_json, df_tipi, aliq_ibs/100, aliq_cbs/100)
+                resultado = motor.classificar_item(row_simulada, mapa_lei, indice_cclass, df_tipi, aliq_ibs/100, aliq_cbs/100)
                 cClass, desc_regra, status, novo_cst, origem_legal = resultado[0], resultado[1], resultado[2], resultado[3], resultado[4]
                 
                 st.markdown("---")
@@ -444,42 +756,19 @@ elif modo_app == "🔍 Consultor de Classificação":
         
         if uploaded_lote:
             try:
-                if uploaded_lote.name.endswith('.csv'): df_lote = pd.read_csv(uploaded_lote, sep=';', dtype=str)
-                else: df_lote = pd.read_excel(uploaded_lote, dtype=str)
-                col_ncm = next((c for c in df_lote.columns if 'ncm' in c.lower()), None)
-                col_cfop = next((c for c in df_lote.columns if 'cfop' in c.lower()), None)
+                # Resultado guardado por upload: reruns não reclassificam nem regravam o Excel
+                chave_lote = (uploaded_lote.file_id, versao_regras)
+                guardado = st.session_state.get('consultor_lote')
+                if guardado is None or guardado[0] != chave_lote:
+                    guardado = (chave_lote, classificar_cadastro(uploaded_lote))
+                    st.session_state['consultor_lote'] = guardado
+                resultado = guardado[1]
                 
-                if col_ncm:
-                    st.success(f"Processando {len(df_lote)} linhas...")
-                    resultados_lote = []
-                    prog_bar = st.progress(0)
-                    total = len(df_lote)
-                    for idx, row in df_lote.iterrows():
-                        ncm_val = str(row[col_ncm])
-                        cfop_val = str(row[col_cfop]) if col_cfop and pd.notna(row[col_cfop]) else "5102"
-                        ncm_limpo = ncm_val.replace('.', '').strip()
-                        ncm_formatado_pontos = formatar_ncm_pontos(ncm_limpo)
-                        row_sim = {'NCM': ncm_val, 'CFOP': cfop_val, 'Valor': 100.0, 'vICMS':0, 'vPIS':0, 'vCOFINS':0}
-                        res = motor.classificar_item(row_sim, mapa_lei, df_regras_json, df_tipi, aliq_ibs/100, aliq_cbs/100)
-                        desc_tipi = buscar_descricao_tipi(ncm_val, df_tipi)
-                        
-                        link_lei = f"https://www.planalto.gov.br/ccivil_03/leis/lcp/lcp214.htm#:~:text={ncm_formatado_pontos}"
-                        formula_excel = f'=HYPERLINK("{link_lei}", "📜 Base Legal")'
-                        link_cosmos = f"https://cosmos.bluesoft.com.br/ncms/{ncm_limpo}"
-                        
-                        resultados_lote.append({
-                            'NCM Original': ncm_val, 'CFOP': cfop_val, 'Descrição TIPI': desc_tipi,
-                            'Novo CST': res[3], 'cClassTrib': res[0], 'Regra Aplicada': res[1],
-                            'Status Tributário': res[2], 
-                            'Link Conferência (Web)': link_cosmos, 
-                            'Base Legal (Clique Aqui)': formula_excel 
-                        })
-                        if idx % 10 == 0: prog_bar.progress((idx + 1) / total)
-                    prog_bar.empty()
-                    df_resultado = pd.DataFrame(resultados_lote)
-                    st.dataframe(df_resultado.drop(columns=['Base Legal (Clique Aqui)']), column_config={"Link Conferência (Web)": st.column_config.LinkColumn("🔍 Tira-Teima", display_text="Ver Produto")})
-                    df_export = df_resultado.drop(columns=['Link Conferência (Web)'])
-                    excel_data = gerar_excel_final_com_links(df_export)
+                if resultado is not None:
+                    total, df_previa, excel_data = resultado
+                    st.success(f"{total:,} linhas processadas.")
+                    if total > len(df_previa): st.caption(f"Mostrando as primeiras {len(df_previa):,} linhas; o Excel traz todas.")
+                    st.dataframe(df_previa, column_config={"Link Conferência (Web)": st.column_config.LinkColumn("🔍 Tira-Teima", display_text="Ver Produto")})
                     st.download_button(label="📥 Baixar Resultado (Excel Profissional)", data=excel_data, file_name="Resultado_Classificacao.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
                 else: st.error("Não encontrei a coluna 'NCM'. Verifique o cabeçalho.")
             except Exception as e: st.error(f"Erro ao processar arquivo: {e}")
@@ -501,69 +790,54 @@ elif modo_app == "🛡️ Validador XML (Reforma)":
         if st.session_state.df_validador.empty:
             if tem_zip:
                 zip_files = [f for f in uploaded_xmls if f.name.endswith('.zip')]
-                st.session_state.df_validador = pd.DataFrame(processar_arquivos_com_barra(zip_files, 'SAIDA', is_zip=True))
+                st.session_state.df_validador = processar_arquivos_com_barra(zip_files, 'SAIDA', is_zip=True)
             else:
-                st.session_state.df_validador = pd.DataFrame(processar_arquivos_com_barra(uploaded_xmls, 'SAIDA', is_zip=False))
+                st.session_state.df_validador = processar_arquivos_com_barra(uploaded_xmls, 'SAIDA', is_zip=False)
             st.rerun()
     if not st.session_state.df_validador.empty:
-        df_auditado = auditar_df(st.session_state.df_validador.copy(), aliq_ibs/100, aliq_cbs/100)
-        divergencias = []
-        corretos = []
-        prog_bar = st.progress(0, text="🔍 Confrontando XML vs Regras...")
-        total_rows = len(df_auditado)
-        for idx, row in df_auditado.iterrows():
-            xml_ibs = row.get('XML_vIBS', 0.0); xml_class = str(row.get('XML_cClass', '')).strip()
-            sys_ibs = row.get('vIBS', 0.0); sys_class = str(row.get('cClassTrib', '')).strip()
-            
-            xml_cbs = row.get('XML_vCBS', 0.0) 
-            sys_cbs = row.get('vCBS', 0.0)     
-            
-            status_class = "✅ OK" if xml_class == sys_class else "❌ Divergente"
-            diff_ibs = abs(xml_ibs - sys_ibs)
-            status_valor = "✅ OK" if diff_ibs < 0.05 else "❌ Valor Diferente"
-            
-            item = {
-                'Chave NFe': row['Chave NFe'], 'Num NFe': row['Num NFe'], 'Produto': row['Produto'], 'NCM': row['NCM'],
-                'Valor Produto': row.get('Valor', 0.0), 
-                'cClass XML': xml_class, 'cClass Sistema': sys_class, 
-                'vIBS XML': xml_ibs, 'vIBS Sistema': sys_ibs,
-                'vCBS XML': xml_cbs, 'vCBS Sistema': sys_cbs, 
-                'Status Classif.': status_class, 'Status Valor': status_valor
-            }
-            
-            if status_class == "❌ Divergente" or status_valor == "❌ Valor Diferente":
-                sugestoes = []
-                if status_class == "❌ Divergente": sugestoes.append(f"Alterar cClass de '{xml_class}' para '{sys_class}'")
-                if status_valor == "❌ Valor Diferente": sugestoes.append(f"Ajustar IBS p/ {sys_ibs:.2f} e CBS p/ {sys_cbs:.2f}")
-                item['Recomendação / Esperado'] = " | ".join(sugestoes)
-                divergencias.append(item)
-            else:
-                item['Recomendação / Esperado'] = "Nenhuma ação necessária"
-                corretos.append(item)
-                
-            if idx % 10 == 0: prog_bar.progress((idx + 1) / total_rows)
-        prog_bar.empty()
+        with st.expander("⚖️ Tolerâncias"):
+            t1, t2 = st.columns(2)
+            with t1: tol_ibs = st.number_input("vIBS (R$)", 0.0, 100.0, motor.TOLERANCIA_VALIDADOR, 0.01, key='tol_ibs')
+            with t2: tol_cbs = st.number_input("vCBS (R$)", 0.0, 100.0, motor.TOLERANCIA_VALIDADOR, 0.01, key='tol_cbs')
+        # Resultado e planilha guardados enquanto o upload e os parâmetros não mudarem
+        df_val = st.session_state.df_validador
+        parametros = (versao_regras, aliq_ibs, aliq_cbs, tol_ibs, tol_cbs)
+        guardado = st.session_state.get('validacao_cache')
+        if guardado is None or guardado[0] is not df_val or guardado[1] != parametros:
+            df_auditado = auditar_df('df_validador', aliq_ibs/100, aliq_cbs/100)
+            with desempenho.etapa('validacao', itens=len(df_auditado)):
+                df_div, df_corr = motor.validar_tags(df_auditado, tol_ibs, tol_cbs)
+            guardado = (df_val, parametros, df_div, df_corr, relatorio.gerar_excel_validacao(df_div, df_corr))
+            st.session_state['validacao_cache'] = guardado
+        _, _, df_div, df_corr, excel_validacao = guardado
         st.divider()
         k1, k2, k3 = st.columns(3)
-        k1.metric("Total Notas Analisadas", total_rows); k2.metric("XMLs Corretos", len(corretos)); k3.metric("Com Divergência", len(divergencias), delta_color="inverse")
-        
-        df_div = pd.DataFrame(divergencias) if divergencias else pd.DataFrame()
-        df_corr = pd.DataFrame(corretos) if corretos else pd.DataFrame()
+        k1.metric("Total Notas Analisadas", len(df_div) + len(df_corr)); k2.metric("XMLs Corretos", len(df_corr)); k3.metric("Com Divergência", len(df_div), delta_color="inverse")
         
         if not df_div.empty:
-            st.error(f"🚨 Encontramos {len(divergencias)} itens com divergência na tag de Reforma!")
+            st.error(f"🚨 Encontramos {len(df_div)} itens com divergência na tag de Reforma!")
             st.dataframe(df_div)
         else: 
             st.success("🎉 Parabéns! Todos os XMLs analisados estão em conformidade com as regras do sistema.")
             
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            if not df_div.empty:
-                df_div.to_excel(writer, index=False, sheet_name='Divergentes')
-                writer.sheets['Divergentes'].set_column('A:N', 18)
-            if not df_corr.empty:
-                df_corr.to_excel(writer, index=False, sheet_name='Corretos')
-                writer.sheets['Corretos'].set_column('A:N', 18)
-        st.download_button("📥 Baixar Relatório de Validação XML", output.getvalue(), "Relatorio_Validacao_XML.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-
+        st.download_button("📥 Baixar Relatório de Validação XML", excel_validacao, "Relatorio_Validacao_XML.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
+# ==============================================================================
+# PAINEL DE PERFORMANCE
+# ==============================================================================
+if st.session_state.medir_desempenho:
+    registros = list(st.session_state.registros_desempenho)
+    with painel_desempenho.container():
+        if not registros: st.caption("Nenhuma etapa medida ainda.")
+        else:
+            st.dataframe(desempenho.resumir(registros), hide_index=True, use_container_width=True)
+            por_arquivo = pd.DataFrame([r for r in registros if r['arquivo']])
+            if not por_arquivo.empty:
+                st.caption("Arquivos mais lentos")
+                st.dataframe(por_arquivo.nlargest(10, 'segundos')[['etapa', 'arquivo', 'itens', 'segundos', 'memoria_mb']], hide_index=True, use_container_width=True)
+            st.download_button("📥 Métricas (JSON)", "\n".join(json.dumps(r, ensure_ascii=False) for r in registros), "metricas_auditoria.jsonl", "application/json")
+            if gerar_perfil and os.path.exists(caminho_perfil):
+                with open(caminho_perfil, 'rb') as f: st.download_button("📥 cProfile (.prof)", f.read(), "auditoria.prof")
+            if st.button("🧹 Limpar Métricas"):
+                st.session_state.registros_desempenho.clear()
+                st.rerun()
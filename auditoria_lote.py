@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import sys
+import time
+import pandas as pd
+import motor
+import relatorio
+import agregados
+import cenarios
+import desempenho
+import base_regras
+
+# --- AUDITORIA EM LOTE (SEM STREAMLIT) ---
+# Mesmo fluxo do app (leitura -> classificação -> exportação), mas lendo pastas
+# do servidor em fluxo: os itens passam em lotes de `tamanho_lote`, cada lote é
+# auditado e gravado, e só a amostra do PDF e os agregados (agregados.py: totais
+# por dimensão e resumo de saneamento, somados lote a lote) ficam em memória.
+# Uso: python -m motor audit --saidas pasta/ --sped efd.txt --destino resultado/
+#      python -m motor build-rules [--texto anexos_lc214.txt]  (recompila regras.bin)
+
+NS = {'ns': motor.NS_NFE}
+EXTENSOES_XML = ('.xml', '.zip')
+EXTENSOES_SPED = ('.txt',)
+TIPOS = {'SAIDA': 'Saidas', 'ENTRADA': 'Entradas'}
+FORMATOS = ('xlsx', 'parquet', 'csv', 'pdf')
+FORMATOS_PADRAO = ('xlsx', 'parquet', 'pdf')
+MODOS_PDF = ('amostra', 'agregado')  # 'completo' exigiria guardar todos os itens
+
+def listar_arquivos(caminhos, extensoes):
+    """Arquivos com as extensões dadas, percorrendo pastas recursivamente (ordem alfabética)."""
+    arquivos = []
+    for caminho in caminhos or []:
+        if os.path.isdir(caminho):
+            for raiz, pastas, nomes in os.walk(caminho):
+                pastas.sort()
+                arquivos.extend(os.path.join(raiz, n) for n in sorted(nomes) if n.lower().endswith(extensoes))
+        elif os.path.isfile(caminho):
+            arquivos.append(caminho)
+        else:
+            raise FileNotFoundError(caminho)
+    return arquivos
+
+def lotes_xml(arquivos, tipo, info, tamanho_lote=50000, workers=None):
+    """Gera DataFrames de até `tamanho_lote` itens a partir de XMLs soltos e ZIPs."""
+    partes, soltos = [], motor.LoteItens()  # lotes prontos (ZIP) e itens de XMLs soltos ainda em colunas
+    def acumulados(): return sum(len(p) for p in partes) + len(soltos)
+    def juntar():
+        return motor.juntar_itens(partes + ([soltos.df()] if len(soltos) else []))
+    for arquivo in arquivos:
+        if arquivo.lower().endswith('.zip'):
+            stats = {}
+            try:
+                for df in motor.ler_zip_stream(arquivo, NS, tipo, workers=workers, estatisticas=stats):
+                    if len(soltos): partes.append(soltos.df()); soltos = motor.LoteItens()  # mantém a ordem dos arquivos
+                    partes.append(df)
+                    if acumulados() >= tamanho_lote:
+                        yield juntar(); partes = []
+            except Exception as e:  # ZIP corrompido: os lotes já entregues ficam
+                info['erros'].append(f"{arquivo}: {e}")
+                continue
+            if tipo == 'SAIDA' and not info.get('empresa'): info['empresa'] = stats.get('emitente')
+        else:
+            try:
+                with desempenho.etapa('leitura_xml', arquivo) as medida:
+                    emitente, itens = motor.processar_xml_stream(arquivo, tipo, NS)
+                    medida.itens = len(itens)
+            except Exception as e:
+                info['erros'].append(f"{arquivo}: {e}")
+                continue
+            if tipo == 'SAIDA' and not info.get('empresa'): info['empresa'] = emitente
+            soltos.acrescentar(itens)
+            if acumulados() >= tamanho_lote:
+                yield juntar(); partes, soltos = [], motor.LoteItens()
+    if acumulados(): yield juntar()
+
+def lotes_sped(arquivos, tipos, info, tamanho_lote=50000):
+    """Gera (tipo, DataFrame) a partir de arquivos SPED, só para os tipos pedidos."""
+    for arquivo in arquivos:
+        for nome, vendas, compras in motor.ler_sped_stream(arquivo, tamanho_lote):
+            if not info.get('empresa'): info['empresa'] = nome
+            if len(vendas) and 'SAIDA' in tipos: yield 'SAIDA', vendas
+            if len(compras) and 'ENTRADA' in tipos: yield 'ENTRADA', compras
+
+class _Destinos:
+    """Grava os lotes auditados nos formatos pedidos e acumula o que o PDF e o resumo precisam."""
+    def __init__(self, destino, formatos, versoes, aliquotas, modo_pdf='amostra'):
+        os.makedirs(destino, exist_ok=True)
+        self.destino = destino
+        self.formatos = formatos
+        self.versoes = versoes
+        self.aliquotas = aliquotas  # (IBS, CBS): os agregados guardam somas independentes delas
+        self.modo_pdf = modo_pdf
+        self.arquivos = {}
+        self.planilha = None
+        self.parquet = {}
+        self.csv = {}
+        self.amostras = {t: [] for t in TIPOS}
+        self.agregados = {t: agregados.Agregados() for t in TIPOS}
+        self.itens = {t: 0 for t in TIPOS}
+        if 'xlsx' in formatos:
+            self.arquivos['xlsx'] = os.path.join(destino, 'Auditoria_Dados_Completos.xlsx')
+            self.planilha = relatorio.PlanilhaFluxo(self.arquivos['xlsx'])
+
+    def gravar(self, tipo, df, preparado):
+        """df: itens auditados; preparado: saída de motor.preparar_auditoria para os mesmos itens."""
+        self.itens[tipo] += len(df)
+        self.agregados[tipo].acrescentar(df, preparado)
+        if self.planilha is not None: self.planilha.escrever(TIPOS[tipo], relatorio.preparar_exibicao(df))
+        if 'parquet' in self.formatos: self._gravar_parquet(tipo, df)
+        if 'csv' in self.formatos: self._gravar_csv(tipo, df)
+        faltam = relatorio.LIMITE_AMOSTRA_PDF - sum(len(a) for a in self.amostras[tipo])
+        if faltam > 0 and self.modo_pdf == 'amostra': self.amostras[tipo].append(df.head(faltam))
+
+    def _gravar_parquet(self, tipo, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if tipo not in self.parquet:
+            caminho = os.path.join(self.destino, f'Auditoria_{TIPOS[tipo]}.parquet')
+            tabela = pa.Table.from_pandas(df, schema=relatorio.esquema_arrow(df), preserve_index=False)
+            # Versão das regras fica nos metadados do arquivo
+            tabela = tabela.replace_schema_metadata({**(tabela.schema.metadata or {}),
+                                                     **{k.encode(): v.encode() for k, v in self.versoes.items()}})
+            self.parquet[tipo] = pq.ParquetWriter(caminho, tabela.schema)
+            self.arquivos[f'parquet_{TIPOS[tipo].lower()}'] = caminho
+        else:
+            # Lotes seguintes seguem o esquema do primeiro (colunas ausentes viram nulas)
+            escritor = self.parquet[tipo]
+            tabela = pa.Table.from_pandas(df.reindex(columns=escritor.schema.names), schema=escritor.schema, preserve_index=False)
+        self.parquet[tipo].write_table(tabela)
+
+    def _gravar_csv(self, tipo, df):
+        # Mesmas colunas do .xlsx; ';' e vírgula decimal como o Excel pt-BR abre
+        df = relatorio.preparar_exibicao(df)
+        if tipo not in self.csv:
+            caminho = os.path.join(self.destino, f'Auditoria_{TIPOS[tipo]}.csv')
+            self.csv[tipo] = (open(caminho, 'w', encoding='utf-8-sig', newline=''), list(df.columns))
+            self.arquivos[f'csv_{TIPOS[tipo].lower()}'] = caminho
+            df.head(0).to_csv(self.csv[tipo][0], sep=';', index=False, lineterminator='\r\n')
+        arquivo, colunas = self.csv[tipo]
+        df.reindex(columns=colunas).to_csv(arquivo, sep=';', decimal=',', index=False, header=False, lineterminator='\r\n')
+
+    def _juntar(self, partes):
+        return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+
+    def carga(self, tipo):
+        return self.agregados[tipo].totais(*self.aliquotas)['Carga Projetada']
+
+    def fechar(self, empresa):
+        if self.planilha is not None: self.planilha.fechar()
+        for escritor in self.parquet.values(): escritor.close()
+        for arquivo, _ in self.csv.values(): arquivo.close()
+        resumo_v, resumo_c = self.agregados['SAIDA'].saneamento, self.agregados['ENTRADA'].saneamento
+        if 'xlsx' in self.formatos and (not resumo_v.empty or not resumo_c.empty):
+            self.arquivos['saneamento'] = os.path.join(self.destino, 'Resumo_Saneamento_Cadastro.xlsx')
+            with open(self.arquivos['saneamento'], 'wb') as f: f.write(relatorio.gerar_excel_saneamento(resumo_v, resumo_c))
+        if 'pdf' in self.formatos:
+            self.arquivos['pdf'] = os.path.join(self.destino, 'Laudo_Auditoria.pdf')
+            if self.modo_pdf == 'agregado': itens = [self.agregados[t].tabela('laudo', *self.aliquotas) for t in TIPOS]
+            else: itens = [self._juntar(self.amostras[t]) for t in TIPOS]
+            pdf = relatorio.gerar_pdf_bytes(empresa, *itens, totais=(self.carga('SAIDA'), self.carga('ENTRADA')),
+                                            versao_regras=self.versoes['versao_regras'], modo=self.modo_pdf)
+            with open(self.arquivos['pdf'], 'wb') as f: f.write(pdf)
+
+def auditar_arquivos(saidas=None, entradas=None, sped=None, aliq_ibs=0.177, aliq_cbs=0.088, destino='resultado_auditoria',
+                     formatos=FORMATOS_PADRAO, tipi=None, empresa=None, tamanho_lote=50000, workers=None, progresso=None,
+                     regras=base_regras.ARQUIVO_PADRAO, modo_pdf='amostra'):
+    """Audita pastas/arquivos e grava os resultados em `destino`.
+    Como no app, cada tipo vem dos XMLs quando houver, senão do SPED.
+    progresso(tipo, itens_acumulados) é chamado a cada lote; modo_pdf em MODOS_PDF. Retorna um resumo (dict)."""
+    inicio = time.perf_counter()
+    arquivos_xml = {'SAIDA': listar_arquivos(saidas, EXTENSOES_XML), 'ENTRADA': listar_arquivos(entradas, EXTENSOES_XML)}
+    arquivos_sped = listar_arquivos(sped, EXTENSOES_SPED)
+    tipos_sped = [t for t in TIPOS if not arquivos_xml[t]]
+
+    base = base_regras.carregar(regras)
+    mapa_lei, indice_cclass, versao_base = base.mapa_ncm, base.indice_cclass, base.versao
+    base.fechar()
+    df_tipi = motor.carregar_tipi(tipi)
+    versao = motor.versao_regras(mapa_lei, indice_cclass, df_tipi)
+
+    info = {'empresa': empresa, 'erros': []}
+    if arquivos_sped and not tipos_sped:
+        info['erros'].append(f"{', '.join(arquivos_sped)}: SPED ignorado (saídas e entradas vieram dos XMLs)")
+    saida = _Destinos(destino, formatos, {'base_regras': versao_base, 'versao_regras': versao}, (aliq_ibs, aliq_cbs), modo_pdf)
+
+    def lotes():
+        for tipo in TIPOS:
+            for df in lotes_xml(arquivos_xml[tipo], tipo, info, tamanho_lote, workers): yield tipo, df
+        if arquivos_sped and tipos_sped:
+            yield from lotes_sped(arquivos_sped, tipos_sped, info, tamanho_lote)
+
+    for tipo, df in lotes():
+        if df.empty: continue
+        preparado = motor.preparar_auditoria(df, mapa_lei, indice_cclass, df_tipi, versao)
+        auditado = pd.concat([df, preparado[motor.COLUNAS_CLASSIFICACAO + ['Carga Atual']],
+                              motor.aplicar_aliquotas(preparado, aliq_ibs, aliq_cbs)], axis=1)
+        saida.gravar(tipo, auditado, preparado)
+        if progresso: progresso(tipo, saida.itens[tipo])
+
+    nome_empresa = info['empresa'] or "Empresa não identificada"
+    saida.fechar(nome_empresa)
+    segundos = time.perf_counter() - inicio
+    total = saida.itens['SAIDA'] + saida.itens['ENTRADA']
+    resumo = {'empresa': nome_empresa, 'itens_saida': saida.itens['SAIDA'], 'itens_entrada': saida.itens['ENTRADA'],
+              'debito': saida.carga('SAIDA'), 'credito': saida.carga('ENTRADA'), 'versao_regras': versao,
+              'base_regras': versao_base, 'aliq_ibs': aliq_ibs, 'aliq_cbs': aliq_cbs,
+              'segundos': segundos, 'itens_por_segundo': total / segundos if segundos > 0 else 0.0,
+              'arquivos': saida.arquivos, 'erros': info['erros']}
+    # Cronograma da transição nas alíquotas de referência (os agregados guardam as bases)
+    resumo['transicao'] = cenarios.simular(saida.agregados['SAIDA'], saida.agregados['ENTRADA'],
+                                           cenarios.cronograma(aliq_ibs * 100, aliq_cbs * 100)).to_dict('records')
+    resumo['arquivos']['resumo'] = os.path.join(destino, 'resumo_auditoria.json')
+    with open(resumo['arquivos']['resumo'], 'w', encoding='utf-8') as f: json.dump(resumo, f, ensure_ascii=False, indent=2)
+    return resumo
+
+def _argumentos():
+    parser = argparse.ArgumentParser(prog='python -m motor', description='Auditoria fiscal em lote (sem Streamlit).')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    p = sub.add_parser('audit', help='Audita XMLs/ZIPs/SPED e grava Excel, Parquet e PDF.')
+    p.add_argument('--saidas', nargs='+', metavar='CAMINHO', help='XMLs/ZIPs de vendas (arquivos ou pastas)')
+    p.add_argument('--entradas', nargs='+', metavar='CAMINHO', help='XMLs/ZIPs de compras (arquivos ou pastas)')
+    p.add_argument('--sped', nargs='+', metavar='CAMINHO', help='Arquivos SPED .txt (ou pastas)')
+    p.add_argument('--ibs', type=float, default=17.7, help='Alíquota IBS em %% (padrão 17.7)')
+    p.add_argument('--cbs', type=float, default=8.8, help='Alíquota CBS em %% (padrão 8.8)')
+    p.add_argument('--destino', default='resultado_auditoria', help='Pasta de saída')
+    p.add_argument('--formatos', nargs='+', choices=FORMATOS, default=list(FORMATOS_PADRAO),
+                   help='Arquivos a gerar (padrão: xlsx parquet pdf; csv para volumes além do Excel)')
+    p.add_argument('--tipi', help='Planilha TIPI (padrão: tipi.xlsx da pasta atual)')
+    p.add_argument('--empresa', help='Nome da empresa no laudo (padrão: emitente/SPED)')
+    p.add_argument('--lote', type=int, default=50000, help='Itens por lote (limita a memória)')
+    p.add_argument('--workers', type=int, help='Processos p/ leitura de ZIP (padrão: todos os núcleos)')
+    p.add_argument('--metricas', metavar='ARQUIVO', help='Grava tempo/itens/memória de cada etapa (JSON Lines)')
+    p.add_argument('--perfil', metavar='ARQUIVO', help='Grava um cProfile (.prof) das etapas')
+    p.add_argument('--regras', default=base_regras.ARQUIVO_PADRAO, help='Base de regras compilada (padrão: regras.bin)')
+    p.add_argument('--pdf', choices=MODOS_PDF, default='amostra',
+                   help='Itens do laudo: amostra (primeiros itens) ou agregado (totais por NCM/cClassTrib/CST)')
+    p.add_argument('-q', '--quieto', action='store_true', help='Não mostra o progresso')
+    r = sub.add_parser('build-rules', help='Compila a base de regras (texto dos Anexos, JSON cClassTrib, Anexo VIII).')
+    r.add_argument('--texto', nargs='*', default=[], metavar='TXT', help='Íntegra dos Anexos da LC 214 (texto)')
+    r.add_argument('--destino', default=base_regras.ARQUIVO_PADRAO)
+    return parser
+
+def compilar_regras(args):
+    versao = base_regras.compilar(args.destino, args.texto)
+    base = base_regras.BaseRegras(args.destino)
+    print(f"Base de regras {versao} gravada em {args.destino}: {len(base.mapa_ncm)} NCMs, "
+          f"{len(base.indice_cclass)} cClassTrib, {len(base.anexo_viii)} itens do Anexo VIII")
+    base.fechar()
+    return 0
+
+def main(argv=None):
+    args = _argumentos().parse_args(argv)
+    if args.comando == 'build-rules': return compilar_regras(args)
+    if not (args.saidas or args.entradas or args.sped):
+        print("Informe ao menos --saidas, --entradas ou --sped.", file=sys.stderr)
+        return 2
+    def progresso(tipo, itens):
+        if not args.quieto: print(f"[{TIPOS[tipo]}] {itens:,} itens auditados", file=sys.stderr)
+    if args.metricas or args.perfil:
+        desempenho.configurar(*([desempenho.SinkJSON(args.metricas)] if args.metricas else []), perfil=args.perfil)
+    try:
+        resumo = auditar_arquivos(args.saidas, args.entradas, args.sped, args.ibs / 100, args.cbs / 100, args.destino,
+                                  args.formatos, args.tipi, args.empresa, args.lote, args.workers, progresso, args.regras, args.pdf)
+    except FileNotFoundError as e:
+        print(f"Arquivo ou pasta não encontrado: {e}", file=sys.stderr)
+        return 2
+    finally: desempenho.desligar()
+    print(f"Empresa: {resumo['empresa']} · Regras {resumo['versao_regras']}")
+    print(f"Itens: {resumo['itens_saida']:,} saídas / {resumo['itens_entrada']:,} entradas "
+          f"({resumo['itens_por_segundo']:,.0f} itens/s)")
+    print(f"Débitos R$ {resumo['debito']:,.2f} · Créditos R$ {resumo['credito']:,.2f} · Saldo R$ {resumo['debito'] - resumo['credito']:,.2f}")
+    for erro in resumo['erros']: print(f"Ignorado: {erro}", file=sys.stderr)
+    for arquivo in resumo['arquivos'].values(): print(f"Gerado: {arquivo}")
+    return 0
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime
+import pandas as pd
+import motor
+
+# --- BASE DE REGRAS COMPILADA ---
+# As fontes legais (texto dos Anexos da LC 214, classificacao_tributaria.json e
+# a planilha do Anexo VIII) viram um único artefato versionado (regras.bin):
+#   MAGICO | tamanho do cabeçalho | cabeçalho JSON | seções JSON
+# O cabeçalho guarda a versão (hash das seções), as impressões digitais das
+# fontes e onde começa/termina cada seção. É um cache pré-serializado: o
+# arquivo (pequeno) é lido inteiro de uma vez, mas cada seção só é decodificada
+# e convertida em estruturas do motor quando usada (o Anexo VIII, por exemplo,
+# fica em bytes se ninguém consulta NBS). Se alguma fonte mudou, carregar()
+# recompila sozinho.
+# Compilação manual: python -m motor build-rules [--texto anexos_lc214.txt ...]
+
+MAGICO = b'REGRASLC214\x00'
+VERSAO_FORMATO = 1
+ARQUIVO_PADRAO = 'regras.bin'
+FONTE_JSON = 'classificacao_tributaria.json'
+FONTE_ANEXO_VIII = 'AnexoVIII-CorrelacaoItemNBSIndOpCClassTrib_IBSCBS_V1.00.00.xlsx'
+
+def _hash_bytes(dados):
+    return hashlib.blake2b(dados, digest_size=16).hexdigest()
+
+def _digital(caminho):
+    """Impressão digital de uma fonte em disco (None se não existir)."""
+    if not caminho or not os.path.exists(caminho): return None
+    st = os.stat(caminho)
+    with open(caminho, 'rb') as f: conteudo = f.read()
+    return {'caminho': caminho, 'tamanho': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': _hash_bytes(conteudo)}
+
+def _digital_embutida():
+    # Texto embutido e configuração dos Anexos: mudar o motor também invalida o artefato
+    return _hash_bytes(repr((VERSAO_FORMATO, motor.TEXTO_MESTRA, motor.CONFIG_ANEXOS)).encode('utf-8'))
+
+def _fonte_mudou(digital):
+    """Compara com a fonte atual; mtime+tamanho iguais dispensam reler o arquivo."""
+    caminho = digital['caminho']
+    if not os.path.exists(caminho): return True
+    st = os.stat(caminho)
+    if st.st_size != digital['tamanho']: return True
+    if st.st_mtime_ns == digital['mtime_ns']: return False
+    with open(caminho, 'rb') as f: return _hash_bytes(f.read()) != digital['hash']  # ex.: checkout muda o mtime
+
+def _secao_cclass(caminho_json):
+    if not os.path.exists(caminho_json): return []
+    with open(caminho_json, 'r', encoding='utf-8') as f: df = pd.DataFrame(json.load(f), dtype=str)
+    return [[codigo, r.cst, r.descricao, r.reducao_ibs, r.reducao_cbs, r.anexo, sorted(r.documentos), r.url]
+            for codigo, r in motor.indexar_cclass(df).items()]
+
+def _secao_anexo_viii(caminho_xlsx):
+    """Blocos do Anexo VIII: item da LC 116 com suas NBS, indicadores de operação e cClassTrib.
+    As células mescladas da planilha vêm vazias nas linhas seguintes do mesmo item."""
+    if not caminho_xlsx or not os.path.exists(caminho_xlsx): return []
+    df = pd.read_excel(caminho_xlsx, sheet_name='tabela geral', dtype=str)
+    df['bloco'] = df['Item LC 116'].notna().cumsum()
+    blocos = []
+    for _, grupo in df[df['bloco'] > 0].groupby('bloco', sort=True):
+        primeira = grupo.iloc[0]
+        unicos = lambda col: list(dict.fromkeys(v.strip() for v in grupo[col].dropna()))
+        blocos.append({'item': primeira['Item LC 116'].strip(), 'descricao': str(primeira['Descrição Item']).strip(),
+                       'nbs': [n.replace('.', '') for n in unicos('NBS')], 'indop': unicos('INDOP'),
+                       'cclass': unicos('cClassTrib'), 'onerosa': unicos('PS ONEROSA? (S/N)'),
+                       'adq_exterior': unicos('ADQ EXTERIOR? (S/N)')})
+    return blocos
+
+def compilar(destino=ARQUIVO_PADRAO, textos=(), caminho_json=FONTE_JSON, caminho_anexo_viii=FONTE_ANEXO_VIII):
+    """Gera o artefato a partir das fontes. `textos`: arquivos .txt extras com a
+    íntegra dos Anexos (o TEXTO_MESTRA embutido sempre entra e prevalece). Retorna a versão."""
+    fontes_texto = []
+    for caminho in textos:
+        with open(caminho, 'r', encoding='utf-8') as f: fontes_texto.append((os.path.basename(caminho), f.read()))
+    secoes = {
+        'ncm': motor.mapa_base_legal(fontes_texto),
+        'cclass': _secao_cclass(caminho_json),
+        'anexo_viii': _secao_anexo_viii(caminho_anexo_viii),
+    }
+    blobs = {nome: json.dumps(conteudo, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+             for nome, conteudo in secoes.items()}
+    versao = _hash_bytes(b''.join(nome.encode('utf-8') + b'\x00' + blob for nome, blob in sorted(blobs.items())))[:16]
+    posicoes, pos = {}, 0
+    for nome, blob in blobs.items():
+        posicoes[nome] = [pos, pos + len(blob)]
+        pos += len(blob)
+    cabecalho = json.dumps({
+        'formato': VERSAO_FORMATO, 'versao': versao, 'criado': datetime.now().isoformat(timespec='seconds'),
+        'fontes': {'embutida': _digital_embutida(), 'json': _digital(caminho_json), 'anexo_viii': _digital(caminho_anexo_viii),
+                   'textos': [_digital(c) for c in textos]},
+        'secoes': posicoes,
+    }, ensure_ascii=False).encode('utf-8')
+    tmp = f"{destino}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGICO)
+        f.write(struct.pack('<Q', len(cabecalho)))
+        f.write(cabecalho)
+        for blob in blobs.values(): f.write(blob)
+    os.replace(tmp, destino)  # quem já leu o arquivo antigo continua com o antigo
+    return versao
+
+class BaseRegras:
+    """Artefato lido do disco. As seções viram estruturas do motor sob demanda."""
+    def __init__(self, caminho=ARQUIVO_PADRAO):
+        self.caminho = caminho
+        with open(caminho, 'rb') as f: self._dados = f.read()
+        if self._dados[:len(MAGICO)] != MAGICO: raise ValueError(f"{caminho} não é uma base de regras")
+        ini = len(MAGICO) + 8
+        (tamanho,) = struct.unpack('<Q', self._dados[len(MAGICO):ini])
+        self.cabecalho = json.loads(self._dados[ini:ini + tamanho].decode('utf-8'))
+        if self.cabecalho.get('formato') != VERSAO_FORMATO: raise ValueError("formato de base de regras antigo")
+        self._inicio_dados = ini + tamanho
+        self._cache = {}
+        self.versao = self.cabecalho['versao']
+
+    def _secao(self, nome):
+        ini, fim = self.cabecalho['secoes'][nome]
+        return json.loads(self._dados[self._inicio_dados + ini:self._inicio_dados + fim].decode('utf-8'))
+
+    def _memo(self, nome, construir):
+        if nome not in self._cache: self._cache[nome] = construir()
+        return self._cache[nome]
+
+    @property
+    def mapa_ncm(self):
+        """IndiceNCM (trie de Anexos), o mesmo de motor.carregar_base_legal."""
+        return self._memo('ncm', lambda: motor.IndiceNCM(self._secao('ncm')))
+
+    @property
+    def indice_cclass(self):
+        return self._memo('cclass', lambda: motor.IndiceCClass({
+            codigo: motor.RegraCClass(cst, descricao, red_ibs, red_cbs, anexo, frozenset(docs), url)
+            for codigo, cst, descricao, red_ibs, red_cbs, anexo, docs, url in self._secao('cclass')}))
+
+    @property
+    def anexo_viii(self):
+        return self._memo('anexo_viii', lambda: self._secao('anexo_viii'))
+
+    def consultar_nbs(self, nbs):
+        """Blocos do Anexo VIII (item LC 116, INDOP, cClassTrib) em que a NBS aparece."""
+        por_nbs = self._memo('por_nbs', lambda: _indexar_nbs(self.anexo_viii))
+        return [self.anexo_viii[i] for i in por_nbs.get(str(nbs).replace('.', '').strip(), [])]
+
+    def desatualizada(self):
+        """True se alguma fonte mudou desde a compilação."""
+        fontes = self.cabecalho['fontes']
+        if fontes.get('embutida') != _digital_embutida(): return True
+        for digital in [fontes.get('json'), fontes.get('anexo_viii')] + fontes.get('textos', []):
+            if digital and _fonte_mudou(digital): return True
+        return False
+
+    def textos(self):
+        return [d['caminho'] for d in self.cabecalho['fontes'].get('textos', []) if d]
+
+    def fechar(self):
+        """Libera os bytes e as seções decodificadas (os objetos já entregues continuam válidos)."""
+        self._cache.clear()
+        self._dados = b''
+
+def _indexar_nbs(blocos):
+    indice = {}
+    for i, bloco in enumerate(blocos):
+        for nbs in bloco['nbs']: indice.setdefault(nbs, []).append(i)
+    return indice
+
+def abrir(caminho=ARQUIVO_PADRAO):
+    try: return BaseRegras(caminho)
+    except (OSError, ValueError, KeyError, struct.error): return None
+
+def carregar(caminho=ARQUIVO_PADRAO, textos=None):
+    """Abre o artefato; compila (ou recompila, com as mesmas fontes de texto) se
+    não existir ou se alguma fonte mudou."""
+    base = abrir(caminho)
+    if base is not None and not base.desatualizada() and (textos is None or sorted(textos) == sorted(base.textos())):
+        return base
+    if textos is None: textos = base.textos() if base is not None else []
+    if base is not None: base.fechar()
+    compilar(caminho, textos)
+    return BaseRegras(caminho)
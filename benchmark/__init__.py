@@ -0,0 +1,5 @@
+"""Benchmark de throughput (itens/s) e memória (pico de RSS).
+
+Gera NF-e, ZIPs e EFD sintéticos (benchmark.geradores) e mede os leitores,
+a auditoria e as exportações (benchmark.casos). Uso: python -m benchmark
+"""
@@ -0,0 +1,67 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# --- EXECUTOR DO BENCHMARK ---
+# python -m benchmark [--tamanhos 1000 10000 ...] [--casos zip sped ...] [--saida resultados.json]
+# Cada (caso, tamanho) roda num processo novo (casos.medir), para que o pico de RSS medido
+# seja só daquele caso; a memória do caso é o pico menos o RSS depois da preparação. O
+# resultado vai para um JSON comparável entre versões (--comparar outro.json mostra a
+# variação de itens/s e de memória).
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAMANHOS_PADRAO = [1000, 10000, 100000, 1000000]
+
+def _commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True).stdout.strip() or None
+    except OSError: return None
+
+def _comparar(resultados, caminho):
+    with open(caminho, encoding='utf-8') as f: anteriores = {(r['caso'], r['tamanho']): r for r in json.load(f)['resultados']}
+    print(f"\nComparação com {caminho}:")
+    for r in resultados:
+        ant = anteriores.get((r['caso'], r['tamanho']))
+        if not ant or not ant.get('itens_por_segundo') or not r.get('itens_por_segundo'): continue
+        vel = r['itens_por_segundo'] / ant['itens_por_segundo']
+        mem = f"{r['memoria_mb'] - ant['memoria_mb']:+,.0f} MB" if r.get('memoria_mb') is not None and ant.get('memoria_mb') is not None else "-"
+        print(f"  {r['caso']:<18} {r['tamanho']:>9,}  {vel:6.2f}x itens/s  {mem}")
+
+def main(argv=None):
+    from benchmark.casos import CASOS, medir
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Throughput e memória dos leitores, da auditoria e das exportações.')
+    parser.add_argument('--tamanhos', nargs='+', type=int, default=TAMANHOS_PADRAO, help='Quantidades de itens (padrão: 1k a 1M)')
+    parser.add_argument('--casos', nargs='+', choices=list(CASOS), default=list(CASOS))
+    parser.add_argument('--pasta', default=os.path.join(RAIZ, '.benchmark'), help='Onde guardar as entradas geradas (reaproveitadas)')
+    parser.add_argument('--saida', default='resultados_benchmark.json', help='Arquivo JSON de resultados')
+    parser.add_argument('--workers', type=int, default=1, help='Processos p/ leitura de ZIP')
+    parser.add_argument('--comparar', metavar='JSON', help='Resultados anteriores para comparar')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.pasta, exist_ok=True)
+    opcoes = {'workers': args.workers}
+    resultados = []
+    contexto = multiprocessing.get_context('spawn')
+    for n in args.tamanhos:
+        for caso in args.casos:
+            with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+                r = pool.submit(medir, caso, os.path.abspath(args.pasta), n, opcoes, RAIZ).result()
+            resultados.append(r)
+            print(f"{caso:<18} {n:>9,} itens  {r['segundos']:9.3f} s  {r['itens_por_segundo'] or 0:>12,.0f} itens/s  "
+                  f"pico {r['rss_pico_mb'] or 0:,.0f} MB (+{r['memoria_mb'] or 0:,.0f} MB)", flush=True)
+
+    saida = {'data': datetime.now().isoformat(timespec='seconds'), 'commit': _commit(),
+             'python': platform.python_version(), 'plataforma': platform.platform(), 'cpus': os.cpu_count(),
+             'opcoes': opcoes, 'resultados': resultados}
+    with open(args.saida, 'w', encoding='utf-8') as f: json.dump(saida, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados em {args.saida}")
+    if args.comparar: _comparar(resultados, args.comparar)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+import base_regras
+import desempenho
+import motor
+import relatorio
+from . import geradores
+
+# --- CASOS DE BENCHMARK ---
+# Cada caso recebe (pasta de trabalho, n_itens, opções) e devolve a função
+# cronometrada. A preparação (gerar/carregar a entrada) fica fora da medição;
+# a função retorna quantos itens processou.
+
+NS = {'ns': motor.NS_NFE}
+ALIQ_IBS, ALIQ_CBS = 0.177, 0.088
+
+def _entrada(pasta, nome, gerar):
+    """Reaproveita a entrada gerada em execuções anteriores (mesmo tamanho e semente)."""
+    caminho = os.path.join(pasta, nome)
+    if not os.path.exists(caminho):
+        tmp = caminho + '.tmp'
+        gerar(tmp)
+        os.replace(tmp, caminho)
+    return caminho
+
+def _pasta_xml(pasta, n):
+    return _entrada(pasta, f'xml_{n}', lambda p: geradores.gerar_pasta_xml(p, n))
+
+def _bases():
+    base = base_regras.carregar()
+    mapa_lei, indice_cclass = base.mapa_ncm, base.indice_cclass
+    base.fechar()
+    return mapa_lei, indice_cclass, motor.carregar_tipi()
+
+def _auditado(n, tipo):
+    """Metade dos n itens para cada tipo (saídas levam o resto)."""
+    mapa_lei, indice_cclass, df_tipi = _bases()
+    n = n - n // 2 if tipo == 'SAIDA' else n // 2
+    df = geradores.gerar_itens_df(n, seed=1 if tipo == 'SAIDA' else 2, tipo=tipo)
+    preparado = motor.preparar_auditoria(df, mapa_lei, indice_cclass, df_tipi)
+    return df.join(preparado[motor.COLUNAS_CLASSIFICACAO + ['Carga Atual']]).join(motor.aplicar_aliquotas(preparado, ALIQ_IBS, ALIQ_CBS))
+
+def caso_xml_detalhado(pasta, n, opcoes):
+    base = _pasta_xml(pasta, n)
+    arquivos = [os.path.join(base, a) for a in sorted(os.listdir(base))]
+    def rodar():
+        lista = []
+        for arquivo in arquivos:
+            tree = ET.parse(arquivo)
+            motor.extrair_nome_empresa_xml(tree, NS)
+            lista.extend(motor.processar_xml_detalhado(tree, NS, 'SAIDA'))
+        return len(lista)
+    return rodar
+
+def caso_xml_stream(pasta, n, opcoes):
+    base = _pasta_xml(pasta, n)
+    arquivos = [os.path.join(base, a) for a in sorted(os.listdir(base))]
+    def rodar():
+        lista = []
+        for arquivo in arquivos: lista.extend(motor.processar_xml_stream(arquivo, 'SAIDA', NS)[1])
+        return len(lista)
+    return rodar
+
+def caso_zip(pasta, n, opcoes):
+    caminho = _entrada(pasta, f'nfe_{n}.zip', lambda p: geradores.gerar_zip(p, n))
+    return lambda: len(motor.processar_zip_xml(caminho, NS, 'SAIDA', workers=opcoes.get('workers', 1)))
+
+def caso_sped(pasta, n, opcoes):
+    caminho = _entrada(pasta, f'efd_{n}.txt', lambda p: geradores.gerar_sped(p, n))
+    def rodar():
+        _, vendas, compras = motor.processar_sped_geral(caminho)
+        return len(vendas) + len(compras)
+    return rodar
+
+def caso_auditar_df(pasta, n, opcoes):
+    # Mesmo caminho do auditar_df do app: classificação (sem memo aquecido) + alíquotas
+    mapa_lei, indice_cclass, df_tipi = _bases()
+    df = geradores.gerar_itens_df(n)
+    def rodar():
+        motor._MEMO_CLASSIFICACAO.clear()
+        preparado = motor.preparar_auditoria(df, mapa_lei, indice_cclass, df_tipi)
+        auditado = df.join(preparado[motor.COLUNAS_CLASSIFICACAO + ['Carga Atual']]).join(motor.aplicar_aliquotas(preparado, ALIQ_IBS, ALIQ_CBS))
+        return len(auditado)
+    return rodar
+
+def _caso_pdf(modo):
+    # 'amostra' desenha só LIMITE_AMOSTRA_PDF linhas por lado: itens/s não diria nada
+    def caso(pasta, n, opcoes):
+        df_v, df_c = _auditado(n, 'SAIDA'), _auditado(n, 'ENTRADA')
+        return lambda: (relatorio.gerar_pdf_bytes('Empresa Benchmark LTDA', df_v, df_c, modo=modo), len(df_v) + len(df_c))[1]
+    return caso
+
+def caso_excel_completo(pasta, n, opcoes):
+    df_v, df_c = _auditado(n, 'SAIDA'), _auditado(n, 'ENTRADA')
+    destino = os.path.join(pasta, f'saida_excel_{n}.xlsx')
+    def rodar():
+        with relatorio.PlanilhaFluxo(destino) as planilha:
+            planilha.escrever('Saidas', relatorio.preparar_exibicao(df_v))
+            planilha.escrever('Entradas', relatorio.preparar_exibicao(df_c))
+        return len(df_v) + len(df_c)
+    return rodar
+
+def caso_excel_saneamento(pasta, n, opcoes):
+    df_v, df_c = _auditado(n, 'SAIDA'), _auditado(n, 'ENTRADA')
+    return lambda: (relatorio.gerar_excel_saneamento(df_v, df_c), len(df_v) + len(df_c))[1]
+
+CASOS = {
+    'xml_detalhado': caso_xml_detalhado,
+    'xml_stream': caso_xml_stream,
+    'zip': caso_zip,
+    'sped': caso_sped,
+    'auditar_df': caso_auditar_df,
+    'pdf_completo': _caso_pdf('completo'),
+    'pdf_agregado': _caso_pdf('agregado'),
+    'excel_completo': caso_excel_completo,
+    'excel_saneamento': caso_excel_saneamento,
+}
+
+def _zerar_pico():
+    """Linux: zera o pico de RSS do processo (VmHWM), para o pico lido depois ser só da execução."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f: f.write('5')
+        return True
+    except OSError: return False
+
+def _rss_pico_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'): return int(linha.split()[1]) / 1024
+    except (OSError, ValueError, IndexError): pass
+    try: import resource
+    except ImportError: return None  # Windows
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024  # bytes no macOS, KB no Linux
+
+def medir(caso, pasta, n, opcoes, raiz):
+    """Roda num processo filho novo: prepara, cronometra uma execução e mede a memória.
+    rss_antes_mb é a memória atual depois da preparação; rss_pico_mb, o pico durante a
+    execução; memoria_mb, a diferença (o custo do caso sem a preparação)."""
+    os.chdir(raiz)  # o motor lê tipi.xlsx e classificacao_tributaria.json da pasta atual
+    rodar = CASOS[caso](pasta, n, opcoes)
+    rss_antes = desempenho.rss_mb()
+    zerado = _zerar_pico()
+    pico_preparo = None if zerado else _rss_pico_mb()
+    inicio = time.perf_counter()
+    itens = rodar()
+    segundos = time.perf_counter() - inicio
+    rss_pico = _rss_pico_mb()
+    # Sem zerar (fora do Linux), o pico do processo só é da execução se subiu durante ela
+    if not zerado and (rss_pico is None or pico_preparo is None or rss_pico <= pico_preparo): rss_pico = None
+    memoria = rss_pico - rss_antes if rss_pico is not None and rss_antes is not None else None
+    return {'caso': caso, 'tamanho': n, 'itens': itens, 'segundos': round(segundos, 4),
+            'itens_por_segundo': round(itens / segundos, 1) if segundos > 0 else None,
+            'rss_antes_mb': rss_antes and round(rss_antes, 1), 'rss_pico_mb': rss_pico and round(rss_pico, 1),
+            'memoria_mb': memoria and round(memoria, 1)}
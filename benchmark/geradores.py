@@ -0,0 +1,121 @@
+import os
+import random
+import zipfile
+import numpy as np
+import pandas as pd
+
+# --- GERADORES DE DADOS SINTÉTICOS ---
+# NF-e (layout 4.00 com o grupo IBSCBS da Reforma), ZIPs de NF-e e EFD com
+# 0000/0200/C100/C170. Tudo determinístico pela semente, para que duas
+# execuções do benchmark meçam exatamente a mesma entrada.
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+
+# Mistura de NCMs dos Anexos (cesta básica, saúde, hortifruti...), do Seletivo e de tributação cheia
+NCMS = ['10063021', '10019900', '04011010', '02013000', '07019000', '08030000', '19059010', '15079011',
+        '30049069', '30042099', '90183119', '21069030', '49019900', '33051000', '34011190', '96032100',
+        '22030000', '22042100', '24022000', '87032100', '93040000', '84713012', '85171231', '39241000',
+        '61091000', '64039990', '94036000', '27101259', '22021000', '17019900']
+CFOPS_SAIDA = ['5102', '5102', '5102', '6102', '5405', '5403', '5910', '5911', '5109', '5901', '7101', '6108']
+CFOPS_ENTRADA = ['1102', '1102', '2102', '1403', '1556', '2556', '1407', '1910', '2911']
+CCLASS = ['000001', '200003', '200034', '200013', '410004', '410999', '000002', '200028']
+ITENS_POR_NOTA = 10
+ITENS_POR_DOC_SPED = 5
+PRODUTOS_CADASTRO = 2000  # tamanho do catálogo (0200) do EFD e dos códigos de produto
+
+def _chave(rng):
+    return ''.join(str(rng.randint(0, 9)) for _ in range(44))
+
+def _fmt(v): return f"{v:.2f}"
+
+def gerar_nfe(n_itens, seed=0, emitente='Empresa Benchmark LTDA', reforma=True):
+    """Bytes de uma NF-e (nfeProc) com n_itens <det>."""
+    rng = random.Random(seed)
+    chave = _chave(rng)
+    dets = []
+    for i in range(1, n_itens + 1):
+        cod = rng.randrange(PRODUTOS_CADASTRO)
+        ncm = NCMS[cod % len(NCMS)]
+        v = round(rng.uniform(1, 5000), 2)
+        icms, pis, cofins = v * 0.18, v * 0.0165, v * 0.076
+        ibscbs = ''
+        if reforma:
+            vibs, vcbs = v * 0.001, v * 0.009
+            ibscbs = (f'<IBSCBS><CST>000</CST><cClassTrib>{rng.choice(CCLASS)}</cClassTrib><gIBSCBS><vBC>{_fmt(v)}</vBC>'
+                      f'<gIBSUF><pIBSUF>0.1000</pIBSUF><vIBSUF>{_fmt(vibs)}</vIBSUF></gIBSUF>'
+                      f'<gIBSMun><pIBSMun>0.0000</pIBSMun><vIBSMun>0.00</vIBSMun></gIBSMun><vIBS>{_fmt(vibs)}</vIBS>'
+                      f'<gCBS><pCBS>0.9000</pCBS><vCBS>{_fmt(vcbs)}</vCBS></gCBS></gIBSCBS></IBSCBS>')
+        dets.append(
+            f'<det nItem="{i}"><prod><cProd>P{cod:05d}</cProd><cEAN>SEM GTIN</cEAN><xProd>Produto {cod} - Linha {ncm[:4]}</xProd>'
+            f'<NCM>{ncm}</NCM><CFOP>{rng.choice(CFOPS_SAIDA)}</CFOP><uCom>UN</uCom><qCom>1.0000</qCom><vUnCom>{_fmt(v)}</vUnCom>'
+            f'<vProd>{_fmt(v)}</vProd><cEANTrib>SEM GTIN</cEANTrib><uTrib>UN</uTrib><qTrib>1.0000</qTrib><vUnTrib>{_fmt(v)}</vUnTrib><indTot>1</indTot></prod>'
+            f'<imposto><vTotTrib>{_fmt(icms + pis + cofins)}</vTotTrib>'
+            f'<ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC><vBC>{_fmt(v)}</vBC><pICMS>18.00</pICMS><vICMS>{_fmt(icms)}</vICMS></ICMS00></ICMS>'
+            f'<PIS><PISAliq><CST>01</CST><vBC>{_fmt(v)}</vBC><pPIS>1.65</pPIS><vPIS>{_fmt(pis)}</vPIS></PISAliq></PIS>'
+            f'<COFINS><COFINSAliq><CST>01</CST><vBC>{_fmt(v)}</vBC><pCOFINS>7.60</pCOFINS><vCOFINS>{_fmt(cofins)}</vCOFINS></COFINSAliq></COFINS>'
+            f'{ibscbs}</imposto></det>')
+    xml = (f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NS_NFE}" versao="4.00"><NFe><infNFe Id="NFe{chave}" versao="4.00">'
+           f'<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>{rng.randint(1, 999999)}</nNF>'
+           f'<dhEmi>2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T10:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+           f'<emit><CNPJ>00000000000191</CNPJ><xNome>{emitente}</xNome><enderEmit><UF>SP</UF></enderEmit></emit>'
+           f'<dest><CNPJ>11111111000111</CNPJ><xNome>Cliente Benchmark SA</xNome></dest>'
+           f'{"".join(dets)}<total><ICMSTot><vProd>0.00</vProd></ICMSTot></total></infNFe></NFe>'
+           f'<protNFe versao="4.00"><infProt><chNFe>{chave}</chNFe><cStat>100</cStat></infProt></protNFe></nfeProc>')
+    return xml.encode('utf-8')
+
+def _notas(n_itens, seed):
+    """(nome, bytes) de NF-e com ITENS_POR_NOTA itens (a última leva o resto)."""
+    for k, ini in enumerate(range(0, n_itens, ITENS_POR_NOTA)):
+        yield f'NFe_{seed}_{k:07d}.xml', gerar_nfe(min(ITENS_POR_NOTA, n_itens - ini), seed * 10_000_000 + k)
+
+def gerar_pasta_xml(pasta, n_itens, seed=0):
+    os.makedirs(pasta, exist_ok=True)
+    for nome, dados in _notas(n_itens, seed):
+        with open(os.path.join(pasta, nome), 'wb') as f: f.write(dados)
+    return pasta
+
+def gerar_zip(caminho, n_itens, seed=0):
+    with zipfile.ZipFile(caminho, 'w', zipfile.ZIP_DEFLATED) as z:
+        for nome, dados in _notas(n_itens, seed): z.writestr(nome, dados)
+    return caminho
+
+def gerar_sped(caminho, n_itens, seed=0):
+    """EFD ICMS/IPI com n_itens C170 (ITENS_POR_DOC_SPED por C100), ~1/3 entradas."""
+    rng = random.Random(seed)
+    with open(caminho, 'w', encoding='latin-1', newline='\r\n') as f:
+        f.write('|0000|017|0|01012026|31122026|EMPRESA BENCHMARK SPED SA|00000000000191||SP|123456789|3550308|||A|1|\n')
+        f.write('|0001|0|\n')
+        for cod in range(PRODUTOS_CADASTRO):
+            ncm = NCMS[cod % len(NCMS)]
+            f.write(f'|0200|P{cod:05d}|Produto {cod} - Linha {ncm[:4]}|||UN|00|{ncm}||{ncm[:2]}||18,00||\n')
+        f.write('|0990|1|\n|C001|0|\n')
+        for doc, ini in enumerate(range(0, n_itens, ITENS_POR_DOC_SPED)):
+            saida = rng.random() > 1 / 3
+            data = f'{rng.randint(1, 28):02d}{rng.randint(1, 12):02d}2026'
+            f.write(f'|C100|{1 if saida else 0}|0|P1|55|00|1|{doc + 1}|{_chave(rng)}|{data}|{data}|0,00|0|0,00|0,00|0,00|0,00|0|0,00|0,00|0,00|0,00|0,00|0,00|0,00|0,00|0,00|0,00|0,00|\n')
+            for i in range(1, min(ITENS_POR_DOC_SPED, n_itens - ini) + 1):
+                v = rng.uniform(1, 5000)
+                cfop = rng.choice(CFOPS_SAIDA if saida else CFOPS_ENTRADA)
+                f.write(f'|C170|{i}|P{rng.randrange(PRODUTOS_CADASTRO):05d}||1|UN|{v:.2f}|0|0|000|{cfop}||{v:.2f}|18,00|{v * 0.18:.2f}|0|0|0||||||||||||||||||\n'.replace('.', ','))
+            f.write('|C190|000|5102|18,00|0,00|0,00|0,00|0|0|0|0||\n')
+        f.write('|C990|0|\n|9999|0|\n')
+    return caminho
+
+def gerar_itens_df(n_itens, seed=0, tipo='SAIDA'):
+    """DataFrame no formato dos itens lidos dos XMLs, gerado direto (sem parser),
+    para medir auditoria e exportações sem o custo de leitura."""
+    rng = np.random.default_rng(seed)
+    cod = rng.integers(0, PRODUTOS_CADASTRO, n_itens)
+    ncms = np.array(NCMS)[cod % len(NCMS)]
+    valor = rng.uniform(1, 5000, n_itens).round(2)
+    nota = np.arange(n_itens) // ITENS_POR_NOTA
+    cfops = CFOPS_SAIDA if tipo == 'SAIDA' else CFOPS_ENTRADA
+    return pd.DataFrame({
+        'Cód. Produto': np.char.add('P', np.char.zfill(cod.astype(str), 5)),
+        'Chave NFe': np.char.zfill(nota.astype(str), 44), 'Num NFe': (nota + 1).astype(str),
+        'NCM': ncms, 'Produto': np.char.add('Produto ', cod.astype(str)),
+        'CFOP': np.array(cfops)[rng.integers(0, len(cfops), n_itens)], 'Valor': valor,
+        'vICMS': (valor * 0.18).round(2), 'vPIS': (valor * 0.0165).round(2), 'vCOFINS': (valor * 0.076).round(2),
+        'Tipo': tipo, 'XML_cClass': np.array(CCLASS)[rng.integers(0, len(CCLASS), n_itens)],
+        'XML_vIBS': (valor * 0.001).round(2), 'XML_vCBS': (valor * 0.009).round(2),
+    })
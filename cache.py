@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+# --- CACHE DE LEITURA (ENDEREÇADO POR CONTEÚDO) ---
+# Itens já lidos de um arquivo ficam em disco (Parquet), com a chave sendo o
+# hash do conteúdo enviado. O mesmo SPED enviado de novo, por qualquer sessão
+# ou usuário, é recarregado sem passar pelos parsers. XMLs têm uma entrada por
+# documento (arquivo solto ou membro de ZIP, ver motor.ler_documento_xml): o
+# emitente e os itens em colunas, com pickle, porque um Parquet por documento
+# custaria mais que reler o XML. Acrescentar um XML ao conjunto só lê o novo.
+
+TAMANHO_BLOCO_HASH = 4 * 1024 * 1024
+
+def _atualizar_hash(h, arquivo):
+    if isinstance(arquivo, (bytes, bytearray, memoryview)):
+        h.update(arquivo)
+    elif isinstance(arquivo, (str, os.PathLike)):
+        with open(arquivo, 'rb') as f:
+            for bloco in iter(lambda: f.read(TAMANHO_BLOCO_HASH), b''): h.update(bloco)
+    elif hasattr(arquivo, 'getbuffer'):
+        h.update(arquivo.getbuffer())
+    else:
+        arquivo.seek(0)
+        for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO_HASH), b''): h.update(bloco)
+        arquivo.seek(0)
+
+def hash_conteudo(*partes):
+    """Hash (hex) do conteúdo de bytes, caminhos ou arquivos, na ordem dada."""
+    h = hashlib.blake2b(digest_size=20)
+    for parte in partes:
+        _atualizar_hash(h, parte)
+        h.update(b'\x00')
+    return h.hexdigest()
+
+def tamanho_conteudo(arquivo):
+    if isinstance(arquivo, (bytes, bytearray, memoryview)): return len(arquivo)
+    if isinstance(arquivo, (str, os.PathLike)): return os.path.getsize(arquivo)
+    if hasattr(arquivo, 'getbuffer'): return arquivo.getbuffer().nbytes
+    return getattr(arquivo, 'size', 0)
+
+class CacheParse:
+    """Cache LRU em disco de itens lidos. Cada entrada de DataFrame são dois arquivos,
+    <chave>.parquet e <chave>.json (metadados); cada documento XML, um <chave>.doc.
+    Ao passar de `limite_bytes`, as entradas menos usadas recentemente saem.
+    Pode ir para outros processos (pickle): o destino começa com contadores zerados."""
+    def __init__(self, diretorio='.cache_parse', limite_bytes=1024 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.limite_bytes = limite_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_poupados = 0
+        self._trava = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+
+    def __getstate__(self): return {'diretorio': self.diretorio, 'limite_bytes': self.limite_bytes}
+    def __setstate__(self, estado): self.__init__(estado['diretorio'], estado['limite_bytes'])
+
+    def chave(self, *arquivos, contexto=''):
+        """Chave = hash do conteúdo dos arquivos + contexto (tipo de operação, versão do parser...)."""
+        return hash_conteudo(str(contexto).encode('utf-8'), *arquivos)
+
+    def _caminhos(self, chave):
+        base = os.path.join(self.diretorio, chave)
+        return base + '.parquet', base + '.json'
+
+    def _temporario(self, caminho):
+        return caminho + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+
+    def contar(self, hits=0, misses=0, bytes_poupados=0):
+        """Soma acessos feitos fora deste objeto (ex.: processos que leem um ZIP)."""
+        with self._trava:
+            self.hits += hits
+            self.misses += misses
+            self.bytes_poupados += bytes_poupados
+
+    def obter(self, chave, bytes_origem=0):
+        """Retorna (df, meta) ou None."""
+        arq_dados, arq_meta = self._caminhos(chave)
+        try:
+            df = pd.read_parquet(arq_dados)
+            with open(arq_meta, 'r', encoding='utf-8') as f: meta = json.load(f)
+            os.utime(arq_dados)  # marca como usado recentemente (LRU)
+        except (OSError, ValueError):
+            with self._trava: self.misses += 1
+            return None
+        with self._trava:
+            self.hits += 1
+            self.bytes_poupados += bytes_origem
+        return df, meta
+
+    def guardar(self, chave, df, meta=None):
+        arq_dados, arq_meta = self._caminhos(chave)
+        tmp_dados, tmp_meta = self._temporario(arq_dados), self._temporario(arq_meta)
+        try:
+            df.to_parquet(tmp_dados, index=False)
+            with open(tmp_meta, 'w', encoding='utf-8') as f: json.dump(meta or {}, f)
+            # Escrita atômica, metadados antes: quem acha o parquet acha também o json completo
+            os.replace(tmp_meta, arq_meta)
+            os.replace(tmp_dados, arq_dados)
+        except Exception:
+            for tmp in (tmp_dados, tmp_meta):
+                if os.path.exists(tmp): os.remove(tmp)
+            return
+        self.despejar()
+
+    def obter_documento(self, chave, bytes_origem=0):
+        """(meta, colunas) de um documento, ou None."""
+        arquivo = os.path.join(self.diretorio, chave + '.doc')
+        try:
+            with open(arquivo, 'rb') as f: meta, colunas = pickle.load(f)
+            os.utime(arquivo)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            with self._trava: self.misses += 1
+            return None
+        with self._trava:
+            self.hits += 1
+            self.bytes_poupados += bytes_origem
+        return meta, colunas
+
+    def guardar_documento(self, chave, meta, colunas):
+        """Grava sem despejar: quem lê muitos documentos chama despejar() no fim."""
+        arquivo = os.path.join(self.diretorio, chave + '.doc')
+        tmp = self._temporario(arquivo)
+        try:
+            with open(tmp, 'wb') as f: pickle.dump((meta, colunas), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, arquivo)
+        except OSError:
+            if os.path.exists(tmp): os.remove(tmp)
+
+    def _entradas(self):
+        """(último uso, bytes, arquivos) de cada entrada."""
+        entradas = []
+        for nome in os.listdir(self.diretorio):
+            if not nome.endswith(('.parquet', '.doc')): continue
+            caminho = os.path.join(self.diretorio, nome)
+            arquivos = [caminho] if nome.endswith('.doc') else [caminho, caminho[:-len('.parquet')] + '.json']
+            try:
+                st = os.stat(caminho)
+                tam = st.st_size + sum(os.path.getsize(a) for a in arquivos[1:] if os.path.exists(a))
+            except OSError: continue
+            entradas.append((st.st_mtime, tam, arquivos))
+        return entradas
+
+    def despejar(self):
+        """Remove as entradas menos usadas até caber em limite_bytes."""
+        with self._trava:
+            entradas = sorted(self._entradas())
+            total = sum(e[1] for e in entradas)
+            for _, tam, arquivos in entradas:
+                if total <= self.limite_bytes: break
+                for arq in arquivos:
+                    try: os.remove(arq)
+                    except OSError: pass
+                total -= tam
+
+    def tamanho_total(self):
+        return sum(e[1] for e in self._entradas())
+
+    def estatisticas(self):
+        entradas = self._entradas()
+        return {'hits': self.hits, 'misses': self.misses, 'bytes_poupados': self.bytes_poupados,
+                'entradas': len(entradas), 'bytes_em_disco': sum(e[1] for e in entradas)}
+
+    def limpar(self):
+        with self._trava:
+            for nome in os.listdir(self.diretorio):
+                if nome.endswith(('.parquet', '.json', '.doc')):
+                    try: os.remove(os.path.join(self.diretorio, nome))
+                    except OSError: pass
+
+# --- CACHE DE EXPORTAÇÕES (EM MEMÓRIA) ---
+# PDF e planilhas gerados só quando o usuário pede e guardados por impressão
+# digital dos dados auditados + alíquotas + versão das regras. Reruns do
+# Streamlit que não mudam nada disso reaproveitam os bytes já gerados.
+
+def impressao_df(df):
+    """Hash do conteúdo de um DataFrame (colunas, índice e valores)."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr([str(c) for c in df.columns]).encode('utf-8'))
+    if len(df): h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+class CacheExportacao:
+    """Bytes de exportação por chave, LRU limitado em bytes: ao passar de
+    `limite_bytes`, os artefatos menos usados recentemente saem."""
+    def __init__(self, limite_bytes=256 * 1024 * 1024):
+        self.limite_bytes = limite_bytes
+        self.hits = 0
+        self.misses = 0
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._trava = threading.Lock()  # o download roda numa thread à parte
+
+    def obter(self, chave, gerar):
+        """Bytes guardados para `chave`; se não houver, chama gerar() e guarda."""
+        with self._trava:
+            dados = self._itens.get(chave)
+            if dados is not None:
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                return dados
+            self.misses += 1
+        dados = gerar()
+        with self._trava:
+            if chave not in self._itens and len(dados) <= self.limite_bytes:
+                self._itens[chave] = dados
+                self._bytes += len(dados)
+                while self._bytes > self.limite_bytes:
+                    _, antigo = self._itens.popitem(last=False)
+                    self._bytes -= len(antigo)
+        return dados
+
+    def estatisticas(self):
+        with self._trava:
+            return {'hits': self.hits, 'misses': self.misses, 'entradas': len(self._itens), 'bytes_em_memoria': self._bytes}
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+            self._bytes = 0
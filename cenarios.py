@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import agregados
+
+# --- SIMULADOR DA TRANSIÇÃO (2026-2033) ---
+# Cada cenário é uma linha (Ano, IBS %, CBS %, fator do ICMS, fator do
+# PIS/COFINS). Os agregados já guardam, sem depender de alíquota, a base da
+# Reforma (Base Líquida x fator de redução da classificação) e os tributos
+# atuais separados; todos os cenários saem de uma única multiplicação
+# (grupos x componentes) @ (componentes x cenários), sem voltar aos itens.
+
+COLUNAS_CENARIO = ['Ano', 'IBS (%)', 'CBS (%)', 'Fator ICMS', 'Fator PIS/COFINS']
+COMPONENTES = ['Base Reforma', 'ICMS Atual', 'PIS/COFINS Atual']
+ALIQ_TESTE_IBS, ALIQ_TESTE_CBS = 0.1, 0.9  # 2026: período de teste (%)
+REDUCAO_CBS_TESTE = 0.1  # 2027-2028: CBS de referência menos 0,1 p.p. (IBS segue em teste)
+FATOR_ICMS = {2029: 0.9, 2030: 0.8, 2031: 0.7, 2032: 0.6}  # ICMS cai 1/10 ao ano; o IBS ocupa o espaço
+
+def cronograma(aliq_ibs, aliq_cbs):
+    """Cronograma da EC 132 / LC 214 a partir das alíquotas de referência (em %).
+    PIS/COFINS acabam em 2027 e o ICMS em 2033."""
+    linhas = [(2026, ALIQ_TESTE_IBS, ALIQ_TESTE_CBS, 1.0, 1.0)]
+    linhas += [(ano, ALIQ_TESTE_IBS, aliq_cbs - REDUCAO_CBS_TESTE, 1.0, 0.0) for ano in (2027, 2028)]
+    linhas += [(ano, aliq_ibs * (1 - fator), aliq_cbs, fator, 0.0) for ano, fator in FATOR_ICMS.items()]
+    linhas.append((2033, aliq_ibs, aliq_cbs, 0.0, 0.0))
+    return pd.DataFrame(linhas, columns=COLUNAS_CENARIO)
+
+def _validos(cenarios):
+    # Linhas incompletas (ex.: recém-criadas no editor) ficam de fora
+    return cenarios.dropna(subset=COLUNAS_CENARIO).reset_index(drop=True)
+
+def _matriz(cenarios):
+    """(3 x cenários): multiplicadores da base da Reforma, do ICMS e do PIS/COFINS."""
+    ibs = cenarios['IBS (%)'].to_numpy(dtype=float) / 100
+    cbs = cenarios['CBS (%)'].to_numpy(dtype=float) / 100
+    return np.vstack([ibs + cbs, cenarios['Fator ICMS'].to_numpy(dtype=float),
+                      cenarios['Fator PIS/COFINS'].to_numpy(dtype=float)])
+
+def simular(agregado_v, agregado_c, cenarios):
+    """Uma linha por cenário: débitos (saídas) e créditos (entradas) de IBS/CBS e
+    dos tributos atuais remanescentes, totais e saldo."""
+    cenarios = _validos(cenarios)
+    matriz = _matriz(cenarios)
+    res = cenarios.copy()
+    for nome, agregado in (('Débito', agregado_v), ('Crédito', agregado_c)):
+        base, icms, pis_cofins = agregado.somas[COMPONENTES].to_numpy(dtype=float)
+        res[f'{nome} IBS/CBS'] = base * matriz[0]
+        res[f'{nome} Legado'] = icms * matriz[1] + pis_cofins * matriz[2]
+        res[f'{nome}s'] = res[f'{nome} IBS/CBS'] + res[f'{nome} Legado']
+    res['Saldo'] = res['Débitos'] - res['Créditos']
+    return res
+
+def saldo_por(agregado_v, agregado_c, cenarios, dimensao):
+    """Saldo (débitos - créditos) de cada grupo da dimensão (agregados.DIMENSOES) em
+    cada cenário: uma coluna por cenário, rotulada pelo ano."""
+    cenarios = _validos(cenarios)
+    chaves = agregados.DIMENSOES[dimensao]
+    juntos = pd.merge(agregado_v.tabela(dimensao, 0, 0)[chaves + COMPONENTES],
+                      agregado_c.tabela(dimensao, 0, 0)[chaves + COMPONENTES],
+                      on=chaves, how='outer', suffixes=(' v', ' c'))
+    liquido = (juntos[[f'{c} v' for c in COMPONENTES]].fillna(0).to_numpy(dtype=float)
+               - juntos[[f'{c} c' for c in COMPONENTES]].fillna(0).to_numpy(dtype=float))
+    saldos = liquido @ _matriz(cenarios)
+    anos = [str(int(a)) for a in cenarios['Ano']]
+    return pd.concat([juntos[chaves], pd.DataFrame(saldos, columns=anos, index=juntos.index)], axis=1)
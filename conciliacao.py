@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# --- CONCILIAÇÃO XML x SPED POR ITEM ---
+# Cada item é identificado por (chave da NF-e, nº do item): nItem do <det> no
+# XML e NUM_ITEM do C170 no SPED. Os textos viram códigos inteiros num
+# dicionário comum aos dois lados (só as categorias distintas são comparadas,
+# os itens apenas têm o código remapeado) e cada item vira um único int64. O
+# lado SPED é indexado numa tabela hash e o lado XML é consultado em blocos:
+# custo linear no número de itens, com as ocorrências saindo bloco a bloco.
+# Nos pares encontrados comparam-se NCM, CFOP, valor e, nas saídas, o código
+# do produto (nas entradas o COD_ITEM do SPED é o código do próprio
+# contribuinte, não o do fornecedor, e o CFOP do XML é o da saída do emitente).
+
+OCORRENCIAS = ['Nota fora do SPED', 'Nota sem XML', 'Item fora do SPED', 'Item sem XML',
+               'Item duplicado no XML', 'Item duplicado no SPED',
+               'Produto divergente', 'NCM divergente', 'CFOP divergente', 'Valor divergente']
+COLUNAS = ['Ocorrência', 'Chave NFe', 'Nº Item', 'Cód. Produto XML', 'Cód. Produto SPED', 'NCM XML', 'NCM SPED',
+           'CFOP XML', 'CFOP SPED', 'Valor XML', 'Valor SPED', 'Diferença']
+TOLERANCIA_VALOR = 0.01
+VAZIOS = ['', '0000', 'N/A']  # NCM sem 0200, CFOP ausente no C170 (EFD Contribuições), chave não lida
+TAMANHO_BLOCO = 200000
+
+def _categorias(serie):
+    """(categorias como texto, códigos por item; -1 = nulo)."""
+    if not isinstance(serie.dtype, pd.CategoricalDtype): serie = serie.astype('category')
+    return pd.Index(serie.cat.categories.astype(str)), serie.cat.codes.to_numpy(dtype=np.int64)
+
+def _remapear(categorias, codigos, uniao):
+    if not len(categorias): return np.full(len(codigos), -1, dtype=np.int64)
+    mapa = uniao.get_indexer(categorias)
+    mapa[categorias.isin(VAZIOS)] = -1
+    return np.where(codigos >= 0, mapa[codigos], -1)
+
+def _codigos(a, b, normalizar_a=None):
+    """Códigos das colunas a e b num dicionário comum (-1 = vazio) e o dicionário."""
+    cats_a, cod_a = _categorias(a)
+    cats_b, cod_b = _categorias(b)
+    if normalizar_a is not None: cats_a = cats_a.map(normalizar_a)
+    uniao = cats_a.append(cats_b).drop_duplicates()
+    return _remapear(cats_a, cod_a, uniao), _remapear(cats_b, cod_b, uniao), uniao
+
+def _numero_item(serie):
+    """Nº do item como inteiro ('001' e '1' são o mesmo item); -1 se ausente."""
+    cats, cod = _categorias(serie)
+    numeros = pd.to_numeric(pd.Series(cats), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+    return np.where(cod >= 0, numeros[cod], -1) if len(numeros) else np.full(len(cod), -1, dtype=np.int64)
+
+def cfop_espelho(cfop):
+    """CFOP de saída do emitente (5/6/7xxx) -> entrada correspondente (1/2/3xxx)."""
+    return str(int(cfop[0]) - 4) + cfop[1:] if len(cfop) == 4 and cfop[0] in '567' else cfop
+
+def _coluna(df, campo, linhas):
+    if campo not in df.columns: return pd.Series([None] * len(linhas), dtype=object)
+    return pd.Series(df[campo].array.take(linhas, allow_fill=True)).astype(object)
+
+def _tabela(ocorrencia, xml, sped, ix, isp):
+    """Ocorrências de pares (linha no XML, linha no SPED); -1 = o item não existe naquele lado."""
+    if not len(ix): return pd.DataFrame(columns=COLUNAS)
+    t = pd.DataFrame({'Ocorrência': ocorrencia}, index=range(len(ix)))
+    for campo in ['Chave NFe', 'Nº Item']:
+        t[campo] = _coluna(xml, campo, ix).where(ix >= 0, _coluna(sped, campo, isp))
+    for campo in ['Cód. Produto', 'NCM', 'CFOP', 'Valor']:
+        t[f'{campo} XML'] = _coluna(xml, campo, ix)
+        t[f'{campo} SPED'] = _coluna(sped, campo, isp)
+    t['Valor XML'] = t['Valor XML'].astype(float)
+    t['Valor SPED'] = t['Valor SPED'].astype(float)
+    t['Diferença'] = t['Valor XML'].fillna(0) - t['Valor SPED'].fillna(0)
+    return t[COLUNAS]
+
+def _notas(ocorrencia, chaves, presentes, ausentes_no_outro, valores, lado):
+    """Uma linha por nota presente de um lado e ausente do outro, com o valor somado."""
+    notas = np.flatnonzero(presentes & ~ausentes_no_outro)
+    if not len(notas): return pd.DataFrame(columns=COLUNAS)
+    t = pd.DataFrame({'Ocorrência': ocorrencia, 'Chave NFe': chaves[notas].astype(object),
+                      f'Valor {lado}': valores[notas]}).reindex(columns=COLUNAS)
+    t['Diferença'] = valores[notas] if lado == 'XML' else -valores[notas]
+    return t
+
+def conciliar(xml, sped, tipo='SAIDA', tamanho_bloco=TAMANHO_BLOCO):
+    """Gera DataFrames (COLUNAS) com as ocorrências entre os itens do XML e do SPED
+    de um tipo de operação: primeiro as notas que só existem de um lado, depois os
+    itens duplicados, os itens do XML bloco a bloco e, por fim, os itens do SPED
+    sem correspondente. Itens que conferem não aparecem."""
+    if xml.empty and sped.empty: return
+    vazio = pd.Series(dtype=object)
+    coluna = lambda df, c: df[c] if c in df.columns else vazio.reindex(df.index)
+    ch_x, ch_s, chaves = _codigos(coluna(xml, 'Chave NFe'), coluna(sped, 'Chave NFe'))
+    it_x, it_s = _numero_item(coluna(xml, 'Nº Item')), _numero_item(coluna(sped, 'Nº Item'))
+    base = max(it_x.max(initial=0), it_s.max(initial=0)) + 2
+    k_x = np.where(ch_x >= 0, ch_x * base + it_x + 1, -1)
+    k_s = np.where(ch_s >= 0, ch_s * base + it_s + 1, -1)
+    v_x, v_s = coluna(xml, 'Valor').to_numpy(dtype=float), coluna(sped, 'Valor').to_numpy(dtype=float)
+
+    # Notas: presença e valor por chave (bincount sobre os códigos)
+    n = len(chaves)
+    notas_x = np.bincount(ch_x[ch_x >= 0], minlength=n) > 0
+    notas_s = np.bincount(ch_s[ch_s >= 0], minlength=n) > 0
+    soma_x = np.bincount(ch_x[ch_x >= 0], weights=v_x[ch_x >= 0], minlength=n)
+    soma_s = np.bincount(ch_s[ch_s >= 0], weights=v_s[ch_s >= 0], minlength=n)
+    yield pd.concat([_notas('Nota fora do SPED', chaves, notas_x, notas_s, soma_x, 'XML'),
+                     _notas('Nota sem XML', chaves, notas_s, notas_x, soma_s, 'SPED')], ignore_index=True)
+
+    # Só as notas dos dois lados descem ao nível de item
+    em_ambos = notas_x & notas_s
+    comum_x = (ch_x >= 0) & em_ambos[np.maximum(ch_x, 0)]
+    comum_s = (ch_s >= 0) & em_ambos[np.maximum(ch_s, 0)]
+    dup_x = comum_x & pd.Index(k_x).duplicated()
+    dup_s = comum_s & pd.Index(k_s).duplicated()
+    yield pd.concat([_tabela('Item duplicado no XML', xml, sped, np.flatnonzero(dup_x), np.full(dup_x.sum(), -1)),
+                     _tabela('Item duplicado no SPED', xml, sped, np.full(dup_s.sum(), -1), np.flatnonzero(dup_s))],
+                    ignore_index=True)
+
+    linhas_s = np.flatnonzero(comum_s & ~dup_s)
+    indice = pd.Index(k_s[linhas_s])  # tabela hash: chave do item -> posição em linhas_s
+    encontrados = np.zeros(len(sped), dtype=bool)
+
+    entrada = tipo != 'SAIDA'
+    cp_x, cp_s, _ = _codigos(coluna(xml, 'Cód. Produto'), coluna(sped, 'Cód. Produto'))
+    ncm_x, ncm_s, _ = _codigos(coluna(xml, 'NCM'), coluna(sped, 'NCM'))
+    cfop_x, cfop_s, _ = _codigos(coluna(xml, 'CFOP'), coluna(sped, 'CFOP'), cfop_espelho if entrada else None)
+    comparacoes = [('NCM divergente', ncm_x, ncm_s), ('CFOP divergente', cfop_x, cfop_s)]
+    if not entrada: comparacoes.insert(0, ('Produto divergente', cp_x, cp_s))
+
+    linhas_x = np.flatnonzero(comum_x & ~dup_x)
+    for ini in range(0, len(linhas_x), tamanho_bloco):
+        ix = linhas_x[ini:ini + tamanho_bloco]
+        pos = indice.get_indexer(k_x[ix])
+        partes = [_tabela('Item fora do SPED', xml, sped, ix[pos < 0], np.full((pos < 0).sum(), -1))]
+        ix, isp = ix[pos >= 0], linhas_s[pos[pos >= 0]]
+        encontrados[isp] = True
+        for nome, a, b in comparacoes:
+            div = (a[ix] >= 0) & (b[isp] >= 0) & (a[ix] != b[isp])
+            partes.append(_tabela(nome, xml, sped, ix[div], isp[div]))
+        div = np.abs(v_x[ix] - v_s[isp]) > TOLERANCIA_VALOR
+        partes.append(_tabela('Valor divergente', xml, sped, ix[div], isp[div]))
+        yield pd.concat(partes, ignore_index=True)
+
+    sobra = linhas_s[~encontrados[linhas_s]]
+    yield _tabela('Item sem XML', xml, sped, np.full(len(sobra), -1), sobra)
+
+def conciliar_df(xml, sped, tipo='SAIDA'):
+    """Todas as ocorrências de conciliar() num único DataFrame."""
+    blocos = [b for b in conciliar(xml, sped, tipo) if not b.empty]
+    return pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame(columns=COLUNAS)
+
+def resumir(ocorrencias):
+    """Quantidade de cada ocorrência (todas as de OCORRENCIAS, mesmo as zeradas)."""
+    return ocorrencias['Ocorrência'].value_counts().reindex(OCORRENCIAS, fill_value=0)
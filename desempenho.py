@@ -0,0 +1,120 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import deque
+import pandas as pd
+
+# --- INSTRUMENTAÇÃO POR ETAPA ---
+# Tempo, quantidade de itens e variação de memória (RSS) de cada etapa da
+# auditoria (leitura de XML/ZIP/SPED, classificação, cruzamento, PDF, Excel),
+# por arquivo quando houver. Os registros vão para "sinks" plugáveis: memória
+# (painel "Performance" do app), arquivo JSON Lines e, opcionalmente, um
+# cProfile das etapas. A configuração é por thread (cada sessão do Streamlit
+# roda em uma); desligada, etapa() devolve um objeto nulo e não mede nada.
+
+_PAGINA = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def rss_mb():
+    """Memória residente atual do processo em MB (None se não der para medir)."""
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * _PAGINA / 1048576
+    except (OSError, ValueError, IndexError): pass
+    try: import resource
+    except ImportError: return None
+    # Fora do Linux fica o pico (ru_maxrss: KB no Linux, bytes no macOS)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1048576 if os.uname().sysname == 'Darwin' else pico / 1024
+
+class SinkMemoria:
+    """Guarda os últimos `maximo` registros (para exibir no app)."""
+    def __init__(self, registros=None, maximo=5000):
+        self.registros = registros if registros is not None else deque(maxlen=maximo)
+    def registrar(self, registro): self.registros.append(registro)
+
+class SinkJSON:
+    """Acrescenta cada registro como uma linha JSON em `caminho`."""
+    def __init__(self, caminho): self.caminho = caminho
+    def registrar(self, registro):
+        with open(self.caminho, 'a', encoding='utf-8') as f: f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+
+class _EtapaNula:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def __setattr__(self, nome, valor): pass  # `e.itens = n` vira no-op
+
+_NULA = _EtapaNula()
+
+class _Etapa:
+    __slots__ = ('_estado', 'etapa', 'arquivo', 'itens', '_inicio', '_rss')
+    def __init__(self, estado, etapa, arquivo, itens):
+        self._estado, self.etapa, self.arquivo, self.itens = estado, etapa, arquivo, itens
+
+    def __enter__(self):
+        estado = self._estado
+        estado.nivel += 1
+        if estado.perfil is not None and estado.nivel == 1: estado.perfil.enable()
+        self._rss = rss_mb()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_erro, erro, tb):
+        segundos = time.perf_counter() - self._inicio
+        rss = rss_mb()
+        estado = self._estado
+        estado.nivel -= 1
+        if estado.perfil is not None and estado.nivel == 0:
+            estado.perfil.disable()
+            estado.perfil.dump_stats(estado.caminho_perfil)  # acumulado de todas as etapas até aqui
+        registro = {'etapa': self.etapa, 'arquivo': None if self.arquivo is None else str(self.arquivo),
+                    'itens': self.itens, 'segundos': round(segundos, 6),
+                    'memoria_mb': None if rss is None or self._rss is None else round(rss - self._rss, 2),
+                    'rss_mb': None if rss is None else round(rss, 1), 'nivel': estado.nivel,
+                    'quando': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        if tipo_erro is not None: registro['erro'] = tipo_erro.__name__
+        for sink in estado.sinks: sink.registrar(registro)
+        return False
+
+class Instrumentacao:
+    def __init__(self):
+        self._local = threading.local()
+
+    def configurar(self, *sinks, perfil=None):
+        """Liga a medição na thread atual. perfil = caminho do .prof do cProfile (opcional)."""
+        estado = self._local
+        estado.sinks = list(sinks)
+        estado.perfil = cProfile.Profile() if perfil else None
+        estado.caminho_perfil = perfil
+        estado.nivel = 0
+
+    def desligar(self):
+        self._local.sinks = None
+        self._local.perfil = None
+
+    @property
+    def ativo(self):
+        return bool(getattr(self._local, 'sinks', None)) or getattr(self._local, 'perfil', None) is not None
+
+    def etapa(self, nome, arquivo=None, itens=None):
+        """Context manager que mede uma etapa; atribua `.itens` dentro do bloco se só souber no fim."""
+        estado = self._local
+        if not getattr(estado, 'sinks', None) and getattr(estado, 'perfil', None) is None: return _NULA
+        return _Etapa(estado, nome, arquivo, itens)
+
+INSTRUMENTACAO = Instrumentacao()
+configurar = INSTRUMENTACAO.configurar
+desligar = INSTRUMENTACAO.desligar
+etapa = INSTRUMENTACAO.etapa
+
+def resumir(registros):
+    """Totais por etapa: chamadas, segundos, itens, itens/s e maior variação de memória."""
+    df = pd.DataFrame(list(registros))
+    if df.empty: return pd.DataFrame(columns=['Etapa', 'Chamadas', 'Segundos', 'Itens', 'Itens/s', 'Memória (MB)'])
+    df['itens'] = pd.to_numeric(df['itens'], errors='coerce')
+    resumo = df.groupby('etapa', sort=False).agg(Chamadas=('etapa', 'size'), Segundos=('segundos', 'sum'),
+                                                 Itens=('itens', 'sum'), Memoria=('memoria_mb', 'max'))
+    resumo['Itens/s'] = (resumo['Itens'] / resumo['Segundos']).where(resumo['Segundos'] > 0)
+    resumo = resumo.reset_index().rename(columns={'etapa': 'Etapa', 'Memoria': 'Memória (MB)'})
+    return resumo[['Etapa', 'Chamadas', 'Segundos', 'Itens', 'Itens/s', 'Memória (MB)']].sort_values('Segundos', ascending=False)
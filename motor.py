@@ -1,11 +1,25 @@
 import pandas as pd
+import numpy as np
 import json
+import hashlib
+import pickle
 import xml.etree.ElementTree as ET
 import requests
 import os
 import re
 import io
 import zipfile
+import tempfile
+import shutil
+import time
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from collections import namedtuple, OrderedDict, deque
+from collections.abc import Mapping
+from pandas.api.types import union_categoricals
+import desempenho
 
 # --- 1. MAPA DE INTELIGÊNCIA (CSTs) ---
 MAPA_CST_CORRETO = {
@@ -54,19 +68,248 @@ CONFIG_ANEXOS = {
     "ANEXO XV":  {"Descricao": "Hortifruti e Ovos", "cClassTrib": "200014", "Reducao": 1.0, "CST_Default": "200", "Status": "ZERO (Anexo XV)", "Caps": ["04","06","07","08"]}
 }
 
-def carregar_tipi(uploaded_file=None):
-    # Lógica de carregamento TIPI (mantida)
-    arquivo = uploaded_file if uploaded_file else ("tipi.xlsx" if os.path.exists("tipi.xlsx") else None)
-    if not arquivo: return pd.DataFrame()
+# --- 3. GRUPOS DE CFOP (SOBRESCRITA DA REGRA POR NCM) ---
+CFOPS_BONIFICACAO = frozenset(['1910', '2910', '5910', '6910'])
+CFOPS_AMOSTRA = frozenset(['1911', '2911', '5911', '6911', '5912', '6912', '5913', '6913'])
+CFOPS_SUSPENSAO = frozenset(['5901', '6901', '5902', '6902', '5915', '6915', '5916', '6916'])
+CFOPS_ZFM = frozenset(['5109', '6109', '5110', '6110'])
+CFOPS_EXPORT = frozenset(['7101', '7102', '7127', '7501', '7930', '7949'])
+CFOPS_USO_CONSUMO = frozenset(['556', '407', '551', '406'])  # Sem o dígito de origem (1/2/3)
+
+# Colunas produzidas pela auditoria (mesma ordem da tupla de classificar_item)
+COLUNAS_CLASSIFICACAO = ['cClassTrib', 'DescRegra', 'Status', 'Novo CST', 'Origem Legal', 'Validação TIPI']
+COLUNAS_AUDITORIA = COLUNAS_CLASSIFICACAO + ['Carga Atual', 'Carga Projetada', 'vIBS', 'vCBS']
+
+def _hash_versao(conteudo):
+    return hashlib.blake2b(repr(conteudo).encode('utf-8'), digest_size=8).hexdigest()
+
+# --- 4. ÍNDICE DE PREFIXOS NCM (TRIE) ---
+# NCMs sujeitos ao Imposto Seletivo (bebidas, fumo, veículos, armas)
+PREFIXOS_SELETIVO = ['2203', '2204', '2205', '2206', '2207', '2208', '24', '87', '93']
+
+class IndiceNCM(dict):
+    """Mapa NCM -> Anexo (o mesmo de carregar_base_legal) com uma trie de
+    prefixos compilada para Anexos, Seletivo e capítulos (Caps) dos Anexos.
+    Cada consulta custa O(len(ncm)), independente do tamanho da base.
+    Se o dict for alterado depois de criado, chame compilar() de novo."""
+    def __init__(self, mapa=None):
+        super().__init__(mapa or {})
+        self.compilar()
+
+    def compilar(self):
+        raiz = {}
+        def no(prefixo):
+            atual = raiz
+            for d in prefixo: atual = atual.setdefault(d, {})
+            return atual
+        # Filhos são chaves de 1 caractere; metadados usam chaves longas
+        for prefixo, anexo in self.items(): no(prefixo)['anexo'] = anexo
+        for prefixo in PREFIXOS_SELETIVO: no(prefixo)['seletivo'] = True
+        for anexo, cfg in CONFIG_ANEXOS.items():
+            for cap in cfg['Caps']: no(cap).setdefault('caps', set()).add(anexo)
+        self._trie = raiz
+        self.versao = _hash_versao(sorted(self.items()))
+
+    def consultar(self, ncm):
+        """Retorna (anexo, prefixo_usado, seletivo) para um NCM.
+        O Anexo segue a ordem de tentativa [ncm, ncm[:6], ncm[:4], ncm[:2]]."""
+        ncm = str(ncm).replace('.', '')
+        validos = (2, 4, 6, len(ncm))
+        anexo, prefixo, seletivo = None, None, False
+        atual = self._trie
+        for i, d in enumerate(ncm, 1):
+            atual = atual.get(d)
+            if atual is None: break
+            if 'seletivo' in atual: seletivo = True
+            if 'anexo' in atual and i in validos: anexo, prefixo = atual['anexo'], ncm[:i]
+        return anexo, prefixo, seletivo
+
+    def cap_permitido(self, anexo, codigo):
+        """Equivale a: not caps or any(codigo.startswith(cap) for cap in caps)."""
+        if not CONFIG_ANEXOS[anexo]['Caps']: return True
+        atual = self._trie
+        for d in codigo:
+            atual = atual.get(d)
+            if atual is None: return False
+            if anexo in atual.get('caps', ()): return True
+        return False
+
+    def consultar_serie(self, ncms):
+        """Consulta em lote: cada NCM distinto é resolvido uma vez e o
+        resultado é espalhado de volta. Retorna DataFrame Anexo/Prefixo/Seletivo."""
+        ncms = pd.Series(ncms)
+        codigos, unicos = pd.factorize(ncms.astype(object), use_na_sentinel=False)
+        achados = [self.consultar(u) for u in unicos]
+        anexos = np.array([a[0] for a in achados], dtype=object)
+        prefixos = np.array([a[1] for a in achados], dtype=object)
+        seletivos = np.array([a[2] for a in achados], dtype=bool)
+        return pd.DataFrame({
+            'Anexo': anexos[codigos], 'Prefixo': prefixos[codigos], 'Seletivo': seletivos[codigos]
+        }, index=ncms.index)
+
+# Índice sem mapa de Anexos: atende Seletivo e Caps antes da base legal existir
+_INDICE_BASE = IndiceNCM()
+
+# Índices montados a partir de dicts comuns (id -> (dict, índice)): quem ainda
+# passa o mapa como dict não recompila a trie a cada item. O dict fica
+# referenciado, então o id não é reaproveitado enquanto estiver aqui; o índice
+# guarda a cópia do conteúdo com que foi montado, comparada a cada uso.
+INDICES_DICT_MAX = 8
+_INDICES_DICT = OrderedDict()
+_TRAVA_INDICES = threading.Lock()
+
+def indice_ncm(mapa_regras):
+    """O IndiceNCM do mapa: ele mesmo, se já for um; para um dict, o índice montado
+    na primeira chamada, enquanto o conteúdo do dict for o mesmo (a comparação é
+    entre dicts em C, microssegundos para as ~100 entradas do mapa); dict alterado
+    recompila."""
+    if isinstance(mapa_regras, IndiceNCM): return mapa_regras
+    with _TRAVA_INDICES:
+        achado = _INDICES_DICT.get(id(mapa_regras))
+        if achado is not None and achado[0] is mapa_regras and achado[1] == mapa_regras:
+            _INDICES_DICT.move_to_end(id(mapa_regras))
+            return achado[1]
+    indice = IndiceNCM(mapa_regras)
+    with _TRAVA_INDICES:
+        _INDICES_DICT[id(mapa_regras)] = (mapa_regras, indice)
+        while len(_INDICES_DICT) > INDICES_DICT_MAX: _INDICES_DICT.popitem(last=False)
+    return indice
+
+# --- TIPI (ÍNDICE COMPILADO) ---
+# A planilha é lida e normalizada uma vez e vira um artefato binário pequeno
+# (NCM -> descrição) em DIR_CACHE_TIPI. Enquanto a origem não muda (mtime e
+# tamanho do arquivo em disco, ou hash do conteúdo enviado), o artefato é
+# carregado direto, sem openpyxl.
+DIR_CACHE_TIPI = '.cache_tipi'
+VERSAO_TIPI = 1  # incrementar ao mudar a compilação (invalida os artefatos)
+
+class IndiceTIPI(Mapping):
+    """NCM limpo (4 ou 8 dígitos) -> descrição na TIPI. Consultas O(1)."""
+    def __init__(self, descricoes=None, versao=None):
+        self._descricoes = dict(descricoes or {})
+        self.versao = versao or _hash_versao(sorted(self._descricoes))
+    def __getitem__(self, ncm): return self._descricoes[ncm]
+    def __contains__(self, ncm): return ncm in self._descricoes
+    def __iter__(self): return iter(self._descricoes)
+    def __len__(self): return len(self._descricoes)
+
+    @property
+    def empty(self): return not self._descricoes
+
+    def descricao(self, ncm):
+        """Descrição do NCM; sem o NCM exato, a da posição (4 dígitos)."""
+        if self.empty: return "TIPI não carregada"
+        ncm_limpo = str(ncm).replace('.', '').strip()
+        resultado = self._descricoes.get(ncm_limpo)
+        if resultado is None and len(ncm_limpo) >= 4:
+            posicao = ncm_limpo[:4]
+            resultado = self._descricoes.get(posicao)
+            if resultado: resultado = f"[Posição {posicao}] {resultado}"
+        return resultado or "Descrição não encontrada na TIPI"
+
+def _coluna_descricao(df):
+    """Coluna das descrições: a do cabeçalho 'DESCRIÇÃO' (no nome ou nas primeiras linhas); senão a 3ª."""
+    for i, col in enumerate(df.columns):
+        valores = [str(col)] + [str(v) for v in df.iloc[:20, i].tolist()]
+        if any(v.strip().upper().startswith('DESCRI') for v in valores): return i
+    return 2 if df.shape[1] > 2 else df.shape[1] - 1
+
+def compilar_tipi(arquivo):
+    """Lê a planilha (xlsx, ou CSV como alternativa) e monta o IndiceTIPI.
+    NCM repetido (linhas de EX) fica com a primeira descrição."""
     try:
         try: df = pd.read_excel(arquivo, dtype=str)
-        except: df = pd.read_csv(arquivo, dtype=str, on_bad_lines='skip')
-        df['NCM_Limpo'] = df.iloc[:, 0].apply(lambda x: re.sub(r'[^0-9]', '', str(x)))
-        df = df[df['NCM_Limpo'].str.len().isin([4, 8])]
-        return df.set_index('NCM_Limpo')
-    except: return pd.DataFrame()
+        except Exception:
+            if hasattr(arquivo, 'seek'): arquivo.seek(0)
+            df = pd.read_csv(arquivo, dtype=str, on_bad_lines='skip')
+    except Exception: return IndiceTIPI()
+    if df.empty: return IndiceTIPI()
+    ncms = df.iloc[:, 0].str.replace(r'[^0-9]', '', regex=True)
+    validos = ncms.str.len().isin([4, 8]).fillna(False).to_numpy(dtype=bool)
+    descricoes = df.iloc[:, _coluna_descricao(df)].str.strip()
+    tabela = pd.DataFrame({'NCM': ncms[validos], 'Descricao': descricoes[validos]}).drop_duplicates('NCM')
+    return IndiceTIPI(zip(tabela['NCM'].tolist(), tabela['Descricao'].where(tabela['Descricao'].notna(), None).tolist()))
+
+def _chave_tipi(arquivo):
+    if isinstance(arquivo, (str, os.PathLike)):
+        st = os.stat(arquivo)
+        origem = f"{os.path.abspath(arquivo)}|{st.st_mtime_ns}|{st.st_size}"
+    else:
+        import cache
+        origem = cache.hash_conteudo(arquivo)
+    return hashlib.blake2b(f"{VERSAO_TIPI}|{origem}".encode('utf-8'), digest_size=16).hexdigest()
+
+def _ler_artefato_tipi(caminho):
+    try:
+        with open(caminho, 'rb') as f: formato, versao, ncms, descricoes = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError): return None
+    if formato != VERSAO_TIPI: return None
+    return IndiceTIPI(zip(ncms, descricoes), versao)
+
+def _gravar_artefato_tipi(indice, caminho):
+    try:
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        tmp = f"{caminho}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump((VERSAO_TIPI, indice.versao, list(indice), list(indice.values())), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, caminho)
+    except OSError: pass
+
+def carregar_tipi(uploaded_file=None, diretorio_cache=DIR_CACHE_TIPI):
+    """IndiceTIPI do arquivo enviado (ou do tipi.xlsx local), via artefato compilado."""
+    arquivo = uploaded_file if uploaded_file else ("tipi.xlsx" if os.path.exists("tipi.xlsx") else None)
+    if not arquivo: return IndiceTIPI()
+    try: chave = _chave_tipi(arquivo)
+    except OSError: return IndiceTIPI()
+    artefato = os.path.join(diretorio_cache, f"{chave}.tipi") if diretorio_cache else None
+    if artefato:
+        indice = _ler_artefato_tipi(artefato)
+        if indice is not None: return indice
+    indice = compilar_tipi(arquivo)
+    if artefato and not indice.empty: _gravar_artefato_tipi(indice, artefato)
+    return indice
+
+# --- ÍNDICE cClassTrib (classificacao_tributaria.json) ---
+COL_CCLASS = 'Código da Classificação Tributária'
+COL_CST = 'Código da Situação Tributária'
+DOCUMENTOS_FISCAIS = ['NFe', 'NFCe', 'CTe', 'CTe OS', 'BPe', 'NF3e', 'NFCom', 'NFSE', 'BPe TM', 'BPe TA', 'NFAg', 'NFSVIA', 'NFABI', 'NFGas', 'DERE']
+
+RegraCClass = namedtuple('RegraCClass', ['cst', 'descricao', 'reducao_ibs', 'reducao_cbs', 'anexo', 'documentos', 'url'])
+
+class IndiceCClass(Mapping):
+    """cClassTrib -> RegraCClass, somente leitura (serializável pelo st.cache_data)."""
+    def __init__(self, regras=None):
+        self._regras = dict(regras or {})
+        self.versao = _hash_versao(sorted((k, tuple(sorted(v.documentos)), v[:5]) for k, v in self._regras.items()))
+    def __getitem__(self, codigo): return self._regras[codigo]
+    def __iter__(self): return iter(self._regras)
+    def __len__(self): return len(self._regras)
+
+def _percentual(valor):
+    try: return float(str(valor).replace(',', '.')) / 100
+    except: return 0.0
+
+def indexar_cclass(df_json):
+    """Monta (uma vez) o índice imutável cClassTrib -> RegraCClass.
+    Em caso de código repetido vale a primeira linha, como no filtro antigo."""
+    indice = {}
+    if not df_json.empty and COL_CCLASS in df_json.columns and COL_CST in df_json.columns:
+        docs = [d for d in DOCUMENTOS_FISCAIS if d in df_json.columns]
+        for reg in df_json.to_dict('records'):
+            codigo = str(reg[COL_CCLASS]).strip()
+            if codigo in indice: continue
+            indice[codigo] = RegraCClass(
+                cst=str(reg[COL_CST]).strip(),
+                descricao=reg.get('Descrição do Código da Classificação Tributária', ''),
+                reducao_ibs=_percentual(reg.get('Percentual Redução IBS', 0)),
+                reducao_cbs=_percentual(reg.get('Percentual Redução CBS', 0)),
+                anexo=str(reg.get('Número do Anexo', '') or '').strip(),
+                documentos=frozenset(d for d in docs if str(reg[d]).strip() == 'Sim'),
+                url=reg.get('Url da Legislação', ''))
+    return IndiceCClass(indice)
 
 def carregar_json_regras():
+    """Retorna (df_json, indice_cclass)."""
     try:
         with open('classificacao_tributaria.json', 'r', encoding='utf-8') as f:
             dados = json.load(f)
@@ -74,15 +317,16 @@ def carregar_json_regras():
             if 'Descrição do Código da Classificação Tributária' in df.columns:
                 df['Busca'] = df['Descrição do Código da Classificação Tributária'].str.lower()
             else: df['Busca'] = ""
-            return df
-    except: return pd.DataFrame(columns=['Busca'])
+            return df, indexar_cclass(df)
+    except: return pd.DataFrame(columns=['Busca']), IndiceCClass()
 
 def extrair_regras(texto_fonte, mapa_existente, nome_fonte):
     # Lógica de extração de NCMs do texto (mantida)
     texto = re.sub(r'\s+', ' ', texto_fonte)
+    texto_maiusculo = texto.upper()
     anexos_pos = []
     for anexo in CONFIG_ANEXOS.keys():
-        pos = texto.upper().find(anexo)
+        pos = texto_maiusculo.find(anexo)
         if pos != -1: anexos_pos.append((pos, anexo))
     anexos_pos.sort()
     for i in range(len(anexos_pos)):
@@ -91,41 +335,43 @@ def extrair_regras(texto_fonte, mapa_existente, nome_fonte):
         fim = anexos_pos[i+1][0] if i+1 < len(anexos_pos) else len(texto)
         bloco = texto[inicio:fim]
         ncms_raw = re.findall(r'(?<!\d)(\d{2,4}\.?\d{0,2}\.?\d{0,2})(?!\d)', bloco)
-        caps = CONFIG_ANEXOS[nome_anexo]["Caps"]
         for codigo in ncms_raw:
             c = codigo.replace('.', '')
             if len(c) in [4,6,8]:
-                if not caps or any(c.startswith(cap) for cap in caps):
+                if _INDICE_BASE.cap_permitido(nome_anexo, c):
                     if c not in mapa_existente or nome_fonte == "BACKUP":
                         mapa_existente[c] = nome_anexo
     return mapa_existente
 
-def carregar_base_legal():
+def mapa_base_legal(textos=()):
+    """NCM -> Anexo. `textos`: (nome, texto) de fontes extras (ex.: íntegra dos
+    anexos da LC 214); o TEXTO_MESTRA vem por último e prevalece."""
     mapa = {}
+    for nome, texto in textos:
+        mapa = extrair_regras(texto, mapa, nome)
     mapa = extrair_regras(TEXTO_MESTRA, mapa, "BACKUP")
     caps_anexo_vii = ['10', '11', '12'] 
     for cap in caps_anexo_vii:
         if cap not in mapa: mapa[cap] = "ANEXO VII"
     return mapa
 
+def carregar_base_legal(textos=()):
+    return IndiceNCM(mapa_base_legal(textos))
+
 def verificar_seletivo(ncm):
-    ncm = str(ncm).replace('.', '')
-    return any(ncm.startswith(p) for p in ['2203','2204','2205','2206','2207','2208','24','87','93'])
+    return _INDICE_BASE.consultar(ncm)[2]
 
-def obter_cst_final(c_class_trib, df_json):
+def obter_cst_final(c_class_trib, regras_json):
+    """regras_json: índice de indexar_cclass (O(1)) ou o DataFrame do JSON."""
     c_class_trib = str(c_class_trib).strip()
     if c_class_trib in MAPA_CST_CORRETO:
         return MAPA_CST_CORRETO[c_class_trib]
-    if not df_json.empty:
-        col_class = 'Código da Classificação Tributária'
-        col_cst = 'Código da Situação Tributária'
-        if col_class in df_json.columns and col_cst in df_json.columns:
-            match = df_json[df_json[col_class].str.strip() == c_class_trib]
-            if not match.empty:
-                return str(match.iloc[0][col_cst]).strip()
+    if isinstance(regras_json, pd.DataFrame): regras_json = indexar_cclass(regras_json)
+    regra = regras_json.get(c_class_trib)
+    if regra is not None: return regra.cst
     return '000'
 
-def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
+def classificar_item(row, mapa_regras, regras_json, df_tipi, aliq_ibs, aliq_cbs):
     ncm = str(row['NCM']).replace('.', '')
     cfop_raw = str(row['CFOP']).replace('.', '') if 'CFOP' in row else '0000'
     cfop = cfop_raw
@@ -148,15 +394,8 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
     validacao = "⚠️ NCM Ausente (TIPI)"
     if ncm == 'SEM_DETALHE': validacao = "ℹ️ SPED Perfil B"
     elif not df_tipi.empty:
-        if ncm in df_tipi.index: validacao = "✅ NCM Válido"
-        elif ncm[:4] in df_tipi.index: validacao = "✅ Posição Válida"
-
-    # Definição de Grupos CFOP
-    cfops_bonificacao = ['1910', '2910', '5910', '6910']
-    cfops_amostra = ['1911', '2911', '5911', '6911', '5912', '6912', '5913', '6913']
-    cfops_suspensao = ['5901', '6901', '5902', '6902', '5915', '6915', '5916', '6916']
-    cfops_zfm = ['5109', '6109', '5110', '6110']
-    cfops_export = ['7101', '7102', '7127', '7501', '7930', '7949'] 
+        if ncm in df_tipi: validacao = "✅ NCM Válido"
+        elif ncm[:4] in df_tipi: validacao = "✅ Posição Válida"
 
     # Variáveis Padrão
     cClassTrib = '000001'
@@ -168,14 +407,10 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
     v_cbs_final = cbs_padrao
 
     # Passo 1: NCM
-    anexo_encontrado = None
-    for tent in [ncm, ncm[:6], ncm[:4], ncm[:2]]:
-        if tent in mapa_regras:
-            anexo_encontrado = mapa_regras[tent]
-            origem_final = f"{anexo_encontrado} (via {tent})"
-            break
-            
+    indice = indice_ncm(mapa_regras)
+    anexo_encontrado, tent, eh_seletivo = indice.consultar(ncm)
     if anexo_encontrado:
+        origem_final = f"{anexo_encontrado} (via {tent})"
         regra = CONFIG_ANEXOS[anexo_encontrado]
         cClassTrib = regra['cClassTrib']
         desc_final = regra['Descricao']
@@ -183,10 +418,10 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
         fator = regra.get('Reducao', 0.0)
         v_ibs_final = ibs_padrao * (1 - fator)
         v_cbs_final = cbs_padrao * (1 - fator)
-        cst_final = obter_cst_final(cClassTrib, df_json)
+        cst_final = obter_cst_final(cClassTrib, regras_json)
 
     # Passo 2: Sobrescrita CFOP
-    if cfop in cfops_zfm:
+    if cfop in CFOPS_ZFM:
         cClassTrib = '200022' 
         desc_final = f"Venda Incentivada ZFM (Lei Comp. 214/2025)"
         status_final = 'REDUZIDA 100% (ZFM) *Se ALC: Usar CST 550 / cClass 550020' 
@@ -195,7 +430,7 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
         v_ibs_final = 0.0
         v_cbs_final = 0.0
 
-    elif cfop.startswith('7') or cfop in cfops_export:
+    elif cfop.startswith('7') or cfop in CFOPS_EXPORT:
         cClassTrib = '410004'
         desc_final = "Exportação de Bens e Serviços"
         status_final = 'IMUNE (EXP)'
@@ -204,7 +439,7 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
         v_ibs_final = 0.0
         v_cbs_final = 0.0
 
-    elif cfop in cfops_bonificacao:
+    elif cfop in CFOPS_BONIFICACAO:
         cClassTrib = '410001'
         desc_final = f"Bonificação (CFOP {cfop})"
         status_final = 'NÃO INCIDÊNCIA'
@@ -213,7 +448,7 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
         v_ibs_final = 0.0
         v_cbs_final = 0.0
 
-    elif cfop in cfops_amostra:
+    elif cfop in CFOPS_AMOSTRA:
         cClassTrib = '410999'
         desc_final = f"Op. Não Onerosa (Amostra/Brinde)"
         status_final = 'ZERO (Genérico)'
@@ -222,7 +457,7 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
         v_ibs_final = 0.0
         v_cbs_final = 0.0
 
-    elif cfop in cfops_suspensao:
+    elif cfop in CFOPS_SUSPENSAO:
         cClassTrib = '410999' 
         desc_final = f"Suspensão/Retorno (CFOP {cfop})"
         status_final = 'ZERO (Suspensão)'
@@ -233,16 +468,283 @@ def classificar_item(row, mapa_regras, df_json, df_tipi, aliq_ibs, aliq_cbs):
 
     # Crédito Entrada
     cfop_base = cfop[1:]
-    eh_uso_consumo = cfop_base in ['556', '407', '551', '406']
+    eh_uso_consumo = cfop_base in CFOPS_USO_CONSUMO
     if tipo_op == 'ENTRADA' and eh_uso_consumo:
          return '000001', 'Crédito de Uso/Consumo ou Ativo', 'CREDITO PERMITIDO', '000', f'CFOP {cfop}', validacao, 0.0, ibs_padrao+cbs_padrao, ibs_padrao, cbs_padrao
 
-    if verificar_seletivo(ncm):
+    if eh_seletivo:
         return '000001', 'Produto sujeito a Seletivo', 'ALERTA SELETIVO', '002', 'Trava Seletivo', validacao, imposto_atual, v_ibs_final+v_cbs_final, v_ibs_final, v_cbs_final
 
     imposto_futuro = v_ibs_final + v_cbs_final
     return cClassTrib, desc_final, status_final, cst_final, origem_final, validacao, imposto_atual, imposto_futuro, v_ibs_final, v_cbs_final
 
+# --- CLASSIFICAÇÃO EM LOTE (VETORIZADA) ---
+# Mesma cascata de classificar_item, aplicada sobre colunas inteiras.
+# A saída tem que bater exatamente com classificar_item linha a linha.
+def _codigos_texto(df, col, padrao):
+    """(código por linha, valores distintos como str() sem pontos)."""
+    if col not in df.columns: return np.zeros(len(df), dtype=np.intp), np.array([padrao], dtype=object)
+    codigos, unicos = pd.factorize(df[col], use_na_sentinel=False)
+    return codigos, np.array([str(v).replace('.', '') for v in unicos], dtype=object)
+
+def _numero_coluna(df, col):
+    if col not in df.columns: return np.zeros(len(df))
+    return df[col].astype(float).to_numpy()
+
+def _classificar_regras(ncm, cfop, entrada, mapa_regras, regras_json, df_tipi):
+    """Parte da cascata que não depende de valores: retorna as colunas de
+    classificação + 'Fator' (multiplicador do IBS/CBS padrão) e 'Zera Atual'.
+    `entrada` é booleano (Tipo == 'ENTRADA'), o único uso do Tipo na cascata."""
+    idx = ncm.index
+
+    # Validação TIPI
+    validacao = pd.Series("⚠️ NCM Ausente (TIPI)", index=idx, dtype=object)
+    if not df_tipi.empty:
+        validacao = validacao.mask(ncm.str[:4].map(df_tipi.__contains__).astype(bool), "✅ Posição Válida")
+        validacao = validacao.mask(ncm.map(df_tipi.__contains__).astype(bool), "✅ NCM Válido")
+    validacao = validacao.mask(ncm == 'SEM_DETALHE', "ℹ️ SPED Perfil B")
+
+    # Passo 1: NCM (uma consulta à trie por NCM distinto)
+    indice = indice_ncm(mapa_regras)
+    consulta = indice.consultar_serie(ncm)
+    anexo, tent = consulta['Anexo'], consulta['Prefixo']
+    tem_anexo = anexo.notna().to_numpy()
+
+    regras = {nome: CONFIG_ANEXOS[nome] for nome in anexo[tem_anexo].unique()}
+    if isinstance(regras_json, pd.DataFrame): regras_json = indexar_cclass(regras_json)
+    cst_anexo = {nome: obter_cst_final(r['cClassTrib'], regras_json) for nome, r in regras.items()}
+    cclass = np.where(tem_anexo, anexo.map(lambda a: regras[a]['cClassTrib'] if a in regras else None), '000001').astype(object)
+    desc = np.where(tem_anexo, anexo.map(lambda a: regras[a]['Descricao'] if a in regras else None), 'Padrão - Tributação Integral').astype(object)
+    status = np.where(tem_anexo, anexo.map(lambda a: regras[a]['Status'] if a in regras else None), 'PADRAO').astype(object)
+    cst = np.where(tem_anexo, anexo.map(cst_anexo), '000').astype(object)
+    origem = np.where(tem_anexo, anexo.astype(str) + " (via " + tent.astype(str) + ")", "Regra Geral").astype(object)
+    reducao = anexo.map(lambda a: regras[a].get('Reducao', 0.0) if a in regras else 0.0).astype(float).to_numpy()
+    fator = np.where(tem_anexo, 1 - reducao, 1.0)
+
+    # Passo 2: Sobrescrita CFOP (np.select respeita a ordem do if/elif)
+    condicoes = [
+        cfop.isin(CFOPS_ZFM).to_numpy(),
+        (cfop.str.startswith('7') | cfop.isin(CFOPS_EXPORT)).to_numpy(),
+        cfop.isin(CFOPS_BONIFICACAO).to_numpy(),
+        cfop.isin(CFOPS_AMOSTRA).to_numpy(),
+        cfop.isin(CFOPS_SUSPENSAO).to_numpy(),
+    ]
+    sobrescrito = np.logical_or.reduce(condicoes)
+    cclass = np.select(condicoes, ['200022', '410004', '410001', '410999', '410999'], cclass)
+    desc = np.select(condicoes, [
+        "Venda Incentivada ZFM (Lei Comp. 214/2025)", "Exportação de Bens e Serviços",
+        ("Bonificação (CFOP " + cfop + ")").to_numpy(), "Op. Não Onerosa (Amostra/Brinde)",
+        ("Suspensão/Retorno (CFOP " + cfop + ")").to_numpy()], desc)
+    status = np.select(condicoes, [
+        'REDUZIDA 100% (ZFM) *Se ALC: Usar CST 550 / cClass 550020', 'IMUNE (EXP)',
+        'NÃO INCIDÊNCIA', 'ZERO (Genérico)', 'ZERO (Suspensão)'], status)
+    cst = np.select(condicoes, ['200', '410', '410', '410', '410'], cst)
+    origem = np.select(condicoes, ["Regra ZFM/JSON", "Regra Exportação/JSON", "Regra Bonificação/JSON", "Regra CFOP", "Regra CFOP"], origem)
+    fator = np.where(sobrescrito, 0.0, fator)
+
+    # Crédito de entrada (uso/consumo) e trava do Seletivo
+    uso_consumo = (entrada & cfop.str[1:].isin(CFOPS_USO_CONSUMO)).to_numpy()
+    seletivo = ~uso_consumo & consulta['Seletivo'].to_numpy(dtype=bool)
+
+    cclass = np.where(uso_consumo | seletivo, '000001', cclass)
+    desc = np.select([uso_consumo, seletivo], ['Crédito de Uso/Consumo ou Ativo', 'Produto sujeito a Seletivo'], desc)
+    status = np.select([uso_consumo, seletivo], ['CREDITO PERMITIDO', 'ALERTA SELETIVO'], status)
+    cst = np.select([uso_consumo, seletivo], ['000', '002'], cst)
+    origem = np.select([uso_consumo, seletivo], [("CFOP " + cfop).to_numpy(), 'Trava Seletivo'], origem)
+    fator = np.where(uso_consumo, 1.0, fator)
+
+    return pd.DataFrame({
+        'cClassTrib': cclass, 'DescRegra': desc, 'Status': status, 'Novo CST': cst,
+        'Origem Legal': origem, 'Validação TIPI': validacao.to_numpy(),
+        'Fator': fator, 'Zera Atual': uso_consumo,
+    }, index=idx)
+
+# Memo LRU das classificações por chave (NCM, CFOP, Entrada). A versão das
+# regras faz parte da chave, então regras novas nunca reaproveitam entradas
+# antigas (elas só envelhecem até sair pelo limite). Compartilhado entre as
+# tarefas em segundo plano: todo acesso passa pela trava.
+MEMO_MAX_CHAVES = 200000
+_MEMO_CLASSIFICACAO = OrderedDict()
+_TRAVA_MEMO = threading.Lock()
+COLUNAS_REGRA = COLUNAS_CLASSIFICACAO + ['Fator', 'Zera Atual']
+
+def versao_regras(mapa_regras, regras_json, df_tipi):
+    """Identifica o conjunto de regras (Anexos, cClassTrib e TIPI) usado na classificação."""
+    indice = indice_ncm(mapa_regras)
+    if isinstance(regras_json, pd.DataFrame): regras_json = indexar_cclass(regras_json)
+    v_json = getattr(regras_json, 'versao', None) or _hash_versao(sorted(regras_json.items()))
+    v_tipi = 'sem_tipi' if df_tipi.empty else df_tipi.versao
+    return f"{indice.versao}-{v_json}-{v_tipi}"
+
+def classificar_chaves(chaves, mapa_regras, regras_json, df_tipi, versao=None):
+    """Classifica chaves distintas (DataFrame com NCM, CFOP e Entrada) e retorna
+    COLUNAS_REGRA na mesma ordem. Chaves já vistas nesta versão vêm do memo."""
+    if versao is None: versao = versao_regras(mapa_regras, regras_json, df_tipi)
+    tuplas = list(zip(chaves['NCM'], chaves['CFOP'], chaves['Entrada']))
+    linhas = [None] * len(tuplas)
+    faltando = []
+    with _TRAVA_MEMO:
+        for i, t in enumerate(tuplas):
+            achado = _MEMO_CLASSIFICACAO.get((versao,) + t)
+            if achado is None: faltando.append(i)
+            else:
+                _MEMO_CLASSIFICACAO.move_to_end((versao,) + t)
+                linhas[i] = achado
+    if faltando:
+        # A cascata roda fora da trava; duas tarefas podem classificar a mesma chave, com o mesmo resultado
+        novas = chaves.iloc[faltando]
+        res = _classificar_regras(novas['NCM'], novas['CFOP'], novas['Entrada'], mapa_regras, regras_json, df_tipi)
+        with _TRAVA_MEMO:
+            for i, valores in zip(faltando, res[COLUNAS_REGRA].itertuples(index=False, name=None)):
+                linhas[i] = valores
+                _MEMO_CLASSIFICACAO[(versao,) + tuplas[i]] = valores
+            while len(_MEMO_CLASSIFICACAO) > MEMO_MAX_CHAVES: _MEMO_CLASSIFICACAO.popitem(last=False)
+    return pd.DataFrame(linhas, columns=COLUNAS_REGRA, index=chaves.index)
+
+def classificar_regras_df(df, mapa_regras, regras_json, df_tipi, versao=None):
+    """Colunas de regra (COLUNAS_REGRA) para cada linha de df: a cascata roda uma
+    vez por (NCM, CFOP, Tipo) distinto e o resultado é espalhado pelas linhas."""
+    if df.empty: return pd.DataFrame(columns=COLUNAS_REGRA, index=df.index)
+    # Normalização (str sem pontos) só nos valores distintos de cada coluna
+    cod_ncm, ncms = _codigos_texto(df, 'NCM', '')
+    cod_cfop, cfops = _codigos_texto(df, 'CFOP', '0000')
+    entrada = (df['Tipo'] == 'ENTRADA').to_numpy(dtype=bool) if 'Tipo' in df.columns else np.zeros(len(df), dtype=bool)
+    # Chave combinada como inteiro: fatoração em O(n) sem montar tuplas por linha
+    combinado = (cod_ncm.astype(np.int64) * len(cfops) + cod_cfop) * 2 + entrada
+    codigos, unicos = pd.factorize(combinado)
+    chaves = pd.DataFrame({'NCM': ncms[unicos // 2 // len(cfops)],
+                           'CFOP': cfops[unicos // 2 % len(cfops)],
+                           'Entrada': (unicos % 2).astype(bool)})
+    por_chave = classificar_chaves(chaves, mapa_regras, regras_json, df_tipi, versao)
+    res = por_chave.take(codigos)
+    res.index = df.index
+    return res
+
+def preparar_auditoria(df, mapa_regras, regras_json, df_tipi, versao=None):
+    """Tudo o que não depende das alíquotas: colunas de regra, 'Carga Atual' e
+    'Base Líquida'. Guardar este resultado permite trocar IBS/CBS só com aplicar_aliquotas."""
+    if df.empty: return pd.DataFrame(columns=COLUNAS_REGRA + ['Carga Atual', 'Base Líquida'], index=df.index)
+    with desempenho.etapa('classificacao', itens=len(df)):
+        regras = classificar_regras_df(df, mapa_regras, regras_json, df_tipi, versao)
+        valor = _numero_coluna(df, 'Valor')
+        imposto_atual = _numero_coluna(df, 'vICMS') + _numero_coluna(df, 'vPIS') + _numero_coluna(df, 'vCOFINS')
+        diferenca = valor - imposto_atual
+        regras['Carga Atual'] = np.where(regras['Zera Atual'].to_numpy(dtype=bool), 0.0, imposto_atual)
+        regras['Base Líquida'] = np.where(diferenca > 0, diferenca, 0.0)  # max(0, x) também zera NaN
+    return regras
+
+def aplicar_aliquotas(preparado, aliq_ibs, aliq_cbs):
+    """Parte dependente das alíquotas, vetorizada: Carga Projetada, vIBS e vCBS."""
+    base = preparado['Base Líquida'].to_numpy(dtype=float)
+    fator = preparado['Fator'].to_numpy(dtype=float)
+    v_ibs = (base * aliq_ibs) * fator
+    v_cbs = (base * aliq_cbs) * fator
+    return pd.DataFrame({'Carga Projetada': v_ibs + v_cbs, 'vIBS': v_ibs, 'vCBS': v_cbs}, index=preparado.index)
+
+def classificar_df(df, mapa_regras, regras_json, df_tipi, aliq_ibs, aliq_cbs, versao=None):
+    """Versão em lote de classificar_item: devolve um DataFrame com as colunas
+    de COLUNAS_AUDITORIA, alinhado ao índice de df."""
+    if df.empty: return pd.DataFrame(columns=COLUNAS_AUDITORIA, index=df.index)
+    preparado = preparar_auditoria(df, mapa_regras, regras_json, df_tipi, versao)
+    return pd.concat([preparado[COLUNAS_CLASSIFICACAO + ['Carga Atual']], aplicar_aliquotas(preparado, aliq_ibs, aliq_cbs)], axis=1)
+
+# --- VALIDADOR DE TAGS DA REFORMA (VETORIZADO) ---
+# Confronta cClassTrib/vIBS/vCBS informados no XML com o cálculo do sistema,
+# coluna a coluna (sem laço por item).
+
+TOLERANCIA_VALIDADOR = 0.05
+COLUNAS_VALIDADOR = ['Chave NFe', 'Num NFe', 'Produto', 'NCM', 'Valor Produto', 'cClass XML', 'cClass Sistema',
+                     'vIBS XML', 'vIBS Sistema', 'vCBS XML', 'vCBS Sistema', 'Status Classif.', 'Status Valor',
+                     'Recomendação / Esperado']
+
+def validar_tags(df_auditado, tolerancia_ibs=TOLERANCIA_VALIDADOR, tolerancia_cbs=TOLERANCIA_VALIDADOR):
+    """Recebe a saída da auditoria (itens + classificação + alíquotas) e devolve
+    (divergentes, corretos). Valor diverge se |XML - sistema| >= tolerância em vIBS ou vCBS."""
+    if df_auditado.empty: return pd.DataFrame(columns=COLUNAS_VALIDADOR), pd.DataFrame(columns=COLUNAS_VALIDADOR)
+    texto = lambda col: (df_auditado[col].astype(object).where(df_auditado[col].notna(), '').astype(str).str.strip()
+                         if col in df_auditado else pd.Series('', index=df_auditado.index))
+    xml_class, sys_class = texto('XML_cClass'), texto('cClassTrib')
+    xml_ibs, sys_ibs = _numero_coluna(df_auditado, 'XML_vIBS'), _numero_coluna(df_auditado, 'vIBS')
+    xml_cbs, sys_cbs = _numero_coluna(df_auditado, 'XML_vCBS'), _numero_coluna(df_auditado, 'vCBS')
+
+    class_ok = (xml_class == sys_class).to_numpy()
+    valor_ok = (np.abs(xml_ibs - sys_ibs) < tolerancia_ibs) & (np.abs(xml_cbs - sys_cbs) < tolerancia_cbs)
+
+    saida = pd.DataFrame({
+        'Chave NFe': df_auditado['Chave NFe'], 'Num NFe': df_auditado['Num NFe'], 'Produto': df_auditado['Produto'],
+        'NCM': df_auditado['NCM'], 'Valor Produto': _numero_coluna(df_auditado, 'Valor'),
+        'cClass XML': xml_class, 'cClass Sistema': sys_class,
+        'vIBS XML': xml_ibs, 'vIBS Sistema': sys_ibs, 'vCBS XML': xml_cbs, 'vCBS Sistema': sys_cbs,
+        'Status Classif.': np.where(class_ok, "✅ OK", "❌ Divergente"),
+        'Status Valor': np.where(valor_ok, "✅ OK", "❌ Valor Diferente"),
+    }, index=df_auditado.index)
+
+    # Sugestões montadas por concatenação de colunas; " | " só quando há as duas
+    sug_class = ("Alterar cClass de '" + xml_class + "' para '" + sys_class + "'").where(~class_ok, '')
+    sug_valor = pd.Series("Ajustar IBS p/ " + np.char.mod('%.2f', sys_ibs) + " e CBS p/ " + np.char.mod('%.2f', sys_cbs),
+                          index=df_auditado.index, dtype=object).where(~valor_ok, '')
+    separador = pd.Series(np.where(~class_ok & ~valor_ok, ' | ', ''), index=df_auditado.index)
+    saida['Recomendação / Esperado'] = sug_class + separador + sug_valor
+    ok = class_ok & valor_ok
+    saida.loc[ok, 'Recomendação / Esperado'] = "Nenhuma ação necessária"
+    return saida[~ok].reset_index(drop=True), saida[ok].reset_index(drop=True)
+
+# --- CONSULTOR EM LOTE (CADASTROS GRANDES) ---
+# Catálogos exportados do ERP repetem o mesmo NCM milhares de vezes: a planilha
+# é lida em blocos (openpyxl read-only / CSV em chunks) e cada NCM/CFOP distinto
+# é classificado uma vez (classificar_regras_df + memo).
+
+COLUNAS_CONSULTOR = ['NCM Original', 'CFOP', 'Descrição TIPI', 'Novo CST', 'cClassTrib', 'Regra Aplicada', 'Status Tributário']
+
+def _texto_celula(valor):
+    # Como o read_excel(dtype=str): número inteiro guardado como float perde o ".0"
+    if valor is None: return None
+    if isinstance(valor, float) and valor.is_integer(): return str(int(valor))
+    return str(valor)
+
+def ler_planilha_lotes(arquivo, tamanho_lote=50000):
+    """Gera blocos de até tamanho_lote linhas (colunas como texto) de um .csv
+    (separador ';') ou da primeira aba de um .xlsx, sem carregar o arquivo inteiro."""
+    if (nome_arquivo(arquivo) or '').lower().endswith('.csv'):
+        yield from pd.read_csv(arquivo, sep=';', dtype=str, chunksize=tamanho_lote)
+        return
+    from openpyxl import load_workbook
+    livro = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = livro.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None: return
+        colunas = [f"Unnamed: {i}" if c is None else str(c) for i, c in enumerate(cabecalho)]
+        n = len(colunas)
+        bloco = []
+        for linha in linhas:
+            if all(v is None for v in linha): continue
+            valores = [_texto_celula(v) for v in linha[:n]]
+            bloco.append(valores + [None] * (n - len(valores)))
+            if len(bloco) >= tamanho_lote:
+                yield pd.DataFrame(bloco, columns=colunas, dtype=object)
+                bloco = []
+        if bloco: yield pd.DataFrame(bloco, columns=colunas, dtype=object)
+    finally:
+        livro.close()
+
+def consultar_lote(df, col_ncm, col_cfop, mapa_regras, regras_json, df_tipi, versao=None):
+    """Classificação do Consultor para um bloco da planilha (COLUNAS_CONSULTOR).
+    CFOP ausente vale 5102 e a operação é tratada como saída, como na consulta individual."""
+    ncm = df[col_ncm].astype(object)
+    ncm = ncm.where(ncm.notna(), '').map(str)
+    if col_cfop:
+        cfop = df[col_cfop].astype(object)
+        cfop = cfop.where(cfop.notna(), '5102').map(str)
+    else: cfop = pd.Series('5102', index=df.index, dtype=object)
+    regras = classificar_regras_df(pd.DataFrame({'NCM': ncm, 'CFOP': cfop}), mapa_regras, regras_json, df_tipi, versao)
+    descricoes = {v: df_tipi.descricao(v) for v in ncm.unique()}
+    return pd.DataFrame({
+        'NCM Original': ncm, 'CFOP': cfop, 'Descrição TIPI': ncm.map(descricoes),
+        'Novo CST': regras['Novo CST'], 'cClassTrib': regras['cClassTrib'], 'Regra Aplicada': regras['DescRegra'],
+        'Status Tributário': regras['Status'],
+    }, index=df.index)
+
 def extrair_nome_empresa_xml(tree, ns):
     root = tree.getroot()
     emit = root.find('.//ns:emit', ns)
@@ -251,6 +753,10 @@ def extrair_nome_empresa_xml(tree, ns):
         if xNome is not None: return xNome.text
     return "Empresa Desconhecida"
 
+def _mes_emissao(data):
+    """'AAAA-MM' de dhEmi/dEmi (ISO); None se vazio."""
+    return data[:7] if data and len(data) >= 7 else None
+
 # --- LEITURA DE XML (COM TAGS DA REFORMA) ---
 def processar_xml_detalhado(tree, ns, tipo_op='SAIDA'):
     lista = []
@@ -258,6 +764,7 @@ def processar_xml_detalhado(tree, ns, tipo_op='SAIDA'):
     infNFe = root.find('.//ns:infNFe', ns)
     chave = 'N/A'
     num_nfe = 'N/A'
+    mes = None
     
     if infNFe is not None:
         chave = infNFe.attrib.get('Id', '')[3:]
@@ -265,8 +772,12 @@ def processar_xml_detalhado(tree, ns, tipo_op='SAIDA'):
         if ide is not None:
             nNF = ide.find('ns:nNF', ns)
             if nNF is not None: num_nfe = nNF.text
+            emissao = ide.find('ns:dhEmi', ns)
+            if emissao is None: emissao = ide.find('ns:dEmi', ns)  # layout 2.00
+            if emissao is not None: mes = _mes_emissao(emissao.text)
 
     for det in root.findall('.//ns:det', ns):
+        n_item = det.attrib.get('nItem')
         prod = det.find('ns:prod', ns)
         imposto = det.find('ns:imposto', ns)
         
@@ -298,141 +809,573 @@ def processar_xml_detalhado(tree, ns, tipo_op='SAIDA'):
                 except: pass
 
         lista.append({
-            'Cód. Produto': c_prod, 'Chave NFe': chave, 'Num NFe': num_nfe,
+            'Cód. Produto': c_prod, 'Chave NFe': chave, 'Num NFe': num_nfe, 'Nº Item': n_item,
             'NCM': ncm, 'Produto': xProd, 'CFOP': cfop, 'Valor': valor,
-            'vICMS': v_icms, 'vPIS': v_pis, 'vCOFINS': v_cofins, 'Tipo': tipo_op,
+            'vICMS': v_icms, 'vPIS': v_pis, 'vCOFINS': v_cofins, 'Tipo': tipo_op, 'Mês': mes,
             'XML_cClass': xml_cClass if xml_cClass else 'Não Informado',
             'XML_vIBS': xml_vIBS, 'XML_vCBS': xml_vCBS
         })
     return lista
 
+# --- LEITURA DE XML EM FLUXO (iterparse, passada única) ---
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+# Incrementar sempre que mudar o formato dos itens lidos (invalida o cache de leitura)
+VERSAO_PARSER = 4
+
+def processar_xml_stream(fonte, tipo_op='SAIDA', ns=None):
+    """Lê a NF-e (caminho ou arquivo) uma única vez com iterparse, liberando
+    cada <det> assim que termina. Retorna (nome_emitente, itens), com os
+    mesmos campos de processar_xml_detalhado + extrair_nome_empresa_xml."""
+    uri = (ns or {}).get('ns', NS_NFE)
+    T_INF, T_IDE, T_NNF, T_EMIT, T_XNOME, T_DET, T_PROD, T_IMPOSTO = (
+        f'{{{uri}}}{t}' for t in ['infNFe', 'ide', 'nNF', 'emit', 'xNome', 'det', 'prod', 'imposto'])
+    T_EMISSAO = {f'{{{uri}}}dhEmi', f'{{{uri}}}dEmi'}
+    campos_prod = {f'{{{uri}}}{t}': t for t in ['cProd', 'NCM', 'xProd', 'CFOP', 'vProd']}
+
+    chave = 'N/A'; num_nfe = 'N/A'; mes = None
+    emitente = "Empresa Desconhecida"
+    n_inf = 0; n_emit = 0
+    lista = []
+    pilha = []  # elementos abertos (pais do elemento atual)
+    nomes = {}  # cache tag qualificada -> nome local
+    det = None; prod = None; dentro_imposto = False
+
+    for evento, elem in ET.iterparse(fonte, events=('start', 'end')):
+        tag = elem.tag
+        if evento == 'start':
+            pai = pilha[-1].tag if pilha else None
+            pilha.append(elem)
+            if tag == T_INF:
+                n_inf += 1
+                if n_inf == 1: chave = elem.attrib.get('Id', '')[3:]
+            elif tag == T_EMIT: n_emit += 1
+            elif tag == T_DET and det is None:
+                det = {'item': elem.attrib.get('nItem'), 'prod': None, 'vICMS': 0.0, 'vPIS': 0.0, 'vCOFINS': 0.0, 'cClass': None, 'vIBS': 0.0, 'vCBS': 0.0}
+            elif det is not None and pai == T_DET:
+                if tag == T_PROD and det['prod'] is None: prod = det['prod'] = {}
+                elif tag == T_IMPOSTO and not det.get('imposto_lido'): dentro_imposto = det['imposto_lido'] = True
+            continue
+
+        pilha.pop()
+        pai = pilha[-1].tag if pilha else None
+        if det is None:
+            if tag == T_NNF and pai == T_IDE and n_inf == 1 and len(pilha) > 1 and pilha[-2].tag == T_INF: num_nfe = elem.text
+            elif tag in T_EMISSAO and pai == T_IDE and n_inf == 1 and len(pilha) > 1 and pilha[-2].tag == T_INF:
+                if mes is None: mes = _mes_emissao(elem.text)
+            elif tag == T_XNOME and pai == T_EMIT and n_emit == 1: emitente = elem.text
+            continue
+
+        if tag == T_DET:
+            p = det['prod']  # det sem <prod> invalida o documento, como no parser em árvore
+            lista.append({
+                'Cód. Produto': p['cProd'], 'Chave NFe': None, 'Num NFe': None, 'Nº Item': det['item'],
+                'NCM': p['NCM'], 'Produto': p['xProd'], 'CFOP': p['CFOP'], 'Valor': float(p['vProd']),
+                'vICMS': det['vICMS'], 'vPIS': det['vPIS'], 'vCOFINS': det['vCOFINS'], 'Tipo': tipo_op, 'Mês': None,
+                'XML_cClass': det['cClass'] if det['cClass'] else 'Não Informado',
+                'XML_vIBS': det['vIBS'], 'XML_vCBS': det['vCBS']
+            })
+            det = None; prod = None; dentro_imposto = False
+            elem.clear()
+            if pilha: pilha[-1].remove(elem)
+            continue
+
+        if prod is not None and pai == T_PROD and tag in campos_prod:
+            prod.setdefault(campos_prod[tag], elem.text)
+        elif tag == T_PROD: prod = None
+
+        local = nomes.get(tag)
+        if local is None:
+            tag_limpa = tag.split('}')[-1]
+            local = nomes[tag] = (tag_limpa, tag_limpa.lower())
+        tag_limpa, tag_baixa = local
+        if dentro_imposto:
+            if tag == T_IMPOSTO and pai == T_DET: dentro_imposto = False
+            elif tag_limpa in ('vICMS', 'vICMSSN'): det['vICMS'] += float(elem.text)
+            elif tag_limpa == 'vPIS': det['vPIS'] += float(elem.text)
+            elif tag_limpa == 'vCOFINS': det['vCOFINS'] += float(elem.text)
+        if tag_baixa == 'cclasstrib': det['cClass'] = elem.text
+        elif tag_baixa == 'vibs':
+            try: det['vIBS'] = float(elem.text)
+            except: pass
+        elif tag_baixa == 'vcbs':
+            try: det['vCBS'] = float(elem.text)
+            except: pass
+
+    # Cabeçalho só é conhecido por completo no fim do documento
+    for item in lista:
+        item['Chave NFe'] = chave
+        item['Num NFe'] = num_nfe
+        item['Mês'] = mes
+    return emitente, lista
+
+# --- ITENS EM COLUNAS (REPRESENTAÇÃO COMPACTA) ---
+# Os leitores devolvem cada documento como lista de dicts, mas o que fica em
+# memória são colunas: textos repetitivos (NCM, CFOP, Tipo, nota, produto,
+# cClassTrib) como category e valores como float64, alguns bytes por item em
+# vez de um objeto str por campo. Juntar lotes une as categorias (o concat
+# comum transformaria categorias diferentes em object).
+CAMPOS_SPED = ['Cód. Produto', 'Chave NFe', 'Num NFe', 'Nº Item', 'NCM', 'Produto', 'CFOP', 'Valor',
+               'vICMS', 'vPIS', 'vCOFINS', 'Tipo', 'Mês']
+CAMPOS_XML = CAMPOS_SPED + ['XML_cClass', 'XML_vIBS', 'XML_vCBS']
+CAMPOS_VALOR = frozenset(['Valor', 'vICMS', 'vPIS', 'vCOFINS', 'XML_vIBS', 'XML_vCBS'])
+
+def _categoria(valores):
+    cat = pd.Categorical(valores)
+    # Lote vazio ou só com nulos: categorias de texto como as dos outros lotes (senão não se unem)
+    return cat if len(cat.categories) else pd.Categorical(valores, categories=pd.Index([], dtype='str'))
+
+class LoteItens:
+    """Acumula itens coluna a coluna; df() gera o DataFrame compacto do lote."""
+    def __init__(self, campos=CAMPOS_XML):
+        self.campos = campos
+        self._colunas = [[] for _ in campos]
+
+    def __len__(self): return len(self._colunas[0])
+
+    def acrescentar(self, itens):
+        for campo, coluna in zip(self.campos, self._colunas): coluna.extend([item[campo] for item in itens])
+
+    def acrescentar_colunas(self, colunas):
+        """Itens já em colunas (listas na ordem de self.campos), ex.: lidos do cache."""
+        for coluna, valores in zip(self._colunas, colunas): coluna.extend(valores)
+
+    def df(self):
+        return pd.DataFrame({campo: np.array(coluna, dtype=float) if campo in CAMPOS_VALOR else _categoria(coluna)
+                             for campo, coluna in zip(self.campos, self._colunas)})
+
+def itens_df(itens, campos=CAMPOS_XML):
+    """Lista de itens (dicts dos leitores) -> DataFrame compacto."""
+    lote = LoteItens(campos)
+    lote.acrescentar(itens)
+    return lote.df()
+
+def juntar_itens(partes):
+    """Concatena lotes compactos mantendo as colunas category (categorias unidas)."""
+    partes = [p for p in partes if len(p.columns)]
+    if not partes: return pd.DataFrame()
+    if len(partes) == 1: return partes[0].reset_index(drop=True)
+    colunas = {}
+    for col in partes[0].columns:
+        series = [p[col] for p in partes]
+        if all(isinstance(s.dtype, pd.CategoricalDtype) for s in series):
+            try:
+                colunas[col] = union_categoricals(series, sort_categories=True)  # ordenadas: groupby/sort como em texto
+                continue
+            except TypeError: series = [s.astype(object) for s in series]  # categorias de tipos diferentes
+        colunas[col] = pd.concat(series, ignore_index=True)
+    return pd.DataFrame(colunas)
+
+def nome_arquivo(arquivo):
+    """Nome para logs/métricas: upload do Streamlit (.name), caminho ou None."""
+    nome = getattr(arquivo, 'name', arquivo)
+    return nome if isinstance(nome, str) else (os.fspath(nome) if isinstance(nome, os.PathLike) else None)
+
 def to_float(val):
     try: return float(val.replace(',', '.'))
     except: return 0.0
 
 # --- LEITOR SPED UNIVERSAL (FISCAL E CONTRIBUIÇÕES) ---
-def processar_sped_geral(arquivo):
-    vendas = []
-    compras = []
+# Funciona igual para SPED Fiscal (EFD ICMS/IPI) e Contribuições (EFD Contribuições).
+# Leitura em fluxo: o arquivo é decodificado linha a linha e percorrido uma vez só.
+class _ArquivoSped:
+    """Abre caminho, arquivo binário ou UploadedFile do Streamlit para leitura
+    em bytes. Só fecha o que ele mesmo abriu."""
+    def __init__(self, arquivo): self.arquivo = arquivo; self.proprio = None
+    def __enter__(self):
+        if isinstance(self.arquivo, (str, os.PathLike)):
+            self.proprio = open(self.arquivo, 'rb')
+            return self.proprio
+        if hasattr(self.arquivo, 'seek'): self.arquivo.seek(0)
+        return self.arquivo
+    def __exit__(self, *exc):
+        if self.proprio: self.proprio.close()
+
+def _linhas_sped(fh):
+    """Gera (offset_inicial, offset_final, linha) em bytes para cada linha."""
+    # latin-1 decodifica qualquer byte (o mesmo que o decode do arquivo inteiro fazia)
+    pos = 0
+    for bruto in fh:
+        ini, pos = pos, pos + len(bruto)
+        linha = bruto.decode('latin-1')
+        if linha.endswith('\n'): linha = linha[:-1]
+        yield ini, pos, linha
+
+def _mes_sped(data):
+    """DDMMAAAA do SPED -> 'AAAA-MM' (None se não for uma data)."""
+    return f"{data[4:8]}-{data[2:4]}" if len(data) == 8 and data.isdigit() else None
+
+def _abrir_nota_c100(campos):
+    # C100 é comum a ambos, mas campos variam ligeiramente.
+    # O que importa: IND_OPER (Entrada/Saída), NUM_DOC (Número), CHV_NFE (Chave), DT_DOC (mês)
+    # EFD Fiscal: IND_OPER=2, NUM_DOC=8, CHV_NFE=9, DT_DOC=10 (DDMMAAAA)
+    # EFD Contrib: IND_OPER=2, NUM_DOC=8, CHV_NFE=9 (Geralmente compatível)
+    if len(campos) > 9:
+        ind_oper = campos[2] # 0=Entrada, 1=Saída
+        num_nfe = campos[8]
+        chave = campos[9] if len(campos) > 9 and len(campos[9]) == 44 else f"DOC_{num_nfe}"
+
+        # Filtra apenas notas regulares (COD_SIT = 00) se o campo existir
+        # No SPED Contribuições, COD_SIT é campo 6 também.
+        cod_sit = campos[6]
+        if cod_sit in ['00', '01', '06']:
+            return {
+                'Tipo': 'SAIDA' if ind_oper == '1' else 'ENTRADA',
+                'Chave': chave,
+                'Num NFe': num_nfe,
+                'Mês': _mes_sped(campos[10]) if len(campos) > 10 else None
+            }
+    return None
+
+def _item_c170(campos, nota, dados):
+    # SPED Fiscal: NUM_ITEM=2, COD_ITEM=3, CFOP=11, VL_ITEM=7
+    # SPED Contrib: COD_ITEM=3, CFOP= (Não tem no C170, herda da nota ou C170 fiscal), VL_ITEM=7
+    # *ATENÇÃO*: EFD Contribuições NÃO TEM campo CFOP no C170 padrão.
+    cod_item = campos[3]
+    valor = to_float(campos[7])
+    cfop = '0000' # Default se não achar
+
+    # Tenta achar CFOP (Campo 11 no Fiscal)
+    if len(campos) > 11 and len(campos[11]) == 4:
+        cfop = campos[11]
+
+    # Tenta pegar tributos se for layout Fiscal (ICMS campo 15)
+    v_icms = to_float(campos[15]) if len(campos) > 15 else 0.0
+
+    # No Contribuições, PIS/COFINS estão lá pelo campo 25/30+
+    # Vamos simplificar: SPED geralmente serve para pegar a lista de ITENS vendidos.
+    # A auditoria vai recalcular em cima do NCM.
+    return {
+        'Cód. Produto': cod_item,
+        'Chave NFe': nota['Chave'],
+        'Num NFe': nota['Num NFe'],
+        'Nº Item': campos[2],
+        'NCM': dados['NCM'],
+        'Produto': dados['Produto'],
+        'CFOP': cfop,
+        'Valor': valor,
+        'vICMS': v_icms, 'vPIS': 0.0, 'vCOFINS': 0.0,
+        'Tipo': nota['Tipo'],
+        'Mês': nota['Mês']
+    }
+
+def ler_sped_stream(arquivo, tamanho_lote=50000, indice=None):
+    """Gera (nome_empresa, vendas, compras) em lotes de até ~tamanho_lote itens
+    (DataFrames compactos, ver itens_df), com memória limitada pelo lote. Se `indice` (dict) for informado, recebe
+    o índice de offsets do arquivo (ver indexar_sped) na mesma passada. Os itens saem na ordem do arquivo,
+    como em processar_sped_geral: um C170 cujo produto (0200) ainda não apareceu segura o lote a partir
+    dele (só o que vem antes sai) até o 0200 ser lido. No leiaute oficial o bloco 0 vem antes do C e
+    nada fica retido; no pior caso (0200 só no fim) o lote cresce até o fim do arquivo."""
     nome_empresa = "Empresa SPED"
-    
-    # Decodificação segura
-    raw_content = arquivo.getvalue()
-    try: conteudo = raw_content.decode('latin-1')
-    except: 
-        try: conteudo = raw_content.decode('utf-8')
-        except: conteudo = raw_content.decode('latin-1', errors='ignore')
-
-    lines = conteudo.split('\n')
     mapa_produtos = {}
-    
-    # 1. VARREDURA INICIAL (CADASTRO 0200)
-    # Funciona igual para SPED Fiscal (EFD ICMS/IPI) e Contribuições (EFD Contribuições)
-    for linha in lines:
-        if not linha.startswith('|'): continue
-        campos = linha.split('|')
-        reg = campos[1]
-        
-        if reg == '0000' and len(campos) > 6:
-            nome_empresa = campos[6] # Razão Social costuma ser o campo 6 em ambos
-            
-        elif reg == '0200' and len(campos) > 8:
-            # |0200|COD_ITEM|DESCR_ITEM|...|NCM|...
-            # Index: 0='', 1='0200', 2=COD, 3=DESCR, ..., 8=NCM (na maioria dos layouts)
-            cod = campos[2]
-            desc = campos[3]
-            # No SPED Fiscal e Contribuições, NCM costuma ser campo 8
-            ncm = campos[8] if len(campos) > 8 else ""
-            mapa_produtos[cod] = {'NCM': ncm, 'Produto': desc}
-
-    # 2. VARREDURA DE MOVIMENTO (C100/C170)
+    vendas, compras = [], []
+    aguardando = {}  # id(item) -> COD_ITEM sem 0200 no momento da leitura
     nota_atual = None
     buffer_itens = []
-    
+    indexador = _IndexadorSped() if indice is not None else None
+
     def fechar_nota(nota, itens):
         if not nota: return
         # Salva itens acumulados
         if nota['Tipo'] == 'SAIDA': vendas.extend(itens)
         else: compras.extend(itens)
 
-    for linha in lines:
-        if not linha.startswith('|'): continue
-        campos = linha.split('|')
-        reg = campos[1]
-        
-        if reg == 'C100':
-            fechar_nota(nota_atual, buffer_itens)
-            nota_atual = None
-            buffer_itens = []
-            
-            # C100 é comum a ambos, mas campos variam ligeiramente.
-            # O que importa: IND_OPER (Entrada/Saída), NUM_DOC (Número), CHV_NFE (Chave)
-            # EFD Fiscal: IND_OPER=2, NUM_DOC=8, CHV_NFE=9
-            # EFD Contrib: IND_OPER=2, NUM_DOC=8, CHV_NFE=9 (Geralmente compatível)
-            if len(campos) > 9:
-                ind_oper = campos[2] # 0=Entrada, 1=Saída
-                num_nfe = campos[8]
-                chave = campos[9] if len(campos) > 9 and len(campos[9]) == 44 else f"DOC_{num_nfe}"
-                
-                # Filtra apenas notas regulares (COD_SIT = 00) se o campo existir
-                # No SPED Contribuições, COD_SIT é campo 6 também.
-                cod_sit = campos[6]
-                if cod_sit in ['00', '01', '06']: 
-                    nota_atual = {
-                        'Tipo': 'SAIDA' if ind_oper == '1' else 'ENTRADA',
-                        'Chave': chave,
-                        'Num NFe': num_nfe
-                    }
-
-        elif nota_atual and reg == 'C170':
-            # Itens da Nota
-            # SPED Fiscal: COD_ITEM=3, CFOP=11, VL_ITEM=7
-            # SPED Contrib: COD_ITEM=3, CFOP= (Não tem no C170, herda da nota ou C170 fiscal), VL_ITEM=7
-            # *ATENÇÃO*: EFD Contribuições NÃO TEM campo CFOP no C170 padrão.
-            # Mas vamos tentar pegar o básico.
-            if len(campos) > 7:
+    def resolver(item):
+        dados = mapa_produtos.get(aguardando[id(item)])
+        if dados is None: return False
+        item['NCM'] = dados['NCM']
+        item['Produto'] = dados['Produto']
+        del aguardando[id(item)]
+        return True
+
+    def liberar(lista):
+        """(itens que já podem sair, itens retidos): corta no primeiro item ainda sem 0200."""
+        if aguardando:
+            for i, item in enumerate(lista):
+                if id(item) in aguardando and not resolver(item):
+                    return (lista[:i], lista[i:]) if i else ([], lista)
+        return lista, []
+
+    with _ArquivoSped(arquivo) as fh:
+        for ini, fim, linha in _linhas_sped(fh):
+            if not linha.startswith('|'): continue
+            campos = linha.split('|')
+            reg = campos[1]
+            if indexador: indexador.registrar(reg, campos, ini, fim)
+
+            if reg == '0000' and len(campos) > 6:
+                nome_empresa = campos[6] # Razão Social costuma ser o campo 6 em ambos
+
+            elif reg == '0200' and len(campos) > 8:
+                # |0200|COD_ITEM|DESCR_ITEM|...|NCM|...
+                # Index: 0='', 1='0200', 2=COD, 3=DESCR, ..., 8=NCM (na maioria dos layouts)
+                mapa_produtos[campos[2]] = {'NCM': campos[8], 'Produto': campos[3]}
+
+            elif reg == 'C100':
+                fechar_nota(nota_atual, buffer_itens)
+                buffer_itens = []
+                nota_atual = _abrir_nota_c100(campos)
+                if len(vendas) + len(compras) >= tamanho_lote:
+                    prontos_v, vendas = liberar(vendas)
+                    prontos_c, compras = liberar(compras)
+                    if prontos_v or prontos_c:
+                        yield nome_empresa, itens_df(prontos_v, CAMPOS_SPED), itens_df(prontos_c, CAMPOS_SPED)
+
+            elif nota_atual and reg == 'C170' and len(campos) > 7:
                 cod_item = campos[3]
-                dados = mapa_produtos.get(cod_item, {'NCM': '', 'Produto': f'Item {cod_item}'})
-                
-                valor = to_float(campos[7])
-                cfop = '0000' # Default se não achar
-                
-                # Tenta achar CFOP (Campo 11 no Fiscal)
-                if len(campos) > 11 and len(campos[11]) == 4:
-                    cfop = campos[11]
-                
-                # Tenta pegar tributos se for layout Fiscal (ICMS campo 15)
-                v_icms = to_float(campos[15]) if len(campos) > 15 else 0.0
-                
-                # No Contribuições, PIS/COFINS estão lá pelo campo 25/30+
-                # Vamos simplificar: SPED geralmente serve para pegar a lista de ITENS vendidos.
-                # A auditoria vai recalcular em cima do NCM.
-                
-                buffer_itens.append({
-                    'Cód. Produto': cod_item, 
-                    'Chave NFe': nota_atual['Chave'], 
-                    'Num NFe': nota_atual['Num NFe'],
-                    'NCM': dados['NCM'], 
-                    'Produto': dados['Produto'],
-                    'CFOP': cfop, 
-                    'Valor': valor,
-                    'vICMS': v_icms, 'vPIS': 0.0, 'vCOFINS': 0.0,
-                    'Tipo': nota_atual['Tipo']
-                })
+                dados = mapa_produtos.get(cod_item)
+                item = _item_c170(campos, nota_atual, dados or {'NCM': '', 'Produto': f'Item {cod_item}'})
+                if dados is None: aguardando[id(item)] = cod_item
+                buffer_itens.append(item)
 
     fechar_nota(nota_atual, buffer_itens)
+    if indexador: indice.update(indexador.resultado(arquivo))
+    # Último lote: quem achou o 0200 é resolvido; quem não achou fica sem NCM, como antes
+    if aguardando:
+        for item in vendas + compras:
+            if id(item) in aguardando: resolver(item)
+    yield nome_empresa, itens_df(vendas, CAMPOS_SPED), itens_df(compras, CAMPOS_SPED)
+
+def processar_sped_geral(arquivo):
+    """Arquivo inteiro: (nome_empresa, DataFrame de vendas, DataFrame de compras)."""
+    vendas = []
+    compras = []
+    nome_empresa = "Empresa SPED"
+    with desempenho.etapa('leitura_sped', nome_arquivo(arquivo)) as medida:
+        for nome_empresa, lote_v, lote_c in ler_sped_stream(arquivo):
+            vendas.append(lote_v)
+            compras.append(lote_c)
+        vendas, compras = juntar_itens(vendas), juntar_itens(compras)
+        medida.itens = len(vendas) + len(compras)
     return nome_empresa, vendas, compras
 
-# --- PROCESSADOR DE ZIP XML (MANTIDO) ---
-def processar_zip_xml(zip_file, ns):
-    lista_final = []
+# --- ÍNDICE DE BLOCOS DO SPED (ACESSO POR OFFSET) ---
+# Guarda onde (em bytes) começa e termina cada bloco, cada sequência de um
+# mesmo registro e cada documento C100 (com seus filhos C1xx), para que
+# consultas pontuais leiam só o trecho necessário em vez do arquivo todo.
+VERSAO_INDICE_SPED = 1
+
+class _IndexadorSped:
+    def __init__(self):
+        self.blocos = {}      # '0', 'C', ... -> [ini, fim]
+        self.registros = {}   # '0200', 'C190', ... -> [[ini, fim], ...] (trechos contíguos)
+        self.documentos = {}  # chave -> [[ini, fim], ...]
+        self._doc = None      # (chave, ini) do C100 aberto
+        self._fim = 0
+
+    def registrar(self, reg, campos, ini, fim):
+        bloco = self.blocos.get(reg[:1])
+        if bloco: bloco[1] = fim
+        else: self.blocos[reg[:1]] = [ini, fim]
+        trechos = self.registros.setdefault(reg, [])
+        if trechos and trechos[-1][1] == ini: trechos[-1][1] = fim
+        else: trechos.append([ini, fim])
+
+        if self._doc and (reg == 'C100' or not reg.startswith('C1')): self._fechar_doc(ini)
+        if reg == 'C100':
+            num_nfe = campos[8] if len(campos) > 8 else ''
+            chave = campos[9] if len(campos) > 9 and len(campos[9]) == 44 else f"DOC_{num_nfe}"
+            self._doc = (chave, ini)
+        self._fim = fim
+
+    def _fechar_doc(self, fim):
+        chave, ini = self._doc
+        self.documentos.setdefault(chave, []).append([ini, fim])
+        self._doc = None
+
+    def resultado(self, arquivo):
+        if self._doc: self._fechar_doc(self._fim)
+        return {'versao': VERSAO_INDICE_SPED, 'tamanho': self._fim, 'mtime': _mtime(arquivo),
+                'blocos': self.blocos, 'registros': self.registros, 'documentos': self.documentos}
+
+def _mtime(arquivo):
+    return os.path.getmtime(arquivo) if isinstance(arquivo, (str, os.PathLike)) else None
+
+def indexar_sped(arquivo):
+    """Varre o SPED uma vez e devolve o índice de offsets (dict serializável em JSON)."""
+    indexador = _IndexadorSped()
+    with _ArquivoSped(arquivo) as fh:
+        for ini, fim, linha in _linhas_sped(fh):
+            if linha.startswith('|'):
+                campos = linha.split('|')
+                indexador.registrar(campos[1], campos, ini, fim)
+    return indexador.resultado(arquivo)
+
+def caminho_indice_sped(caminho_sped): return f"{caminho_sped}.idx.json"
+
+def salvar_indice_sped(indice, caminho_sped):
+    with open(caminho_indice_sped(caminho_sped), 'w', encoding='utf-8') as f:
+        json.dump(indice, f)
+
+def carregar_indice_sped(caminho_sped):
+    """Índice salvo ao lado do arquivo, ou None se não existir ou estiver desatualizado."""
+    try:
+        with open(caminho_indice_sped(caminho_sped), 'r', encoding='utf-8') as f:
+            indice = json.load(f)
+    except (OSError, ValueError): return None
+    if (indice.get('versao') != VERSAO_INDICE_SPED or indice.get('tamanho') != os.path.getsize(caminho_sped)
+            or indice.get('mtime') != os.path.getmtime(caminho_sped)): return None
+    return indice
+
+def obter_indice_sped(caminho_sped):
+    indice = carregar_indice_sped(caminho_sped)
+    if indice is None:
+        indice = indexar_sped(caminho_sped)
+        salvar_indice_sped(indice, caminho_sped)
+    return indice
+
+def _ler_trecho(fh, ini, fim):
+    fh.seek(ini)
+    for bruto in fh.read(fim - ini).split(b'\n'):
+        linha = bruto.decode('latin-1')
+        if linha.startswith('|'): yield linha.split('|')
+
+def ler_registros_sped(arquivo, indice, reg):
+    """Gera os campos de todas as linhas de um tipo de registro (ex.: '0200', 'C190')."""
+    with _ArquivoSped(arquivo) as fh:
+        for ini, fim in indice['registros'].get(reg, []):
+            for campos in _ler_trecho(fh, ini, fim):
+                if campos[1] == reg: yield campos
+
+def produtos_sped(arquivo, indice):
+    """Cadastro 0200 (COD_ITEM -> NCM/Produto) lido direto pelos offsets."""
+    return {c[2]: {'NCM': c[8], 'Produto': c[3]} for c in ler_registros_sped(arquivo, indice, '0200') if len(c) > 8}
+
+def itens_sped_por_chave(arquivo, indice, chave, mapa_produtos=None):
+    """Itens (mesmos campos de processar_sped_geral) de um documento pela chave,
+    lendo só o trecho do C100 correspondente."""
+    if mapa_produtos is None: mapa_produtos = produtos_sped(arquivo, indice)
+    itens = []
+    with _ArquivoSped(arquivo) as fh:
+        for ini, fim in indice['documentos'].get(chave, []):
+            nota = None
+            for campos in _ler_trecho(fh, ini, fim):
+                if campos[1] == 'C100': nota = _abrir_nota_c100(campos)
+                elif nota and campos[1] == 'C170' and len(campos) > 7:
+                    dados = mapa_produtos.get(campos[3], {'NCM': '', 'Produto': f'Item {campos[3]}'})
+                    itens.append(_item_c170(campos, nota, dados))
+    return itens
+
+def ler_documento_xml(fonte, tipo_op, ns, cache_docs=None):
+    """(emitente, itens em colunas de CAMPOS_XML) de um XML (caminho, arquivo ou bytes).
+    Com `cache_docs` (cache.CacheParse), o documento é procurado pelo hash do próprio
+    conteúdo e, se for lido agora, guardado; cada XML tem a sua entrada."""
+    if cache_docs is not None:
+        chave = cache_docs.chave(fonte, contexto=f"xml|{tipo_op}|{VERSAO_PARSER}")
+        achado = cache_docs.obter_documento(chave, len(fonte) if isinstance(fonte, bytes) else getattr(fonte, 'size', 0))
+        if achado is not None: return achado[0]['empresa'], achado[1]
+    emitente, itens = processar_xml_stream(io.BytesIO(fonte) if isinstance(fonte, bytes) else fonte, tipo_op, ns)
+    colunas = [[item[campo] for item in itens] for campo in CAMPOS_XML]
+    if cache_docs is not None: cache_docs.guardar_documento(chave, {'empresa': emitente}, colunas)
+    return emitente, colunas
+
+# --- PROCESSADOR DE ZIP XML (PARALELO) ---
+PARALELO_MIN_DOCS = 1000  # abaixo disso o custo de subir os processos não compensa
+
+def _ler_membros_zip(zip_file, nomes, ns, tipo_op, cache_docs=None):
+    """Lê um lote de membros do ZIP (roda dentro de cada processo do pool) e
+    devolve (documentos, emitente do primeiro documento lido ou None, DataFrame
+    compacto, (hits, misses, bytes poupados) no cache_docs); o DataFrame é também
+    o que trafega entre os processos."""
+    lote, primeiro = LoteItens(), None
+    antes = (cache_docs.hits, cache_docs.misses, cache_docs.bytes_poupados) if cache_docs is not None else (0, 0, 0)
     with zipfile.ZipFile(zip_file) as z:
-        for filename in z.namelist():
-            if filename.lower().endswith('.xml'):
-                try:
+        for filename in nomes:
+            try:
+                if cache_docs is None:
                     with z.open(filename) as f:
-                        tree = ET.parse(f)
-                        itens = processar_xml_detalhado(tree, ns, 'SAIDA')
-                        lista_final.extend(itens)
-                except: pass
-    return lista_final
+                        emitente, itens = processar_xml_stream(f, tipo_op, ns)
+                        lote.acrescentar(itens)
+                else:
+                    emitente, colunas = ler_documento_xml(z.read(filename), tipo_op, ns, cache_docs)
+                    lote.acrescentar_colunas(colunas)
+                if primeiro is None: primeiro = emitente
+            except: pass
+    depois = (cache_docs.hits, cache_docs.misses, cache_docs.bytes_poupados) if cache_docs is not None else (0, 0, 0)
+    return len(nomes), primeiro, lote.df(), tuple(d - a for d, a in zip(depois, antes))
+
+def _zip_em_disco(zip_file):
+    """Os processos abrem o ZIP pelo caminho; uploads em memória vão para um temporário."""
+    if isinstance(zip_file, (str, os.PathLike)): return zip_file, None
+    zip_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as tmp:
+        shutil.copyfileobj(zip_file, tmp)
+    return tmp.name, tmp.name
+
+def ler_zip_stream(zip_file, ns, tipo_op='SAIDA', workers=None, progresso=None, estatisticas=None, tamanho_lote=250,
+                   cache_docs=None):
+    """Lê os XMLs do ZIP em lotes distribuídos entre `workers` processos
+    (None = todos os núcleos; 1 = sequencial) e gera o DataFrame de itens de
+    cada lote (itens_df), na ordem do ZIP. progresso(feitos, total) é chamado a cada lote;
+    `estatisticas` (dict), se informado, recebe documentos, itens, segundos, docs/s e
+    o emitente do primeiro documento lido. No paralelo, no máximo 2 x workers lotes
+    ficam em andamento ou prontos à espera do consumidor (memória limitada).
+    `cache_docs` (cache.CacheParse): cada membro é procurado/guardado pelo próprio
+    conteúdo (ler_documento_xml), então um ZIP que mudou em parte só relê o que mudou."""
+    inicio = time.perf_counter()
+    with zipfile.ZipFile(zip_file) as z:
+        nomes = [n for n in z.namelist() if n.lower().endswith('.xml')]
+    total = len(nomes)
+    lotes = [nomes[i:i + tamanho_lote] for i in range(0, total, tamanho_lote)]
+    workers = min(workers or os.cpu_count() or 1, len(lotes)) if lotes else 1
+
+    n_itens = 0
+    feitos = 0
+    emitente = None
+    if progresso: progresso(0, total)
+    paralelo = workers > 1 and total >= PARALELO_MIN_DOCS
+    if not paralelo:
+        resultados = (_ler_membros_zip(zip_file, lote, ns, tipo_op, cache_docs) for lote in lotes)
+        for n, primeiro, itens, _ in resultados:  # os acessos já foram contados no próprio cache_docs
+            if emitente is None: emitente = primeiro
+            n_itens += len(itens)
+            feitos += n
+            if progresso: progresso(feitos, total)
+            yield itens
+    else:
+        caminho, temporario = _zip_em_disco(zip_file)
+        try:
+            # spawn: o Streamlit roda o script em thread, e fork + threads não é seguro
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            try:
+                # Janela de lotes: um novo lote só é enviado quando o mais antigo é entregue
+                restantes, pendentes = iter(lotes), deque()
+                def enviar():
+                    for lote in islice(restantes, 2 * workers - len(pendentes)):
+                        pendentes.append(pool.submit(_ler_membros_zip, caminho, lote, ns, tipo_op, cache_docs))
+                enviar()
+                while pendentes:
+                    n, primeiro, itens, acessos = pendentes.popleft().result()
+                    enviar()
+                    if cache_docs is not None: cache_docs.contar(*acessos)  # cada processo contou na sua cópia
+                    if emitente is None: emitente = primeiro
+                    n_itens += len(itens)
+                    feitos += n
+                    if progresso: progresso(feitos, total)
+                    yield itens
+            finally:
+                # Quem para no meio (erro, cancelamento no progresso) não espera os lotes que faltam
+                pool.shutdown(wait=True, cancel_futures=True)
+        finally:
+            if temporario: os.remove(temporario)
+
+    if cache_docs is not None: cache_docs.despejar()
+    if estatisticas is not None:
+        segundos = time.perf_counter() - inicio
+        estatisticas.update({'documentos': total, 'itens': n_itens, 'segundos': segundos,
+                             'docs_por_segundo': total / segundos if segundos > 0 else 0.0,
+                             'workers': workers if paralelo else 1, 'emitente': emitente})
+
+def processar_zip_xml(zip_file, ns, tipo_op='SAIDA', workers=None, progresso=None, estatisticas=None, tamanho_lote=250):
+    """Lê todos os XMLs do ZIP (ver ler_zip_stream) e devolve um DataFrame de itens."""
+    with desempenho.etapa('leitura_zip', nome_arquivo(zip_file)) as medida:
+        df = juntar_itens(list(ler_zip_stream(zip_file, ns, tipo_op, workers, progresso, estatisticas, tamanho_lote)))
+        medida.itens = len(df)
+    return df
+
+# --- LINHA DE COMANDO ---
+# python -m motor audit --saidas pasta/ --sped efd.txt --destino resultado/
+# python -m motor build-rules [--texto anexos_lc214.txt]
+if __name__ == '__main__':
+    import sys
+    import auditoria_lote
+    sys.exit(auditoria_lote.main())
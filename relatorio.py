@@ -1,12 +1,80 @@
 from fpdf import FPDF
 from datetime import datetime
 import pandas as pd
+import io
+import zipfile
+import desempenho
+
+# --- TABELAS DO LAUDO ---
+# (coluna do DataFrame, título, largura em mm, alinhamento, formato)
+# formato: 'moeda', 'inteiro' ou quantos caracteres do texto cabem (None = todos)
+LAYOUT_ITENS = [('Cód. Produto', 'Cód.', 18, 'C', 10), ('Produto', 'Produto', 57, 'L', 40), ('NCM', 'NCM', 18, 'C', None),
+                ('Novo CST', 'CST', 10, 'C', None), ('cClassTrib', 'cClass', 17, 'C', None),
+                ('Valor', 'Valor Base', 35, 'R', 'moeda'), ('Carga Projetada', 'IBS+CBS', 35, 'R', 'moeda')]
+LAYOUT_AGREGADO = [('NCM', 'NCM', 25, 'C', None), ('Novo CST', 'CST', 15, 'C', None), ('cClassTrib', 'cClass', 20, 'C', None),
+                   ('Itens', 'Itens', 20, 'R', 'inteiro'), ('Valor', 'Valor Base', 55, 'R', 'moeda'),
+                   ('Carga Projetada', 'IBS+CBS', 55, 'R', 'moeda')]
+CHAVES_AGREGADO = ['NCM', 'cClassTrib', 'Novo CST']
+ALTURA_LINHA = 6
+LIMITE_Y_TABELA = 270  # linha que começaria abaixo disto vai para a próxima página
+LIMITE_AMOSTRA_PDF = 200
+LINHAS_MIN_PAGINA = 30  # cota inferior de linhas por página de tabela (cabem 37), para estimar o total de páginas
+# modo do laudo -> o que vai nas tabelas de Saídas/Entradas
+MODOS_PDF = {'amostra': f'Primeiros {LIMITE_AMOSTRA_PDF} itens', 'completo': 'Todos os itens',
+             'agregado': 'Agrupado por NCM / cClassTrib / CST'}
+
+def _texto_coluna(df, coluna, formato):
+    if formato == 'moeda':
+        valores = df[coluna].astype(float) if coluna in df.columns else pd.Series(0.0, index=df.index)
+        return 'R$ ' + valores.map('{:,.2f}'.format)
+    if formato == 'inteiro': return df[coluna].astype('int64').map('{:,}'.format)
+    if coluna not in df.columns: return pd.Series('', index=df.index, dtype=object)
+    textos = df[coluna].astype(object).map(str)
+    return textos.str[:formato] if formato else textos
+
+def _colunas_tabela(df, layout, pdf):
+    """Por coluna do layout: (texto já escapado p/ o PDF, deslocamento x dentro da
+    célula). Largura e escape são calculados uma vez por texto distinto, com a
+    fonte atual do pdf (fonte core: só Latin-1; o resto vira '?')."""
+    cw, escala, margem = pdf.current_font.cw, pdf.font_size_pt / 1000 / pdf.k, pdf.c_margin
+    colunas = []
+    for coluna, _, largura, alinhamento, formato in layout:
+        textos = _texto_coluna(df, coluna, formato)
+        escapados, deslocamentos = {}, {}
+        for texto in textos.unique():
+            seguro = texto.encode('latin-1', 'replace').decode('latin-1')
+            escapados[texto] = seguro.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            if alinhamento == 'L': deslocamentos[texto] = margem
+            else:
+                w = sum(cw.get(ch, 0) for ch in seguro) * escala
+                deslocamentos[texto] = largura - margem - w if alinhamento == 'R' else (largura - w) / 2
+        colunas.append((textos.map(escapados).to_numpy(dtype=object), textos.map(deslocamentos).to_numpy(dtype=float)))
+    return colunas
+
+def agregar_itens(df):
+    """Uma linha por (NCM, cClassTrib, Novo CST): quantidade de itens e somas de
+    Valor e Carga Projetada, maior carga primeiro. Somas parciais podem ser
+    reagregadas (CHAVES_AGREGADO + 'Itens'), o que a auditoria em lote usa por lote."""
+    chaves = [c for c in CHAVES_AGREGADO if c in df.columns]
+    base = df.reindex(columns=chaves + ['Valor', 'Carga Projetada', 'Itens'])
+    if 'Itens' not in df.columns: base['Itens'] = 1
+    base = base.fillna({'Valor': 0.0, 'Carga Projetada': 0.0})
+    agregado = base.groupby(chaves, dropna=False, sort=False, observed=True)[['Itens', 'Valor', 'Carga Projetada']].sum()
+    return agregado.reset_index().sort_values('Carga Projetada', ascending=False, kind='stable', ignore_index=True)
 
 class PDFAuditoria(FPDF):
     def __init__(self, empresa):
         super().__init__()
         self.empresa = empresa
         self.data_emissao = datetime.now().strftime("%d/%m/%Y")
+        self.alias_paginas = '{nb}'
+
+    def reservar_paginas(self, maximo):
+        """O total de páginas entra no rodapé só no fim (alias), no espaço que o fpdf
+        reserva pelo tamanho do alias; o '{nb}' padrão cabe só 3 algarismos."""
+        digitos = len(str(maximo))
+        self.alias_paginas = '{nb}' if digitos <= 3 else '{' + 'n' * (digitos - 2) + '}'
+        self.alias_nb_pages(self.alias_paginas, align='C')
 
     def header(self):
         # Cabeçalho da PÁGINA (Logo/Título)
@@ -29,7 +97,7 @@ class PDFAuditoria(FPDF):
         self.set_y(-15)
         self.set_font('Helvetica', 'I', 8)
         self.set_text_color(128)
-        self.cell(0, 10, f'Página {self.page_no()}/{{nb}} - Gerado por cClass Auditor AI', align='C')
+        self.cell(0, 10, f'Página {self.page_no()}/{self.alias_paginas} - Gerado por cClass Auditor AI', align='C')
 
     def chapter_title(self, label):
         self.set_font('Helvetica', 'B', 12)
@@ -63,98 +131,311 @@ class PDFAuditoria(FPDF):
         self.set_text_color(0)
         self.ln(10)
 
-    def _imprimir_cabecalho_tabela(self):
+    def _imprimir_cabecalho_tabela(self, layout):
         """Método auxiliar para desenhar o cabeçalho da tabela"""
         self.set_font('Helvetica', 'B', 7)
         self.set_fill_color(230, 126, 34) # Laranja
         self.set_text_color(255) # Branco
-        
-        # Definição das Larguras (Total ~190mm)
-        # Cód(18) | Prod(57) | NCM(18) | CST(10) | cClass(17) | Val(35) | Imp(35)
-        
-        self.cell(18, 7, 'Cód.', 1, 0, 'C', True)
-        self.cell(57, 7, 'Produto', 1, 0, 'C', True)
-        self.cell(18, 7, 'NCM', 1, 0, 'C', True)
-        self.cell(10, 7, 'CST', 1, 0, 'C', True)
-        self.cell(17, 7, 'cClass', 1, 0, 'C', True) # Nova Coluna
-        self.cell(35, 7, 'Valor Base', 1, 0, 'C', True)
-        self.cell(35, 7, 'IBS+CBS', 1, 1, 'C', True)
-
-    def tabela_itens(self, df):
-        # Imprime cabeçalho na primeira vez
-        self._imprimir_cabecalho_tabela()
-        
+        for n, (_, titulo, largura, _, _) in enumerate(layout):
+            self.cell(largura, 7, titulo, 1, 1 if n == len(layout) - 1 else 0, 'C', True)
+
+    def _estilo_linhas(self):
         self.set_font('Helvetica', '', 6) # Fonte menor para caber tudo
         self.set_text_color(0)
         self.set_fill_color(245, 245, 245)
-        
-        fill = False
-        # Aumentei o limite para 200 itens para testar paginação
-        for _, row in df.head(200).iterrows():
-            
-            # --- LÓGICA DE PAGINAÇÃO ---
-            # Se estiver perto do fim da página (270mm), cria nova e repete cabeçalho
-            if self.get_y() > 270:
+
+    def tabela_itens(self, df, layout=None, nota=None):
+        """Tabela zebrada com cabeçalho repetido a cada página. Os textos vêm
+        pré-formatados por coluna (_colunas_tabela) e cada página é desenhada de
+        uma vez: quantas linhas cabem sai da altura fixa, sem get_y() por linha."""
+        layout = layout or LAYOUT_ITENS
+        self._imprimir_cabecalho_tabela(layout)
+        self._estilo_linhas()
+        colunas = _colunas_tabela(df, layout, self)
+        i, total = 0, len(df)
+        while i < total:
+            # Mesmo critério de antes: nova página se a próxima linha começaria depois de 270mm
+            if self.get_y() > LIMITE_Y_TABELA:
                 self.add_page()
-                self._imprimir_cabecalho_tabela()
-                # Restaura configurações da fonte de dados
-                self.set_font('Helvetica', '', 6)
-                self.set_text_color(0)
-                self.set_fill_color(245, 245, 245)
-
-            # Preparação dos Dados
-            cod = str(row.get('Cód. Produto', ''))[:10]
-            prod = str(row['Produto'])[:40] # Corta texto longo
-            ncm = str(row['NCM'])
-            cst = str(row.get('Novo CST', ''))
-            cclass = str(row.get('cClassTrib', '')) # Nova Coluna
-            val = f"R$ {row.get('Valor', 0):,.2f}"
-            imp = f"R$ {row.get('Carga Projetada', 0):,.2f}"
-            
-            # Desenho da Linha
-            self.cell(18, 6, cod, 1, 0, 'C', fill)
-            self.cell(57, 6, prod, 1, 0, 'L', fill)
-            self.cell(18, 6, ncm, 1, 0, 'C', fill)
-            self.cell(10, 6, cst, 1, 0, 'C', fill)
-            self.cell(17, 6, cclass, 1, 0, 'C', fill) # Nova Coluna
-            self.cell(35, 6, val, 1, 0, 'R', fill)
-            self.cell(35, 6, imp, 1, 1, 'R', fill)
-            
-            fill = not fill # Alterna cor (Zebrado)
-            
+                self._imprimir_cabecalho_tabela(layout)
+                self._estilo_linhas()
+            y = self.get_y()
+            fim = min(total, i + int((LIMITE_Y_TABELA - y) / ALTURA_LINHA + 1e-9) + 1)
+            self._desenhar_linhas(colunas, layout, i, fim, y)
+            self.set_y(y + (fim - i) * ALTURA_LINHA)
+            i = fim
         self.ln(5)
-        self.set_font('Helvetica', 'I', 8)
-        self.cell(0, 5, '* Listagem de itens limitada para otimização do documento.', ln=True)
+        if nota:
+            self.set_font('Helvetica', 'I', 8)
+            self.cell(0, 5, nota, ln=True)
+
+    def _desenhar_linhas(self, colunas, layout, ini, fim, y):
+        # Equivale a cell(largura, 6, texto, 1, ..., fill) para cada célula das linhas
+        # ini..fim-1, mas emitido como um único trecho de conteúdo da página.
+        k, altura_pag = self.k, self.h
+        self.text(self.l_margin, y, '')  # registra a fonte atual nesta página
+        xs, x = [], self.l_margin
+        for _, _, largura, _, _ in layout:
+            xs.append(x)
+            x += largura
+        base = 0.5 * ALTURA_LINHA + 0.3 * self.font_size
+        h_linha = -ALTURA_LINHA * k
+        bordas, textos = [], [f"q {self.text_color.serialize().lower()} BT /F{self.current_font.i} {self.font_size_pt:.2f} Tf"]
+        for n in range(ini, fim):
+            topo = (altura_pag - y) * k
+            op = 'B' if n % 2 else 'S'  # zebrado: linhas ímpares preenchidas
+            linha_y = (altura_pag - y - base) * k
+            for c, (_, _, largura, _, _) in enumerate(layout):
+                bordas.append(f"{xs[c] * k:.2f} {topo:.2f} {largura * k:.2f} {h_linha:.2f} re {op}")
+                texto, dx = colunas[c][0][n], colunas[c][1][n]
+                if texto: textos.append(f"1 0 0 1 {(xs[c] + dx) * k:.2f} {linha_y:.2f} Tm ({texto}) Tj")
+            y += ALTURA_LINHA
+        textos.append("ET Q")
+        self._out("\n".join(bordas + textos))
+
+def gerar_pdf_bytes(empresa, df_vendas, df_compras, totais=None, versao_regras=None, modo='amostra'):
+    """totais=(débito, crédito) substitui as somas dos DataFrames; usado quando
+    eles são só uma amostra (auditoria em lote, que não guarda todos os itens).
+    versao_regras, se informada, sai no resumo para rastrear qual base foi usada.
+    modo (MODOS_PDF): 'amostra' lista os primeiros itens, 'completo' todos e
+    'agregado' um total por NCM/cClassTrib/CST (aceita somas já agregadas)."""
+    with desempenho.etapa('pdf', itens=len(df_vendas) + len(df_compras)):
+        return _gerar_pdf(empresa, df_vendas, df_compras, totais, versao_regras, modo)
+
+def _tabela_pdf(df, modo):
+    """(DataFrame da tabela, layout, nota de rodapé) conforme o modo do laudo."""
+    if modo == 'agregado': return agregar_itens(df), LAYOUT_AGREGADO, None
+    if modo == 'completo': return df, LAYOUT_ITENS, None
+    return df.head(LIMITE_AMOSTRA_PDF), LAYOUT_ITENS, '* Listagem de itens limitada para otimização do documento.'
 
-def gerar_pdf_bytes(empresa, df_vendas, df_compras):
+def _gerar_pdf(empresa, df_vendas, df_compras, totais, versao_regras, modo):
+    if modo not in MODOS_PDF: raise ValueError(f"modo de laudo desconhecido: {modo}")
+    tabelas = [_tabela_pdf(df, modo) if not df.empty else None for df in (df_vendas, df_compras)]
     pdf = PDFAuditoria(empresa)
-    pdf.alias_nb_pages()
+    # Resumo + uma página a mais por tabela (início parcial) + as páginas cheias
+    pdf.reservar_paginas(2 + sum(1 + len(t[0]) // LINHAS_MIN_PAGINA for t in tabelas if t))
     pdf.add_page()
     
     # 1. Resumo
     pdf.chapter_title("1. Resumo Executivo")
-    deb = df_vendas['Carga Projetada'].sum() if not df_vendas.empty else 0
-    cred = df_compras['Carga Projetada'].sum() if not df_compras.empty else 0
+    if totais is not None: deb, cred = totais
+    else:
+        deb = df_vendas['Carga Projetada'].sum() if not df_vendas.empty else 0
+        cred = df_compras['Carga Projetada'].sum() if not df_compras.empty else 0
     saldo = deb - cred
     pdf.card_resumo(deb, cred, saldo)
+    if versao_regras:
+        pdf.set_font('Helvetica', 'I', 8)
+        pdf.cell(0, 5, f'Versão da base de regras: {versao_regras}', ln=True)
+        pdf.ln(3)
     
-    # Colunas necessárias para a nova tabela
-    cols = ['Cód. Produto', 'Produto', 'NCM', 'Novo CST', 'cClassTrib', 'Valor', 'Carga Projetada']
+    if modo == 'agregado': titulos = ("Saídas por NCM / cClassTrib / CST (Débitos)", "Entradas por NCM / cClassTrib / CST (Créditos)")
+    else: titulos = ("Detalhamento de Saídas (Débitos)", "Detalhamento de Entradas (Créditos)")
 
     # 2. Vendas
-    if not df_vendas.empty:
-        pdf.chapter_title("2. Detalhamento de Saídas (Débitos)")
-        # Garante que as colunas existem antes de copiar
-        cols_v = [c for c in cols if c in df_vendas.columns]
-        df_v = df_vendas[cols_v].copy()
-        pdf.tabela_itens(df_v)
+    if tabelas[0]:
+        pdf.chapter_title(f"2. {titulos[0]}")
+        pdf.tabela_itens(*tabelas[0])
         
     # 3. Compras
-    if not df_compras.empty:
+    if tabelas[1]:
         pdf.add_page()
-        pdf.chapter_title("3. Detalhamento de Entradas (Créditos)")
-        cols_c = [c for c in cols if c in df_compras.columns]
-        df_c = df_compras[cols_c].copy()
-        pdf.tabela_itens(df_c)
+        pdf.chapter_title(f"3. {titulos[1]}")
+        pdf.tabela_itens(*tabelas[1])
         
-    return bytes(pdf.output())
\ No newline at end of file
+    return bytes(pdf.output())
+# --- EXPORTAÇÕES EXCEL (usadas pelo app e pela auditoria em lote) ---
+COLUNAS_EXIBICAO = ['Cód. Produto', 'Descrição Produto', 'NCM', 'CFOP', 'Novo CST', 'cClassTrib', 'DescRegra', 'Valor', 'vICMS', 'vPIS', 'vCOFINS', 'Carga Atual', 'vIBS', 'vCBS', 'Carga Projetada', 'Validação TIPI']
+COLUNAS_SANEAMENTO_BASE = ['NCM', 'CFOP', 'Produto']
+COLUNAS_SANEAMENTO_EXTRA = ['Novo CST', 'cClassTrib', 'DescRegra', 'Status', 'Validação TIPI']
+LIMITE_LINHAS_EXCEL = 1048576  # linhas por aba no .xlsx, cabeçalho incluso
+LOTE_EXPORTACAO = 50000
+# formato -> (extensão do arquivo, MIME) dos "Dados Completos"
+FORMATOS_EXPORTACAO = {
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('zip', 'application/zip'),
+    'parquet': ('zip', 'application/zip'),
+}
+
+def formatar_ncm_pontos(ncm):
+    n = str(ncm).replace('.', '').replace(' ', '').strip()
+    if len(n) == 8: return f"{n[:4]}.{n[4:6]}.{n[6:]}"
+    if len(n) == 4: return f"{n[:2]}.{n[2:]}"
+    return n
+
+def criar_link_lei(ncm):
+    ncm_fmt = formatar_ncm_pontos(ncm)
+    link = f"https://www.planalto.gov.br/ccivil_03/leis/lcp/lcp214.htm#:~:text={ncm_fmt}"
+    return f'=HYPERLINK("{link}", "📜 Base Legal")'
+
+def links_consultor(ncm):
+    """'Link Conferência (Web)' (Cosmos) e 'Base Legal (Clique Aqui)' (fórmula
+    HYPERLINK), montados uma vez por NCM distinto e espalhados pelas linhas."""
+    limpos = {v: str(v).replace('.', '').strip() for v in ncm.unique()}
+    return pd.DataFrame({
+        'Link Conferência (Web)': ncm.map({v: f"https://cosmos.bluesoft.com.br/ncms/{l}" for v, l in limpos.items()}),
+        'Base Legal (Clique Aqui)': ncm.map({v: criar_link_lei(l) for v, l in limpos.items()}),
+    }, index=ncm.index)
+
+def preparar_exibicao(df):
+    if df.empty: return df
+    cols_existentes = [c for c in COLUNAS_EXIBICAO if c in df.columns or c == 'Descrição Produto']
+    if 'Produto' in df.columns:
+        return df.rename(columns={'Produto': 'Descrição Produto'})[cols_existentes]
+    return df[cols_existentes]
+
+def resumo_saneamento(df):
+    """Uma linha por (NCM, CFOP, Produto), com a primeira classificação encontrada."""
+    cols_presentes = [c for c in COLUNAS_SANEAMENTO_BASE + COLUNAS_SANEAMENTO_EXTRA if c in df.columns]
+    return df[cols_presentes].groupby(COLUNAS_SANEAMENTO_BASE, as_index=False).first()
+
+def _lotes(df, tamanho=None):
+    tamanho = tamanho or LOTE_EXPORTACAO
+    for ini in range(0, len(df), tamanho): yield df.iloc[ini:ini + tamanho]
+
+def gerar_dados_completos(df_v, df_c, formato='xlsx'):
+    """Itens auditados (colunas de exibição): .xlsx com abas Saidas e Entradas ou,
+    para volumes além da planilha, .zip com uma CSV/Parquet por tipo (FORMATOS_EXPORTACAO)."""
+    output = io.BytesIO()
+    escritor = PlanilhaFluxo(output) if formato == 'xlsx' else PacoteFluxo(output, formato)
+    with desempenho.etapa(f'{"excel" if formato == "xlsx" else formato}_completo', itens=len(df_v) + len(df_c)), escritor:
+        for nome, df in (('Saidas', df_v), ('Entradas', df_c)):
+            for lote in _lotes(df): escritor.escrever(nome, preparar_exibicao(lote))
+    return output.getvalue()
+
+def gerar_excel_saneamento(df_v, df_c):
+    """Aceita os itens ou o resumo já pronto (Agregados.saneamento)."""
+    output = io.BytesIO()
+    with desempenho.etapa('excel_saneamento', itens=len(df_v) + len(df_c)), PlanilhaFluxo(output, larguras={2: 40}) as planilha:
+        for df, aba in ((df_v, 'Resumo_Saidas'), (df_c, 'Resumo_Entradas')):
+            if df.empty: continue
+            df_resumo = resumo_saneamento(df)
+            df_resumo['Base Legal (Clique Aqui)'] = df_resumo['NCM'].map({n: criar_link_lei(n) for n in df_resumo['NCM'].unique()})
+            planilha.escrever(aba, df_resumo)
+    return output.getvalue()
+
+class PlanilhaFluxo:
+    """Escreve DataFrames em lotes num .xlsx sem manter a planilha em memória
+    (xlsxwriter com constant_memory: cada linha vai para o disco ao ser escrita).
+    Uma aba que chega ao limite de linhas do Excel continua em "<aba> (2)", "(3)"...
+    larguras: {índice da coluna: largura} para fugir do padrão."""
+    def __init__(self, destino, largura_coluna=18, larguras=None):
+        import xlsxwriter
+        self.livro = xlsxwriter.Workbook(destino, {'constant_memory': True, 'nan_inf_to_errors': True})
+        self.largura_coluna = largura_coluna
+        self.larguras = larguras or {}
+        self._abas = {}  # nome -> [worksheet, linha atual, parte, colunas]
+
+    def _nova_parte(self, nome, parte, colunas):
+        titulo = nome if parte == 1 else f"{nome} ({parte})"
+        ws = self.livro.add_worksheet(titulo[:31])
+        ws.set_column(0, max(len(colunas) - 1, 0), self.largura_coluna)
+        for col, largura in self.larguras.items():
+            if col < len(colunas): ws.set_column(col, col, largura)
+        ws.write_row(0, 0, colunas)
+        self._abas[nome] = [ws, 1, parte, colunas]
+
+    def escrever(self, nome, df):
+        if df.empty: return
+        with desempenho.etapa('excel', nome, len(df)):
+            # Convertido para object em lotes: nunca uma cópia inteira de um DataFrame grande
+            for lote in _lotes(df): self._escrever(nome, lote)
+
+    def _escrever(self, nome, df):
+        if nome not in self._abas: self._nova_parte(nome, 1, [str(c) for c in df.columns])
+        estado = self._abas[nome]
+        # Nulos viram células vazias; a ordem das colunas segue a do primeiro lote
+        dados = df.reindex(columns=estado[3]).astype(object)
+        dados = dados.where(dados.notna(), None)
+        for linha in dados.itertuples(index=False, name=None):
+            if estado[1] >= LIMITE_LINHAS_EXCEL:
+                self._nova_parte(nome, estado[2] + 1, estado[3])
+                estado = self._abas[nome]
+            estado[0].write_row(estado[1], 0, linha)
+            estado[1] += 1
+
+    def fechar(self):
+        if not self._abas: self.livro.add_worksheet('Vazio')
+        self.livro.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.fechar()
+
+def esquema_arrow(df):
+    """Esquema Parquet de um lote, com as colunas category como texto: o dicionário
+    muda de um lote para outro e não caberia no esquema do primeiro."""
+    import pyarrow as pa
+    esquema = pa.Table.from_pandas(df, preserve_index=False).schema
+    return pa.schema([c.with_type(c.type.value_type) if pa.types.is_dictionary(c.type) else c for c in esquema],
+                     metadata=esquema.metadata)
+
+class PacoteFluxo:
+    """Alternativa ao .xlsx sem limite de linhas: um .zip com um arquivo por aba,
+    CSV (';' e vírgula decimal, UTF-8 com BOM, como o Excel pt-BR abre) ou Parquet,
+    escrito em lotes. As abas são gravadas uma de cada vez (o zip só aceita um
+    arquivo aberto): voltar a uma aba já encerrada é erro."""
+    def __init__(self, destino, formato='csv'):
+        if formato not in ('csv', 'parquet'): raise ValueError(f"formato não suportado: {formato}")
+        self.formato = formato
+        self.zip = zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED)
+        self._atual = None  # [nome, arquivo no zip, escritor, colunas]
+        self._encerradas = set()
+
+    def escrever(self, nome, df):
+        if df.empty: return
+        with desempenho.etapa(self.formato, nome, len(df)):
+            for lote in _lotes(df): self._escrever(nome, lote)
+
+    def _abrir(self, nome, df):
+        if nome in self._encerradas: raise ValueError(f"aba {nome} já foi encerrada")
+        self._encerrar()
+        membro = self.zip.open(f"{nome}.{self.formato}", 'w', force_zip64=True)
+        colunas = [str(c) for c in df.columns]
+        if self.formato == 'csv':
+            escritor = io.TextIOWrapper(membro, encoding='utf-8-sig', newline='')
+            df.head(0).set_axis(colunas, axis=1).to_csv(escritor, sep=';', index=False, lineterminator='\r\n')
+        else:
+            import pyarrow.parquet as pq
+            escritor = pq.ParquetWriter(membro, esquema_arrow(df.set_axis(colunas, axis=1)))
+        self._atual = [nome, membro, escritor, colunas]
+
+    def _escrever(self, nome, df):
+        if self._atual is None or self._atual[0] != nome: self._abrir(nome, df)
+        _, _, escritor, colunas = self._atual
+        df = df.set_axis([str(c) for c in df.columns], axis=1).reindex(columns=colunas)
+        if self.formato == 'csv':
+            df.to_csv(escritor, sep=';', decimal=',', index=False, header=False, lineterminator='\r\n')
+        else:
+            import pyarrow as pa
+            escritor.write_table(pa.Table.from_pandas(df, schema=escritor.schema, preserve_index=False))
+
+    def _encerrar(self):
+        if self._atual is None: return
+        nome, membro, escritor, _ = self._atual
+        if self.formato == 'csv': escritor.flush(); escritor.detach()
+        else: escritor.close()
+        membro.close()
+        self._encerradas.add(nome)
+        self._atual = None
+
+    def fechar(self):
+        self._encerrar()
+        self.zip.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.fechar()
+
+def gerar_excel_conciliacao(ocorrencias):
+    """Ocorrências da conciliação XML x SPED (conciliacao.COLUNAS) numa aba."""
+    output = io.BytesIO()
+    with desempenho.etapa('excel_conciliacao', itens=len(ocorrencias)), PlanilhaFluxo(output, larguras={1: 46}) as planilha:
+        for lote in _lotes(ocorrencias): planilha.escrever('Conciliacao', lote)
+    return output.getvalue()
+
+def gerar_excel_validacao(df_div, df_corr):
+    """Relatório do Validador XML: abas Divergentes e Corretos."""
+    output = io.BytesIO()
+    with PlanilhaFluxo(output) as planilha:
+        planilha.escrever('Divergentes', df_div)
+        planilha.escrever('Corretos', df_corr)
+    return output.getvalue()
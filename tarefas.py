@@ -0,0 +1,137 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import desempenho
+
+# --- TAREFAS EM SEGUNDO PLANO ---
+# Leituras e classificações longas rodam num pool de threads local, fora da
+# execução do script do Streamlit. O estado de cada tarefa (fila, andamento,
+# resultados parciais, resultado final ou erro) fica no Executor, que vive
+# enquanto o servidor viver: um rerun só consulta a tarefa, nunca a refaz. A
+# função de trabalho recebe a própria tarefa como primeiro argumento e informa
+# o andamento por ela; cancelar() faz a próxima chamada de progresso()/parcial()
+# lançar Cancelada. As funções de trabalho não podem usar st.*: quem aplica o
+# resultado à sessão é o script, depois que a tarefa termina.
+
+FILA, EXECUTANDO, CONCLUIDA, CANCELADA, ERRO = 'na fila', 'executando', 'concluída', 'cancelada', 'erro'
+TERMINADOS = frozenset([CONCLUIDA, CANCELADA, ERRO])
+RETENCAO_SEGUNDOS = 3600  # tarefas terminadas e não recolhidas (sessão fechada) saem depois disso
+
+class Cancelada(Exception):
+    """Lançada dentro da função de trabalho quando a tarefa é cancelada."""
+
+class Andamento:
+    """O que uma função de trabalho usa para informar o andamento. Esta base não
+    guarda nada (leitura feita direto no script, sem tarefa)."""
+    def progresso(self, feitos, total=None, texto=None): pass
+    def parcial(self, valor): pass
+    def verificar(self): pass
+
+class Tarefa(Andamento):
+    def __init__(self, nome, chave=None):
+        self.id = uuid.uuid4().hex
+        self.nome, self.chave = nome, chave
+        self.estado = FILA
+        self.feitos, self.total, self.texto = 0, None, None
+        self.resultado = self.erro = None
+        self.criada, self.inicio, self.fim = time.time(), None, None
+        self._parciais = []
+        self._cancelar = threading.Event()
+        self._trava = threading.Lock()
+        self._future = None
+
+    def progresso(self, feitos, total=None, texto=None):
+        """Também serve como callback progresso(feitos, total) do motor."""
+        self.verificar()
+        self.feitos, self.total = feitos, total
+        if texto is not None: self.texto = texto
+
+    def parcial(self, valor):
+        """Publica um resultado parcial (ex.: um lote de itens já lido)."""
+        self.verificar()
+        with self._trava: self._parciais.append(valor)
+
+    def parciais(self):
+        with self._trava: return list(self._parciais)
+
+    def verificar(self):
+        if self._cancelar.is_set(): raise Cancelada()
+
+    def cancelar(self):
+        self._cancelar.set()
+        if self._future is not None and self._future.cancel():  # ainda na fila: nem começa
+            self._encerrar(CANCELADA)
+
+    @property
+    def terminada(self): return self.estado in TERMINADOS
+
+    @property
+    def fracao(self):
+        """Andamento entre 0 e 1 (None se o total não é conhecido)."""
+        return min(self.feitos / self.total, 1.0) if self.total else None
+
+    def _encerrar(self, estado):
+        self.estado, self.fim = estado, time.time()
+        if estado != CONCLUIDA:
+            with self._trava: self._parciais.clear()
+
+class Executor:
+    """Pool de `workers` threads e registro das tarefas enviadas (compartilhado entre sessões)."""
+    def __init__(self, workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tarefa')
+        self._tarefas = {}
+        self._trava = threading.Lock()
+
+    def enviar(self, nome, funcao, *args, chave=None, sinks=(), **kwargs):
+        """Enfileira funcao(tarefa, *args, **kwargs) e devolve a Tarefa. Com `chave`, uma
+        tarefa igual na fila, executando ou concluída é devolvida em vez de criar outra.
+        `sinks`: instrumentação (desempenho) ligada na thread durante a tarefa."""
+        with self._trava:
+            self._podar()
+            if chave is not None:
+                for tarefa in self._tarefas.values():
+                    if tarefa.chave == chave and tarefa.estado not in (CANCELADA, ERRO): return tarefa
+            tarefa = Tarefa(nome, chave)
+            self._tarefas[tarefa.id] = tarefa
+            tarefa._future = self._pool.submit(self._rodar, tarefa, funcao, args, kwargs, list(sinks))
+        return tarefa
+
+    @staticmethod
+    def _rodar(tarefa, funcao, args, kwargs, sinks):
+        if tarefa._cancelar.is_set():
+            tarefa._encerrar(CANCELADA)
+            return
+        tarefa.estado, tarefa.inicio = EXECUTANDO, time.time()
+        if sinks: desempenho.configurar(*sinks)
+        try:
+            with desempenho.etapa('tarefa', tarefa.nome):
+                tarefa.resultado = funcao(tarefa, *args, **kwargs)
+            tarefa._encerrar(CONCLUIDA)
+        except Cancelada:
+            tarefa._encerrar(CANCELADA)
+        except Exception as e:
+            tarefa.erro = f"{type(e).__name__}: {e}"
+            tarefa._encerrar(ERRO)
+        finally:
+            desempenho.desligar()  # a thread volta para o pool
+
+    def obter(self, id_tarefa):
+        return self._tarefas.get(id_tarefa)
+
+    def cancelar(self, id_tarefa):
+        tarefa = self._tarefas.get(id_tarefa)
+        if tarefa is not None: tarefa.cancelar()
+
+    def descartar(self, id_tarefa):
+        """Esquece a tarefa (depois que o resultado foi aplicado); cancela se ainda estiver rodando."""
+        with self._trava: tarefa = self._tarefas.pop(id_tarefa, None)
+        if tarefa is not None and not tarefa.terminada: tarefa.cancelar()
+
+    def listar(self):
+        with self._trava: return list(self._tarefas.values())
+
+    def _podar(self):
+        limite = time.time() - RETENCAO_SEGUNDOS
+        for id_tarefa in [i for i, t in self._tarefas.items() if t.terminada and t.fim < limite]:
+            del self._tarefas[id_tarefa]
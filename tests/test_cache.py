@@ -0,0 +1,94 @@
+# Cache de leitura (cache.CacheParse): acerto, falta, despejo LRU e uma
+# entrada por documento XML (arquivo solto ou membro de ZIP).
+import os
+import zipfile
+import pandas as pd
+import cache
+import motor
+from benchmark import geradores
+
+NS = {'ns': motor.NS_NFE}
+
+def _cache(tmp_path, limite=1024 * 1024 * 1024):
+    return cache.CacheParse(str(tmp_path / 'cache'), limite)
+
+def test_acerto_e_falta(tmp_path):
+    c = _cache(tmp_path)
+    chave = c.chave(b'conteudo', contexto='sped|1')
+    assert c.obter(chave) is None
+    df = pd.DataFrame({'NCM': ['1006', '2202'], 'Valor': [1.0, 2.5]})
+    c.guardar(chave, df, {'empresa': 'X'})
+    achado = c.obter(chave, bytes_origem=8)
+    assert achado is not None
+    pd.testing.assert_frame_equal(achado[0], df)
+    assert achado[1] == {'empresa': 'X'}
+    assert (c.hits, c.misses, c.bytes_poupados) == (1, 1, 8)
+    assert c.chave(b'conteudo', contexto='sped|2') != chave
+    assert not [n for n in os.listdir(c.diretorio) if n.endswith('.tmp')]
+
+def test_despejo_lru(tmp_path):
+    c = _cache(tmp_path)
+    df = pd.DataFrame({'Valor': range(2000)})
+    for i, chave in enumerate(['a', 'b', 'c']):
+        c.guardar(chave, df)
+        os.utime(os.path.join(c.diretorio, chave + '.parquet'), (1000 + i, 1000 + i))
+    c.obter('a')  # 'a' passa a ser a mais recente; 'b' é a menos usada
+    por_entrada = c.tamanho_total() / 3
+    c.limite_bytes = int(por_entrada * 2.5)
+    c.despejar()
+    assert c.obter('b') is None
+    assert c.obter('a') is not None and c.obter('c') is not None
+    assert not os.path.exists(os.path.join(c.diretorio, 'b.json'))
+
+def test_documentos_entram_no_despejo(tmp_path):
+    c = _cache(tmp_path)
+    for i in range(5):
+        c.guardar_documento(f'd{i}', {'empresa': 'X'}, [[str(i)] * 100])
+        os.utime(os.path.join(c.diretorio, f'd{i}.doc'), (1000 + i, 1000 + i))
+    c.limite_bytes = int(c.tamanho_total() / 5 * 2.5)
+    c.despejar()
+    assert [i for i in range(5) if c.obter_documento(f'd{i}') is not None] == [3, 4]
+
+def _pasta(tmp_path, n):
+    pasta = tmp_path / 'xml'
+    pasta.mkdir(exist_ok=True)
+    for i in range(n):
+        (pasta / f'n{i}.xml').write_bytes(geradores.gerar_nfe(3, seed=i))
+    return sorted(str(p) for p in pasta.iterdir())
+
+def _ler(arquivos, c):
+    lote = motor.LoteItens()
+    for arquivo in arquivos: lote.acrescentar_colunas(motor.ler_documento_xml(arquivo, 'SAIDA', NS, c)[1])
+    return lote.df()
+
+def test_uma_entrada_por_xml(tmp_path):
+    c = _cache(tmp_path)
+    arquivos = _pasta(tmp_path, 4)
+    primeira = _ler(arquivos[:3], c)
+    assert (c.hits, c.misses) == (0, 3)
+    # Acrescentar um XML ao conjunto só lê o novo
+    todas = _ler(arquivos, c)
+    assert (c.hits, c.misses) == (3, 4)
+    assert len(todas) == 12
+    pd.testing.assert_frame_equal(todas.head(9).astype(str), primeira.astype(str))
+    sem_cache = motor.itens_df([i for a in arquivos for i in motor.processar_xml_stream(a, 'SAIDA', NS)[1]])
+    pd.testing.assert_frame_equal(todas.astype(str), sem_cache.astype(str))
+
+def test_uma_entrada_por_membro_do_zip(tmp_path):
+    c = _cache(tmp_path)
+    caminho = str(tmp_path / 'notas.zip')
+    def gravar(seeds):
+        with zipfile.ZipFile(caminho, 'w') as z:
+            for i, seed in enumerate(seeds): z.writestr(f'n{i}.xml', geradores.gerar_nfe(2, seed=seed))
+    gravar([0, 1, 2, 3])
+    stats = {}
+    lido = motor.juntar_itens(list(motor.ler_zip_stream(caminho, NS, workers=1, estatisticas=stats, cache_docs=c)))
+    assert (c.hits, c.misses) == (0, 4)
+    assert stats['emitente'] == 'Empresa Benchmark LTDA'
+    # Um membro trocado: só ele é relido
+    gravar([0, 1, 99, 3])
+    relido = motor.juntar_itens(list(motor.ler_zip_stream(caminho, NS, workers=1, cache_docs=c)))
+    assert (c.hits, c.misses) == (3, 5)
+    assert len(relido) == len(lido) == 8
+    esperado = motor.processar_zip_xml(caminho, NS, workers=1)
+    pd.testing.assert_frame_equal(relido.astype(str), esperado.astype(str))
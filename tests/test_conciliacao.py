@@ -0,0 +1,105 @@
+# Conciliação XML x SPED por item (conciliacao.conciliar_df): notas e itens de
+# um lado só, divergências de produto/NCM/CFOP/valor, espelho do CFOP nas
+# entradas e lados vazios, com DataFrames comuns e compactos (categóricos).
+import pandas as pd
+import pytest
+import conciliacao
+import motor
+
+CHAVE_A, CHAVE_B, CHAVE_C = '3' * 43 + '1', '3' * 43 + '2', '3' * 43 + '3'
+
+def _item(chave, n, produto='P1', ncm='10063021', cfop='5102', valor=10.0):
+    return {'Chave NFe': chave, 'Nº Item': n, 'Cód. Produto': produto, 'NCM': ncm, 'CFOP': cfop, 'Valor': valor}
+
+def _df(itens, compacto):
+    if not compacto: return pd.DataFrame(itens, columns=list(_item('', '')))
+    campos = motor.CAMPOS_SPED
+    padrao = {c: 0.0 if c in motor.CAMPOS_VALOR else '' for c in campos}
+    return motor.itens_df([dict(padrao, **i) for i in itens], campos)
+
+def _ocorrencias(resultado):
+    return sorted((r['Ocorrência'], r['Chave NFe'], str(r['Nº Item'])) for _, r in resultado.iterrows())
+
+@pytest.fixture(params=[False, True], ids=['objeto', 'compacto'])
+def compacto(request):
+    return request.param
+
+def test_itens_que_conferem_nao_geram_ocorrencia(compacto):
+    # '001' no XML e '1' no SPED são o mesmo item
+    xml = _df([_item(CHAVE_A, '001'), _item(CHAVE_A, '002', produto='P2', valor=5.0)], compacto)
+    sped = _df([_item(CHAVE_A, '1'), _item(CHAVE_A, '2', produto='P2', valor=5.004)], compacto)
+    resultado = conciliacao.conciliar_df(xml, sped)
+    assert resultado.empty
+    assert list(resultado.columns) == conciliacao.COLUNAS
+    assert conciliacao.resumir(resultado).sum() == 0
+
+def test_notas_de_um_lado_so(compacto):
+    xml = _df([_item(CHAVE_A, '1'), _item(CHAVE_B, '1', valor=7.0), _item(CHAVE_B, '2', valor=3.0)], compacto)
+    sped = _df([_item(CHAVE_A, '1'), _item(CHAVE_C, '1', valor=4.0)], compacto)
+    resultado = conciliacao.conciliar_df(xml, sped)
+    assert _ocorrencias(resultado) == [('Nota fora do SPED', CHAVE_B, 'nan'), ('Nota sem XML', CHAVE_C, 'nan')]
+    notas = resultado.set_index('Ocorrência')
+    assert notas.loc['Nota fora do SPED', 'Valor XML'] == 10.0
+    assert notas.loc['Nota fora do SPED', 'Diferença'] == 10.0
+    assert notas.loc['Nota sem XML', 'Valor SPED'] == 4.0
+    assert notas.loc['Nota sem XML', 'Diferença'] == -4.0
+
+def test_itens_de_um_lado_so_e_duplicados(compacto):
+    xml = _df([_item(CHAVE_A, '1'), _item(CHAVE_A, '2'), _item(CHAVE_A, '3'), _item(CHAVE_A, '3')], compacto)
+    sped = _df([_item(CHAVE_A, '1'), _item(CHAVE_A, '1'), _item(CHAVE_A, '4')], compacto)
+    resultado = conciliacao.conciliar_df(xml, sped)
+    # A primeira ocorrência do item duplicado ainda é conciliada normalmente
+    assert _ocorrencias(resultado) == [('Item duplicado no SPED', CHAVE_A, '1'), ('Item duplicado no XML', CHAVE_A, '3'),
+                                       ('Item fora do SPED', CHAVE_A, '2'), ('Item fora do SPED', CHAVE_A, '3'),
+                                       ('Item sem XML', CHAVE_A, '4')]
+
+def test_divergencias_nas_saidas(compacto):
+    xml = _df([_item(CHAVE_A, '1', produto='P1'), _item(CHAVE_A, '2', ncm='22021000'),
+               _item(CHAVE_A, '3', cfop='5405'), _item(CHAVE_A, '4', valor=10.0),
+               _item(CHAVE_A, '5', ncm='')], compacto)
+    sped = _df([_item(CHAVE_A, '1', produto='X9'), _item(CHAVE_A, '2', ncm='22029900'),
+                _item(CHAVE_A, '3', cfop='5102'), _item(CHAVE_A, '4', valor=12.5),
+                _item(CHAVE_A, '5', ncm='10063021')], compacto)  # NCM vazio de um lado não diverge
+    resultado = conciliacao.conciliar_df(xml, sped)
+    assert _ocorrencias(resultado) == [('CFOP divergente', CHAVE_A, '3'), ('NCM divergente', CHAVE_A, '2'),
+                                       ('Produto divergente', CHAVE_A, '1'), ('Valor divergente', CHAVE_A, '4')]
+    linha = resultado.set_index('Ocorrência').loc['Valor divergente']
+    assert (linha['Valor XML'], linha['Valor SPED'], linha['Diferença']) == (10.0, 12.5, -2.5)
+    linha = resultado.set_index('Ocorrência').loc['CFOP divergente']
+    assert (linha['CFOP XML'], linha['CFOP SPED']) == ('5405', '5102')
+    resumo = conciliacao.resumir(resultado)
+    assert list(resumo.index) == conciliacao.OCORRENCIAS
+    assert resumo['Valor divergente'] == 1 and resumo['Nota sem XML'] == 0
+
+def test_entradas_espelham_o_cfop_e_ignoram_o_produto(compacto):
+    assert conciliacao.cfop_espelho('5102') == '1102'
+    assert conciliacao.cfop_espelho('6403') == '2403'
+    assert conciliacao.cfop_espelho('7101') == '3101'
+    assert conciliacao.cfop_espelho('1102') == '1102'
+    assert conciliacao.cfop_espelho('0000') == '0000'
+    xml = _df([_item(CHAVE_A, '1', produto='FORN-1', cfop='5102'), _item(CHAVE_A, '2', cfop='6102')], compacto)
+    sped = _df([_item(CHAVE_A, '1', produto='MEU-1', cfop='1102'), _item(CHAVE_A, '2', cfop='1102')], compacto)
+    resultado = conciliacao.conciliar_df(xml, sped, tipo='ENTRADA')
+    assert _ocorrencias(resultado) == [('CFOP divergente', CHAVE_A, '2')]
+    # Nas saídas o mesmo par diverge em produto e CFOP
+    saidas = conciliacao.conciliar_df(xml, sped, tipo='SAIDA')
+    assert conciliacao.resumir(saidas)[['Produto divergente', 'CFOP divergente']].tolist() == [1, 2]
+
+def test_lados_vazios(compacto):
+    xml = _df([_item(CHAVE_A, '1'), _item(CHAVE_A, '2')], compacto)
+    vazio = _df([], compacto)
+    assert _ocorrencias(conciliacao.conciliar_df(xml, vazio)) == [('Nota fora do SPED', CHAVE_A, 'nan')]
+    assert _ocorrencias(conciliacao.conciliar_df(vazio, xml)) == [('Nota sem XML', CHAVE_A, 'nan')]
+    assert conciliacao.conciliar_df(vazio, vazio).empty
+    # SPED sem colunas (nenhum item lido) e sem categorias
+    assert _ocorrencias(conciliacao.conciliar_df(xml, pd.DataFrame())) == [('Nota fora do SPED', CHAVE_A, 'nan')]
+
+def test_blocos_nao_mudam_o_resultado(compacto):
+    xml = _df([_item(CHAVE_A, str(n), valor=float(n)) for n in range(1, 40)], compacto)
+    sped = _df([_item(CHAVE_A, str(n), valor=float(n) + (n % 3 == 0)) for n in range(2, 45)], compacto)
+    inteiro = pd.concat(list(conciliacao.conciliar(xml, sped)), ignore_index=True)
+    blocos = list(conciliacao.conciliar(xml, sped, tamanho_bloco=5))
+    em_blocos = pd.concat(blocos, ignore_index=True)
+    assert len(blocos) > 4
+    assert _ocorrencias(em_blocos) == _ocorrencias(inteiro)
+    assert conciliacao.resumir(em_blocos)[['Item fora do SPED', 'Item sem XML', 'Valor divergente']].tolist() == [1, 5, 13]
@@ -0,0 +1,79 @@
+# Paridade entre a classificação vetorizada (motor.classificar_df) e a
+# classificação item a item (motor.classificar_item), sobre as bases do
+# repositório (regras.bin, tipi.xlsx) e um conjunto pequeno de itens que passa
+# por todos os ramos da cascata: Anexos, Seletivo, NCM desconhecido, SPED
+# perfil B e cada grupo de CFOP, nas saídas e nas entradas.
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+import base_regras
+import motor
+
+ALIQ_IBS, ALIQ_CBS = 0.177, 0.088
+NCMS_EXTRAS = ['22030000', '24022000', '87032100', '0201.10.00', '99999999', 'SEM_DETALHE']
+CFOPS_EXTRAS = ['5102', '6102', '1102', '2102', '1556', '2407', '3551', '0000']
+# (Valor, vICMS, vPIS, vCOFINS): inclui tributo atual maior que o valor (base líquida zerada)
+VALORES = [(100.0, 18.0, 1.65, 7.6), (59.9, 0.0, 0.0, 0.0), (10.0, 12.0, 0.0, 0.0)]
+
+@pytest.fixture(scope='module')
+def bases():
+    base = base_regras.carregar()
+    try: return base.mapa_ncm, base.indice_cclass
+    finally: base.fechar()
+
+def _ncms(mapa):
+    por_anexo = {}
+    for ncm, anexo in mapa.items(): por_anexo.setdefault(anexo, []).append(ncm)
+    return [n for ncms in por_anexo.values() for n in ncms[:3]] + NCMS_EXTRAS
+
+def _cfops():
+    grupos = [motor.CFOPS_BONIFICACAO, motor.CFOPS_AMOSTRA, motor.CFOPS_SUSPENSAO, motor.CFOPS_ZFM, motor.CFOPS_EXPORT]
+    return sorted(set().union(*grupos)) + CFOPS_EXTRAS
+
+def _itens(mapa):
+    itens = []
+    for i, (ncm, cfop, tipo) in enumerate(itertools.product(_ncms(mapa), _cfops(), ['SAIDA', 'ENTRADA'])):
+        valor, icms, pis, cofins = VALORES[i % len(VALORES)]
+        item = dict.fromkeys(motor.CAMPOS_XML, '')
+        item.update({'NCM': ncm, 'CFOP': cfop, 'Tipo': tipo, 'Valor': valor, 'vICMS': icms, 'vPIS': pis,
+                     'vCOFINS': cofins, 'XML_vIBS': 0.0, 'XML_vCBS': 0.0})
+        itens.append(item)
+    return itens
+
+def _por_item(df, mapa, indice_cclass, df_tipi):
+    linhas = [motor.classificar_item(row, mapa, indice_cclass, df_tipi, ALIQ_IBS, ALIQ_CBS) for _, row in df.iterrows()]
+    return pd.DataFrame(linhas, columns=motor.COLUNAS_AUDITORIA, index=df.index)
+
+@pytest.mark.parametrize('compacto', [False, True], ids=['objeto', 'compacto'])
+@pytest.mark.parametrize('com_tipi', [True, False], ids=['tipi', 'sem_tipi'])
+def test_classificar_df_igual_a_classificar_item(bases, compacto, com_tipi):
+    mapa, indice_cclass = bases
+    df_tipi = motor.carregar_tipi(diretorio_cache=None) if com_tipi else motor.IndiceTIPI()
+    itens = _itens(mapa)
+    df = motor.itens_df(itens) if compacto else pd.DataFrame(itens)
+
+    esperado = _por_item(pd.DataFrame(itens), mapa, indice_cclass, df_tipi)
+    obtido = motor.classificar_df(df, mapa, indice_cclass, df_tipi, ALIQ_IBS, ALIQ_CBS)
+
+    assert list(obtido.columns) == motor.COLUNAS_AUDITORIA
+    for col in motor.COLUNAS_CLASSIFICACAO:
+        diferentes = obtido[col].astype(str).to_numpy() != esperado[col].astype(str).to_numpy()
+        assert not diferentes.any(), f"{col}: {df.loc[diferentes, ['NCM', 'CFOP', 'Tipo']].head().to_dict('records')}"
+    for col in ['Carga Atual', 'Carga Projetada', 'vIBS', 'vCBS']:
+        np.testing.assert_allclose(obtido[col].to_numpy(dtype=float), esperado[col].to_numpy(dtype=float),
+                                   rtol=1e-12, atol=1e-9, err_msg=col)
+
+def test_indice_de_dict_alterado_no_mesmo_tamanho():
+    # Mapa passado como dict: trocar um valor ou uma chave sem mudar o tamanho recompila o índice
+    mapa = {'1006': 'ANEXO_I', '2202': 'ANEXO_VII'}
+    assert motor.indice_ncm(mapa).consultar('10063021')[0] == 'ANEXO_I'
+    assert motor.indice_ncm(mapa) is motor.indice_ncm(mapa)
+    mapa['1006'] = 'ANEXO_VII'
+    assert motor.indice_ncm(mapa).consultar('10063021')[0] == 'ANEXO_VII'
+    del mapa['2202']
+    mapa['0401'] = 'ANEXO_I'
+    assert motor.indice_ncm(mapa).consultar('22021000')[0] is None
+    serie = motor.indice_ncm(mapa).consultar_serie(pd.Series(['04011010', None, '10063021']))
+    assert serie['Anexo'].fillna('-').tolist() == ['ANEXO_I', '-', 'ANEXO_VII']
+    assert not serie['Seletivo'].any()
@@ -0,0 +1,38 @@
+# Laudo PDF completo com mais de mil páginas: o total de páginas do rodapé
+# (alias do fpdf) precisa caber no espaço reservado, sem aviso do fpdf.
+import re
+import warnings
+import zlib
+import numpy as np
+import pandas as pd
+import relatorio
+
+def _paginas(pdf):
+    return len(re.findall(rb'/Type /Page\b', pdf))
+
+def _conteudos(pdf):
+    for m in re.finditer(rb'/Length (\d+)[^>]*>>\s*stream\r?\n', pdf):
+        corpo = pdf[m.end():m.end() + int(m.group(1))]
+        try: yield zlib.decompress(corpo)
+        except zlib.error: continue
+
+def test_pdf_completo_com_mais_de_mil_paginas():
+    n = 40000
+    df = pd.DataFrame({'Cód. Produto': 'P1', 'Produto': 'Arroz', 'NCM': '10063021', 'Novo CST': '200',
+                       'cClassTrib': '200003', 'Valor': np.arange(n, dtype=float), 'Carga Projetada': 1.0})
+    with warnings.catch_warnings(record=True) as avisos:
+        warnings.simplefilter('always')
+        pdf = relatorio.gerar_pdf_bytes('Empresa Teste', df, df.head(10), modo='completo')
+    avisos = [str(a.message) for a in avisos if not issubclass(a.category, DeprecationWarning)]
+    assert avisos == []
+    total = _paginas(pdf)
+    assert total > 1000
+    rodapes = [c for c in _conteudos(pdf) if b'Gerado por cClass Auditor AI' in c]
+    assert len(rodapes) == total
+    assert all(f'({total})'.encode() in c for c in rodapes)
+
+def test_pdf_curto_mantem_o_alias_padrao():
+    df = pd.DataFrame({'Produto': ['Arroz'], 'Valor': [10.0], 'Carga Projetada': [1.0]})
+    pdf = relatorio.gerar_pdf_bytes('Empresa Teste', df, df, modo='completo')
+    assert _paginas(pdf) == 2
+    assert all(b'(2)' in c for c in _conteudos(pdf) if b'Gerado por cClass Auditor AI' in c)
@@ -0,0 +1,85 @@
+# Leitura do SPED em lotes (motor.ler_sped_stream) contra a leitura antiga em
+# duas passadas (todos os 0200 primeiro, depois C100/C170): mesmos itens, na
+# mesma ordem, inclusive quando o 0200 de um produto vem depois dos seus C170.
+import pandas as pd
+import pytest
+import motor
+from benchmark import geradores
+
+COLUNAS = ['Chave NFe', 'Num NFe', 'Nº Item', 'Cód. Produto', 'NCM', 'Produto', 'CFOP', 'Valor', 'Tipo']
+
+def _referencia(texto):
+    """A leitura de processar_sped_geral antes do streaming, reduzida às colunas comparadas."""
+    linhas = [l.split('|') for l in texto.split('\n') if l.startswith('|')]
+    produtos = {c[2]: {'NCM': c[8], 'Produto': c[3]} for c in linhas if c[1] == '0200' and len(c) > 8}
+    vendas, compras, nota = [], [], None
+    for c in linhas:
+        if c[1] == 'C100':
+            nota = None
+            if len(c) > 9 and c[6] in ['00', '01', '06']:
+                nota = {'Tipo': 'SAIDA' if c[2] == '1' else 'ENTRADA', 'Num NFe': c[8],
+                        'Chave': c[9] if len(c[9]) == 44 else f"DOC_{c[8]}"}
+        elif nota and c[1] == 'C170' and len(c) > 7:
+            dados = produtos.get(c[3], {'NCM': '', 'Produto': f'Item {c[3]}'})
+            item = {'Chave NFe': nota['Chave'], 'Num NFe': nota['Num NFe'], 'Nº Item': c[2], 'Cód. Produto': c[3],
+                    'NCM': dados['NCM'], 'Produto': dados['Produto'],
+                    'CFOP': c[11] if len(c) > 11 and len(c[11]) == 4 else '0000', 'Valor': motor.to_float(c[7]),
+                    'Tipo': nota['Tipo']}
+            (vendas if nota['Tipo'] == 'SAIDA' else compras).append(item)
+    return pd.DataFrame(vendas, columns=COLUNAS), pd.DataFrame(compras, columns=COLUNAS)
+
+def _stream(caminho, tamanho_lote):
+    lotes = list(motor.ler_sped_stream(caminho, tamanho_lote))
+    vendas = motor.juntar_itens([v for _, v, _ in lotes])
+    compras = motor.juntar_itens([c for _, _, c in lotes])
+    return lotes, vendas, compras
+
+def _comparar(obtido, esperado):
+    obtido = obtido[COLUNAS].astype(object).astype(str).reset_index(drop=True)
+    esperado = esperado.astype(object).astype(str).reset_index(drop=True)
+    pd.testing.assert_frame_equal(obtido, esperado)
+
+def _c100(oper, num, sit='00'):
+    return f"|C100|{oper}|0|PART|55|{sit}|1|{num}|{'3' * 43}{num % 10}|15012026|15012026|100,00|"
+
+def _c170(n, cod, cfop, valor):
+    return f"|C170|{n}|{cod}|DESC|1|UN|{valor}|0|0|000|{cfop}|001|{valor}|18|1,80|"
+
+def _0200(cod, ncm, descr):
+    return f"|0200|{cod}|{descr}|||UN|00|{ncm}||"
+
+def test_0200_depois_do_c170_mantem_a_ordem(tmp_path):
+    linhas = ["|0000|017|0|01012026|31012026|EMPRESA TESTE SA|", _0200('A', '10063021', 'Arroz')]
+    for num in range(1, 13):
+        oper = '1' if num % 3 else '0'
+        linhas.append(_c100(oper, num, sit='02' if num == 5 else '00'))  # nota 5 cancelada: fora
+        linhas += [_c170(1, 'A', '5102', '10,00'), _c170(2, 'B', '5102', '20,50'), _c170(3, 'C', '5405', '3,25')]
+        if num == 7: linhas.append(_0200('B', '22021000', 'Refrigerante'))  # B só é cadastrado no meio do bloco C
+    linhas.append("|9999|0|")  # C nunca é cadastrado
+    texto = '\n'.join(linhas) + '\n'
+    caminho = tmp_path / 'efd.txt'
+    caminho.write_bytes(texto.encode('latin-1'))
+
+    esperado_v, esperado_c = _referencia(texto)
+    for tamanho_lote in (1, 4, 10, 50000):
+        lotes, vendas, compras = _stream(str(caminho), tamanho_lote)
+        _comparar(vendas, esperado_v)
+        _comparar(compras, esperado_c)
+        assert all(nome == 'EMPRESA TESTE SA' for nome, _, _ in lotes)
+    # Lote pequeno: o que vem antes do primeiro B sem 0200 sai antes do fim do arquivo
+    assert len(_stream(str(caminho), 1)[0]) > 1
+    assert set(vendas.loc[vendas['Cód. Produto'] == 'B', 'NCM']) == {'22021000'}
+    assert set(vendas.loc[vendas['Cód. Produto'] == 'C', 'Produto']) == {'Item C'}
+
+@pytest.mark.parametrize('tamanho_lote', [7, 1000])
+def test_stream_igual_a_leitura_antiga(tmp_path, tamanho_lote):
+    caminho = str(tmp_path / 'efd.txt')
+    geradores.gerar_sped(caminho, 3000)
+    with open(caminho, 'rb') as f: texto = f.read().decode('latin-1')
+    esperado_v, esperado_c = _referencia(texto)
+    _, vendas, compras = _stream(caminho, tamanho_lote)
+    _comparar(vendas, esperado_v)
+    _comparar(compras, esperado_c)
+    _, vendas_geral, compras_geral = motor.processar_sped_geral(caminho)
+    _comparar(vendas_geral, esperado_v)
+    _comparar(compras_geral, esperado_c)